@@ -1,5 +1,22 @@
 from django.contrib import admin
-from .models import Player, Score, OTP, Contact, Rating, Review
+from django.contrib.auth.admin import UserAdmin
+from django.contrib.auth.models import User
+from django.db.models import Q
+
+from . import ratings, reviews, search, sessions
+from .models import Player, Score, LeaderboardEntry, DailyBest, OTP, OutboxEmail, Contact, Rating, Review
+
+
+class FullTextSearchMixin:
+    """Answer the changelist search box from Banana.search's FTS5 index where there is one."""
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term.strip() or not search.is_indexed(queryset.model):
+            return super().get_search_results(request, queryset, search_term)
+        return queryset.filter(self.full_text_q(search_term)), False
+
+    def full_text_q(self, search_term):
+        return search.match_q(self.model, search_term)
 
 
 @admin.register(Player)
@@ -16,6 +33,21 @@ class ScoreAdmin(admin.ModelAdmin):
     search_fields = ['user__username']
 
 
+@admin.register(LeaderboardEntry)
+class LeaderboardEntryAdmin(admin.ModelAdmin):
+    list_display = ['user', 'best_score', 'achieved_at']
+    search_fields = ['user__username']
+    list_select_related = ['user']
+
+
+@admin.register(DailyBest)
+class DailyBestAdmin(admin.ModelAdmin):
+    list_display = ['user', 'day', 'best_score', 'achieved_at']
+    list_filter = ['day']
+    search_fields = ['user__username']
+    list_select_related = ['user']
+
+
 @admin.register(OTP)
 class OTPAdmin(admin.ModelAdmin):
     list_display = ['user', 'otp_type', 'contact_info', 'is_used', 'created_at', 'expires_at']
@@ -24,7 +56,7 @@ class OTPAdmin(admin.ModelAdmin):
 
 
 @admin.register(Contact)
-class ContactAdmin(admin.ModelAdmin):
+class ContactAdmin(FullTextSearchMixin, admin.ModelAdmin):
     list_display = ['name', 'email', 'subject', 'is_read', 'created_at']
     list_filter = ['is_read', 'created_at']
     search_fields = ['name', 'email', 'subject', 'message']
@@ -47,13 +79,22 @@ class RatingAdmin(admin.ModelAdmin):
     search_fields = ['user__username']
     readonly_fields = ['created_at', 'updated_at']
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        ratings.apply_change(form.initial.get('rating') if change else None, obj.rating)
+
 
 @admin.register(Review)
-class ReviewAdmin(admin.ModelAdmin):
+class ReviewAdmin(FullTextSearchMixin, admin.ModelAdmin):
     list_display = ['user', 'title', 'rating', 'is_approved', 'created_at']
     list_filter = ['is_approved', 'rating', 'created_at']
     search_fields = ['user__username', 'title', 'content']
     readonly_fields = ['created_at', 'updated_at']
+
+    def full_text_q(self, search_term):
+        # Usernames aren't in the index; an exact one still finds that user's reviews.
+        by_user = Review.objects.filter(user__username=search_term.strip()).values('pk')
+        return super().full_text_q(search_term) | Q(pk__in=by_user)
     
     fieldsets = (
         ('Review Information', {
@@ -68,10 +109,34 @@ class ReviewAdmin(admin.ModelAdmin):
     
     def approve_reviews(self, request, queryset):
         queryset.update(is_approved=True)
+        reviews.invalidate_approved_count()
         self.message_user(request, f"{queryset.count()} review(s) approved.")
     approve_reviews.short_description = "Approve selected reviews"
     
     def disapprove_reviews(self, request, queryset):
         queryset.update(is_approved=False)
+        reviews.invalidate_approved_count()
         self.message_user(request, f"{queryset.count()} review(s) disapproved.")
     disapprove_reviews.short_description = "Disapprove selected reviews"
+
+
+@admin.register(OutboxEmail)
+class OutboxEmailAdmin(admin.ModelAdmin):
+    list_display = ['subject', 'to', 'priority', 'secret', 'status', 'attempts', 'next_attempt_at', 'sent_at']
+    list_filter = ['status', 'priority']
+    search_fields = ['subject', 'to']
+    readonly_fields = ['created_at', 'sent_at', 'last_error']
+
+
+@admin.action(description="Revoke all sessions of the selected users")
+def revoke_sessions(modeladmin, request, queryset):
+    revoked = sessions.revoke_all_sessions(queryset.values_list('pk', flat=True))
+    modeladmin.message_user(request, f"Revoked {revoked} sessions.")
+
+
+admin.site.unregister(User)
+
+
+@admin.register(User)
+class BananaUserAdmin(UserAdmin):
+    actions = [revoke_sessions]
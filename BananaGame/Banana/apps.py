@@ -1,6 +1,16 @@
 from django.apps import AppConfig
+from django.core import checks
 
 
 class BananaConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'Banana'
+
+    def ready(self):
+        # Registers the signal handlers that invalidate cached users and the
+        # approved-review count, and keep the rating summary in step with deletes.
+        from . import authentication, ratings, reviews  # noqa: F401
+        from . import certificates
+
+        # Builds the certificate templates at startup and warns if one falls back to ReportLab.
+        checks.register(certificates.check_templates)
@@ -0,0 +1,176 @@
+"""
+JWT authentication with a short-lived cache of the user and their Player.
+
+simplejwt's ``JWTAuthentication`` loads the ``User`` row on every request,
+and most views then ran ``Player.objects.get_or_create`` as well.
+``CachedJWTAuthentication`` caches the Player's fields and a few of the
+User's (``USER_FIELDS``; never the password hash, only the MD5 of it that
+simplejwt's revoke claim carries anyway) under the user id for
+``AUTH_USER_CACHE['TIMEOUT']`` seconds, loading both with one joined query
+on a miss. It rebuilds the instances from them and attaches the player to
+``request.user`` so ``get_player`` returns it without a query. Saving or
+deleting a User or Player drops the entry, and so does scoring's queryset
+``update``.
+
+Staleness: with a per-process cache (locmem, the default) another worker's
+changes can't drop this worker's entry, so ``is_active`` and the password
+(for ``CHECK_REVOKE_TOKEN``) are re-read from the database on every request,
+one primary key lookup, and only the profile fields and the player may be
+up to ``TIMEOUT`` seconds old. With a shared cache every ``save()`` or
+``delete()`` is seen on the next request and no query is made; a bare
+queryset ``update()`` of a User stays invisible for up to ``TIMEOUT``
+seconds. ``AUTH_USER_CACHE['CHECK_STATE']`` forces the per-request check on
+(True) or off (False). Views that read a player field and write back
+something derived from it pass ``fresh=True`` to re-read the row first.
+"""
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import router
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from .models import Player
+
+DEFAULT_USER_CACHE_SETTINGS = {
+    'ALIAS': 'default',
+    'TIMEOUT': 60,
+    # None: check is_active and the password against the database only when the cache is per process
+    'CHECK_STATE': None,
+}
+
+# What views read from request.user; anything else is loaded on first access.
+USER_FIELDS = ('id', 'username', 'email', 'first_name', 'last_name', 'is_active', 'is_staff', 'is_superuser')
+
+
+def get_user_cache_settings():
+    return {**DEFAULT_USER_CACHE_SETTINGS, **getattr(settings, 'AUTH_USER_CACHE', {})}
+
+
+def _cache():
+    return caches[get_user_cache_settings()['ALIAS']]
+
+
+def _key(user_id):
+    return f'auth:user:{user_id}'
+
+
+def invalidate_user(user_id):
+    _cache().delete(_key(user_id))
+
+
+def _player_is_cached(user):
+    return get_user_model().player.related.is_cached(user)
+
+
+def get_player(request, fresh=False):
+    """
+    The authenticated user's Player, created if missing. ``fresh`` re-reads
+    a player attached by CachedJWTAuthentication from the database.
+    """
+    user = request.user
+    if _player_is_cached(user):
+        player = user.player
+        if fresh:
+            player.refresh_from_db()
+        return player
+    player, _ = Player.objects.get_or_create(user=user)
+    get_user_model().player.related.set_cached_value(user, player)
+    return player
+
+
+def _fields(instance, names=None):
+    # In concrete field order, which Model.from_db expects for a partial row.
+    return {
+        field.attname: getattr(instance, field.attname)
+        for field in instance._meta.concrete_fields
+        if names is None or field.attname in names
+    }
+
+
+def _revoke_hash(password):
+    return get_md5_hash_password(password)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    def _load(self, user_id):
+        """The cache entry for ``user_id``: plain field values, no model instances."""
+        user = (
+            self.user_model.objects
+            .select_related('player')
+            .get(**{api_settings.USER_ID_FIELD: user_id})
+        )
+        try:
+            player = user.player
+        except Player.DoesNotExist:
+            player = Player.objects.get_or_create(user=user)[0]
+        return {
+            'user': _fields(user, USER_FIELDS),
+            'player': _fields(player),
+            'revoke': _revoke_hash(user.password),
+        }
+
+    def _build(self, entry):
+        db = router.db_for_read(self.user_model)
+        user = self.user_model.from_db(db, list(entry['user']), list(entry['user'].values()))
+        player = Player.from_db(db, list(entry['player']), list(entry['player'].values()))
+        self.user_model.player.related.set_cached_value(user, player)
+        Player.user.field.set_cached_value(player, user)
+        return user
+
+    def _check_state(self, cache):
+        check = get_user_cache_settings()['CHECK_STATE']
+        return isinstance(cache, LocMemCache) if check is None else check
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as e:
+            raise InvalidToken(_("Token contained no recognizable user identification")) from e
+
+        cache = _cache()
+        entry = cache.get(_key(user_id))
+        loaded = entry is None
+        if loaded:
+            try:
+                entry = self._load(user_id)
+            except self.user_model.DoesNotExist as e:
+                raise AuthenticationFailed(_("User not found"), code="user_not_found") from e
+            cache.set(_key(user_id), entry, timeout=get_user_cache_settings()['TIMEOUT'])
+        user = self._build(entry)
+        is_active, revoke = user.is_active, entry['revoke']
+
+        if not loaded and self._check_state(cache):
+            state = list(
+                self.user_model.objects
+                .filter(**{api_settings.USER_ID_FIELD: user_id})
+                .values_list('is_active', 'password')[:1]
+            )
+            if not state:
+                raise AuthenticationFailed(_("User not found"), code="user_not_found")
+            is_active, revoke = state[0][0], _revoke_hash(state[0][1])
+            user.is_active = is_active
+
+        # The same checks as JWTAuthentication, against the cached or re-read state.
+        if api_settings.CHECK_USER_IS_ACTIVE and not is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != revoke:
+                raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+        return user
+
+
+@receiver([post_save, post_delete], sender=settings.AUTH_USER_MODEL)
+def _user_changed(sender, instance, **kwargs):
+    invalidate_user(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=Player)
+def _player_changed(sender, instance, **kwargs):
+    invalidate_user(instance.user_id)
@@ -0,0 +1,1159 @@
+"""
+Benchmark scenarios, run with ``python manage.py bench <scenario> [-p key=value ...]``.
+
+Scenarios that need the database run against a throwaway test database
+(in-memory for SQLite), never against db.sqlite3. Each scenario returns a
+list of result rows that the command prints as a table.
+"""
+import asyncio
+import random
+import statistics
+import tempfile
+import time
+
+SCENARIOS = {}
+
+
+def scenario(name, uses_db=False):
+    def register(func):
+        SCENARIOS[name] = (func, uses_db)
+        return func
+    return register
+
+
+def measure(func, iterations):
+    """Call ``func`` ``iterations`` times and return the per-call latencies in seconds."""
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def summarize(label, latencies, **extra):
+    latencies = sorted(latencies)
+    total = sum(latencies)
+    row = {
+        "case": label,
+        "n": len(latencies),
+        "ops/sec": round(len(latencies) / total, 1) if total else None,
+        "p50 ms": round(statistics.median(latencies) * 1000, 3),
+        "p99 ms": round(latencies[min(len(latencies) - 1, int(0.99 * len(latencies)))] * 1000, 3),
+    }
+    row.update(extra)
+    return row
+
+
+@scenario('puzzles')
+def bench_puzzles(iterations=200, upstream_samples=20):
+    """Local puzzle generation (render + content-addressed store) versus upstream fetches."""
+    from . import puzzlegen, upstream
+
+    rows = []
+    with tempfile.TemporaryDirectory() as root:
+        store = puzzlegen.PuzzleImageStore(root, 'http://localhost/media/puzzles/')
+        source = puzzlegen.LocalPuzzleSource(store, f'{root}/missing.jsonl')
+        rows.append(summarize('local render + store', measure(source, iterations)))
+
+        corpus_source = puzzlegen.LocalPuzzleSource(store, f'{root}/corpus.jsonl')
+        puzzlegen.append_manifest(corpus_source.manifest_path, [
+            puzzlegen.generate_into_store(random.getrandbits(64), root, store.base_url) for _ in range(50)
+        ])
+        rows.append(summarize('local pre-generated corpus', measure(corpus_source, iterations)))
+
+    if upstream_samples:
+        client = upstream.get_client()
+        try:
+            rows.append(summarize('upstream API fetch', measure(client.fetch_puzzle, upstream_samples)))
+        except upstream.PuzzleFetchError as exc:
+            rows.append({"case": "upstream API fetch", "error": str(exc)})
+    return rows
+
+
+def _local_puzzle_settings(root):
+    from . import puzzlegen
+
+    store = puzzlegen.PuzzleImageStore(f'{root}/puzzles', 'http://localhost/media/puzzles/')
+    puzzlegen.append_manifest(f'{root}/corpus.jsonl', [
+        puzzlegen.generate_into_store(seed, store.root, store.base_url) for seed in range(20)
+    ])
+    return {
+        'PUZZLE_SOURCE': 'local',
+        'PUZZLE_STORE_DIR': store.root,
+        'PUZZLE_STORE_URL': store.base_url,
+        'PUZZLE_CORPUS_MANIFEST': f'{root}/corpus.jsonl',
+        'PUZZLE_POOL': {'ENABLED': False},
+    }
+
+
+def _count_writes(queries):
+    return sum(1 for q in queries if q['sql'].split(' ', 1)[0] in ('INSERT', 'UPDATE', 'DELETE'))
+
+
+@scenario('puzzle_state', uses_db=True)
+def bench_puzzle_state(solves=300):
+    """DB writes and latency per solved puzzle: Player.current_puzzle versus signed puzzle tokens."""
+    from django.contrib.auth.models import User
+    from django.db import connection
+    from django.test import override_settings
+    from django.test.utils import CaptureQueriesContext
+    from rest_framework.test import APIClient
+
+    from . import puzzle_tokens
+    from .models import Player
+
+    rows = []
+    with tempfile.TemporaryDirectory() as root:
+        base_settings = _local_puzzle_settings(root)
+        for mode in ('db', 'token'):
+            user = User.objects.create_user(username=f'bench-{mode}', password='bench-password')
+            client = APIClient()
+            client.force_authenticate(user)
+            latencies, queries = [], []
+            with override_settings(PUZZLE_STATE_MODE=mode, **base_settings):
+                for _ in range(solves):
+                    with CaptureQueriesContext(connection) as fetch_ctx:
+                        start = time.perf_counter()
+                        puzzle = client.get('/banana/puzzle/').json()
+                        fetch_time = time.perf_counter() - start
+                    if mode == 'token':
+                        claims = puzzle_tokens.load(puzzle['puzzle_token'], user.id)
+                        answer = {'answer': puzzle_tokens.recover_solution(claims),
+                                  'puzzle_token': puzzle['puzzle_token']}
+                    else:
+                        answer = {'answer': Player.objects.get(user=user).current_puzzle['solution']}
+                    with CaptureQueriesContext(connection) as check_ctx:
+                        start = time.perf_counter()
+                        client.post('/banana/check-puzzle/', answer, format='json')
+                        latencies.append(fetch_time + time.perf_counter() - start)
+                    queries.extend(fetch_ctx.captured_queries + check_ctx.captured_queries)
+            rows.append(summarize(f'{mode} mode', latencies,
+                                  **{"queries/solve": round(len(queries) / solves, 2),
+                                     "writes/solve": round(_count_writes(queries) / solves, 2)}))
+    return rows
+
+
+@scenario('scoring', uses_db=True)
+def bench_scoring(solves=500):
+    """Columns and bytes written per solve: whole-row Player.save() versus the F() expression UPDATE."""
+    from django.contrib.auth.models import User
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    from . import scoring
+    from .models import Player
+
+    url = 'https://www.sanfoh.com/uob/banana/data/t{:08x}.png'
+    player = Player.objects.create(
+        user=User.objects.create_user(username='bench-scoring'),
+        puzzle_history=[url.format(i) for i in range(scoring.HISTORY_LIMIT)],
+        achievements=['first_solve', 'combo_5', 'perfect_10'],
+    )
+    puzzle_ids = (url.format(i) for i in range(scoring.HISTORY_LIMIT, 10 ** 9))
+
+    def full_save():
+        snapshot = Player.objects.get(pk=player.pk)
+        result = scoring.score_solve(snapshot.combo_count, snapshot.difficulty)
+        snapshot.xp += result.xp_gained
+        snapshot.level = scoring.level_for_xp(snapshot.xp)
+        snapshot.combo_count += 1
+        snapshot.max_combo = max(snapshot.max_combo, snapshot.combo_count)
+        snapshot.puzzles_solved += 1
+        snapshot.perfect_solves += 1
+        snapshot.puzzle_history = (snapshot.puzzle_history + [next(puzzle_ids)])[-scoring.HISTORY_LIMIT:]
+        snapshot.save()
+
+    def field_update():
+        snapshot = Player.objects.get(pk=player.pk)
+        result = scoring.score_solve(snapshot.combo_count, snapshot.difficulty)
+        scoring.apply_solve(snapshot, result, next(puzzle_ids))
+
+    rows = []
+    for label, func in (('Player.save()', full_save), ('scoring.apply_solve', field_update)):
+        with CaptureQueriesContext(connection) as ctx:
+            latencies = measure(func, solves)
+        writes = [q['sql'] for q in ctx.captured_queries if q['sql'].startswith('UPDATE')]
+        columns = writes[-1].split(' SET ', 1)[1].split(' WHERE ', 1)[0].count('" = ')
+        rows.append(summarize(label, latencies, **{
+            "rows/solve": round(len(writes) / solves, 2),
+            "columns/solve": columns,
+            "sql bytes/solve": round(sum(len(sql) for sql in writes) / solves),
+        }))
+    return rows
+
+
+def _seed_scores(users, scores, prefix='bench'):
+    """Bulk-insert ``users`` users and ``scores`` Score rows spread randomly across them."""
+    from django.contrib.auth.models import User
+    from django.utils import timezone
+
+    from .models import Score
+
+    User.objects.bulk_create(
+        [User(username=f'{prefix}-{i}', password='!') for i in range(users)], batch_size=5000
+    )
+    user_ids = list(User.objects.filter(username__startswith=f'{prefix}-').values_list('id', flat=True))
+    now = timezone.now()
+    rng = random.Random(1)
+    batch = []
+    for i in range(scores):
+        batch.append(Score(user_id=rng.choice(user_ids), score=rng.randint(0, 100000), date=now))
+        if len(batch) == 20000:
+            Score.objects.bulk_create(batch)
+            batch = []
+    Score.objects.bulk_create(batch)
+    return user_ids
+
+
+@scenario('leaderboard', uses_db=True)
+def bench_leaderboard(scores=1_000_000, users=20_000, iterations=20):
+    """Top-10 query over raw Score (GROUP BY) versus the materialized LeaderboardEntry table."""
+    from django.db.models import Max
+
+    from . import leaderboard
+    from .models import Score
+
+    start = time.perf_counter()
+    _seed_scores(users, scores)
+    seeded = time.perf_counter() - start
+
+    start = time.perf_counter()
+    leaderboard.backfill(chunk_size=2000)
+    backfilled = time.perf_counter() - start
+
+    def aggregate_top10():
+        list(Score.objects.values('user__username').annotate(highest_score=Max('score'))
+             .order_by('-highest_score')[:10])
+
+    return [
+        {"case": f"seed {scores} scores / {users} users", "seconds": round(seeded, 2)},
+        {"case": "backfill LeaderboardEntry", "seconds": round(backfilled, 2)},
+        summarize('Score GROUP BY top 10', measure(aggregate_top10, iterations)),
+        summarize('LeaderboardEntry top 10', measure(lambda: leaderboard.top_entries(10), iterations)),
+    ]
+
+
+@scenario('ranking')
+def bench_ranking(players=100_000, iterations=5000):
+    """In-memory rank index: build, score updates, rank-of-user, top-10 and around-me at N players."""
+    from datetime import datetime, timedelta, timezone
+
+    from .ranking import RankedLeaderboard
+
+    rng = random.Random(3)
+    epoch = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    rows = [(i, f'player{i}', rng.randint(0, 100000), epoch + timedelta(seconds=i)) for i in range(players)]
+
+    board = RankedLeaderboard()
+    start = time.perf_counter()
+    board.load(rows)
+    built = time.perf_counter() - start
+
+    def update():
+        user_id = rng.randrange(players)
+        board.update(user_id, f'player{user_id}', rng.randint(0, 110000), epoch)
+
+    return [
+        {"case": f"load {players} players", "seconds": round(built, 3)},
+        summarize('update best score', measure(update, iterations)),
+        summarize('rank_of', measure(lambda: board.rank_of(rng.randrange(players)), iterations)),
+        summarize('top 10', measure(lambda: board.top(10), iterations)),
+        summarize('around me (+/-5)', measure(lambda: board.around(rng.randrange(players), 5), iterations)),
+    ]
+
+
+@scenario('leaderboard_http', uses_db=True)
+def bench_leaderboard_http(users=20_000, scores=200_000, requests=2000):
+    """Requests/sec for GET /leaderboard/: uncached, cached, and conditional (304) polling."""
+    from django.test import Client, override_settings
+
+    from . import leaderboard, leaderboard_cache
+
+    _seed_scores(users, scores)
+    leaderboard.backfill(chunk_size=2000)
+    client = Client()
+
+    rows = []
+    with override_settings(LEADERBOARD_CACHE={'ENABLED': False}):
+        rows.append(summarize('no cache', measure(lambda: client.get('/banana/leaderboard/'), requests)))
+
+    leaderboard_cache.stats.reset()
+    rows.append(summarize('cache', measure(lambda: client.get('/banana/leaderboard/'), requests),
+                          hit_rate=leaderboard_cache.stats.snapshot()['hit_rate']))
+
+    tag = client.get('/banana/leaderboard/')['ETag']
+    rows.append(summarize('If-None-Match (304)', measure(
+        lambda: client.get('/banana/leaderboard/', HTTP_IF_NONE_MATCH=tag), requests)))
+    return rows
+
+
+class _StreamClient:
+    """Minimal ASGI client that holds one /leaderboard/stream/ connection open."""
+
+    def __init__(self, on_event):
+        self.on_event = on_event
+        self.requested = False
+        self.closed = asyncio.Event()
+
+    async def receive(self):
+        if not self.requested:
+            self.requested = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await self.closed.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(self, message):
+        if message['type'] == 'http.response.body' and message.get('body', b'').startswith(b'event: '):
+            self.on_event(message['body'])
+
+
+@scenario('leaderboard_stream', uses_db=True)
+def bench_leaderboard_stream(clients=2000, rounds=20):
+    """Fan-out latency and memory per connection for N simulated /leaderboard/stream/ clients over ASGI."""
+    import threading
+    import tracemalloc
+
+    from django.core.asgi import get_asgi_application
+
+    from . import realtime
+
+    application = get_asgi_application()
+    realtime.reset_stream()
+    broadcaster = realtime.get_broadcaster()
+    board = [{'username': f'player{i}', 'score': 1000 - i} for i in range(10)]
+    broadcaster.fetch = lambda window: list(board)
+    # Prime the broadcaster so connecting clients get their snapshot from memory.
+    broadcaster.flush({'all'})
+
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+        'scheme': 'http', 'path': '/banana/leaderboard/stream/', 'raw_path': b'/banana/leaderboard/stream/',
+        'root_path': '', 'query_string': b'window=all', 'headers': [(b'host', b'testserver')],
+        'client': ('127.0.0.1', 50000), 'server': ('testserver', 80),
+    }
+
+    async def run():
+        received = []
+        arrived = asyncio.Event()
+
+        def on_event(body):
+            received.append(time.perf_counter())
+            if len(received) == clients:
+                arrived.set()
+
+        connections = [_StreamClient(on_event) for _ in range(clients)]
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        tasks = [asyncio.create_task(application(dict(scope), c.receive, c.send)) for c in connections]
+        await arrived.wait()
+        connected = time.perf_counter() - start
+        per_connection = (tracemalloc.get_traced_memory()[0] - before) / clients
+        tracemalloc.stop()
+
+        latencies = []
+        for round_number in range(rounds):
+            received.clear()
+            arrived.clear()
+            board.insert(0, board.pop())
+            board[0] = {**board[0], 'score': board[1]['score'] + round_number + 1}
+            published = time.perf_counter()
+            threading.Thread(target=broadcaster.flush, args=({'all'},)).start()
+            await arrived.wait()
+            latencies.extend(at - published for at in received)
+
+        for connection_ in connections:
+            connection_.closed.set()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return connected, per_connection, latencies
+
+    try:
+        connected, per_connection, latencies = asyncio.run(run())
+    finally:
+        realtime.reset_stream()
+    return [
+        {"case": f"connect {clients} clients", "seconds": round(connected, 2),
+         "KiB/connection": round(per_connection / 1024, 2)},
+        summarize(f'delta fan-out to {clients}', latencies),
+    ]
+
+
+@scenario('indexes', uses_db=True)
+def bench_indexes(scores=1_000_000, users=20_000, otps=200_000, reviews=100_000, iterations=50):
+    """Hot OTP/Review queries with and without their composite indexes (next to ``scores`` Score rows)."""
+    from datetime import timedelta
+
+    from django.db import connection
+    from django.utils import timezone
+
+    from .models import OTP, Review
+
+    user_ids = _seed_scores(users, scores)
+    now = timezone.now()
+    rng = random.Random(5)
+    OTP.objects.bulk_create([
+        OTP(user_id=rng.choice(user_ids), otp_code='123456', otp_type=OTP.EMAIL, contact_info='bench@example.com',
+            expires_at=now + timedelta(minutes=rng.randint(-600, 10)), is_used=rng.random() < 0.9)
+        for _ in range(otps)
+    ], batch_size=5000)
+    Review.objects.bulk_create([
+        Review(user_id=rng.choice(user_ids), title='Bench', content='Bench review', is_approved=rng.random() < 0.3)
+        for _ in range(reviews)
+    ], batch_size=5000)
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+
+    def user():
+        return rng.choice(user_ids)
+
+    queries = {
+        'verify_otp lookup': lambda: OTP.objects.filter(
+            user_id=user(), otp_type=OTP.EMAIL, is_used=False, expires_at__gt=timezone.now()).first(),
+        'approved reviews (first 20)': lambda: list(Review.objects.filter(is_approved=True)[:20]),
+        'user reviews': lambda: list(Review.objects.filter(user_id=user())),
+    }
+    indexed = {label: measure(func, iterations) for label, func in queries.items()}
+
+    with connection.schema_editor() as editor:
+        for model in (OTP, Review):
+            for index in model._meta.indexes:
+                editor.remove_index(model, index)
+    unindexed = {label: measure(func, iterations) for label, func in queries.items()}
+
+    rows = [{"case": f"seed {scores} scores, {otps} OTPs, {reviews} reviews"}]
+    for label in queries:
+        row = summarize(label, indexed[label])
+        row["p50 ms unindexed"] = summarize(label, unindexed[label])["p50 ms"]
+        rows.append(row)
+    return rows
+
+
+def _allocated_per_call(func, iterations):
+    """Average tracemalloc peak (bytes) over ``iterations`` calls of ``func``."""
+    import tracemalloc
+
+    tracemalloc.start()
+    peaks = []
+    for _ in range(iterations):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        func()
+        peaks.append(tracemalloc.get_traced_memory()[1] - before)
+    tracemalloc.stop()
+    return round(sum(peaks) / len(peaks))
+
+
+@scenario('certificates', uses_db=True)
+def bench_certificates(iterations=200):
+    """GET /certificate/: full ReportLab render per request versus the on-disk certificate store."""
+    from django.contrib.auth.models import User
+    from django.test import override_settings
+    from django.utils import timezone
+    from rest_framework.test import APIClient
+
+    from . import certificates, leaderboard, ranking
+
+    user = User.objects.create_user(username='bench-winner')
+    leaderboard.record_score(user, 1234, timezone.now())
+    ranking.reset_ranking()
+    client = APIClient()
+    client.force_authenticate(user)
+
+    def download():
+        response = client.get('/banana/certificate/')
+        b''.join(response.streaming_content) if response.streaming else response.content
+
+    rows = []
+    with tempfile.TemporaryDirectory() as root:
+        for label, conf in (('render every request', {'ENABLED': False}), ('certificate store', {'DIR': root})):
+            with override_settings(CERTIFICATE_CACHE=conf):
+                download()
+                rows.append(summarize(label, measure(download, iterations),
+                                      **{"bytes allocated/request": _allocated_per_call(download, 20)}))
+                certificates.reset_store()
+    ranking.reset_ranking()
+    return rows
+
+
+@scenario('certificate_burst')
+def bench_certificate_burst(requests=300, threads=16, workers=4):
+    """A burst of distinct certificate renders: inline ReportLab vs template overlay vs process pool."""
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+    from datetime import date
+
+    from django.test import override_settings
+
+    from . import certificates
+
+    day = date.today()
+
+    def burst(label, render):
+        # Stands in for the other API requests a worker is serving during the burst.
+        probe_latencies, stop = [], threading.Event()
+
+        def probe():
+            while not stop.is_set():
+                # Wake-up plus a little work: waiting for the GIL shows up here.
+                start = time.perf_counter()
+                time.sleep(0.002)
+                sum(range(10000))
+                probe_latencies.append(time.perf_counter() - start - 0.002)
+
+        def timed(index):
+            start = time.perf_counter()
+            render(f'player{index}', index % 3 + 1, 1000 + index, day)
+            return time.perf_counter() - start
+
+        prober = threading.Thread(target=probe)
+        prober.start()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(threads) as pool:
+            latencies = list(pool.map(timed, range(requests)))
+        elapsed = time.perf_counter() - start
+        stop.set()
+        prober.join()
+        probe = summarize('probe', probe_latencies)
+        return summarize(label, latencies, **{
+            "renders/sec": round(requests / elapsed, 1),
+            "probe p50 ms": probe["p50 ms"],
+            "probe p99 ms": probe["p99 ms"],
+        })
+
+    rows = [
+        burst('inline ReportLab (old)', certificates.render_certificate_reportlab),
+        burst('inline template overlay', certificates.render_certificate),
+    ]
+    with override_settings(CERTIFICATE_RENDERER={'BACKEND': 'process', 'WORKERS': workers}):
+        # Start the workers and build their templates before timing.
+        list(certificates.get_executor().map(certificates.render_certificate,
+                                             ['warmup'] * workers * 3, [1, 2, 3] * workers,
+                                             [0] * workers * 3, [day] * workers * 3))
+        rows.append(burst(f'process pool ({workers}) overlay', certificates.render))
+    return rows
+
+
+@scenario('certificate_prerender', uses_db=True)
+def bench_certificate_prerender(players=50, rounds=5):
+    """Top-3 certificate downloads right after scores settle, with and without background pre-rendering."""
+    from django.contrib.auth.models import User
+    from django.test import override_settings
+    from rest_framework.test import APIClient
+
+    from . import certificates, jobs, ranking
+
+    users = [User.objects.create_user(username=f'bench-finalist-{i}') for i in range(players)]
+    ranking.reset_ranking()
+    client = APIClient()
+    rng = random.Random(9)
+
+    rows = []
+    with tempfile.TemporaryDirectory() as root:
+        for label, prerender in (('render on download', False), ('pre-rendered', True)):
+            with override_settings(CERTIFICATE_CACHE={'DIR': f'{root}/{label}', 'PRERENDER': prerender},
+                                   JOB_RUNNER='thread'):
+                latencies = []
+                for _ in range(rounds):
+                    # A tournament round: everyone submits, then the top 3 download at once.
+                    for user in rng.sample(users, len(users)):
+                        client.force_authenticate(user)
+                        client.post('/banana/submit-score/', {'score': rng.randint(0, 10 ** 6)}, format='json')
+                    jobs.get_runner().join()
+                    for entry in ranking.get_ranking().top(3):
+                        client.force_authenticate(User.objects.get(username=entry['username']))
+                        latencies.extend(measure(lambda: client.get('/banana/certificate/'), 1))
+                stats = certificates.get_store().stats()
+                rows.append(summarize(label, latencies, **{
+                    "prerendered": stats['prerendered'],
+                    "prerender hit rate": stats['prerender_hit_rate'],
+                }))
+    ranking.reset_ranking()
+    return rows
+
+
+class _SMTPStub:
+    """
+    Minimal local SMTP server that accepts and discards mail. ``handshake``
+    seconds are spent before the greeting to stand in for the TCP + TLS setup
+    that every new connection to a real relay pays.
+    """
+
+    def __init__(self, handshake=0.03):
+        import socketserver
+
+        stub = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def reply(self, line):
+                self.wfile.write(line.encode() + b'\r\n')
+
+            def handle(self):
+                time.sleep(stub.handshake)
+                stub.connections += 1
+                self.reply('220 stub ESMTP')
+                while True:
+                    line = self.rfile.readline()
+                    if not line:
+                        return
+                    command = line[:4].upper()
+                    if command == b'EHLO':
+                        self.reply('250 stub')
+                    elif command == b'DATA':
+                        self.reply('354 go ahead')
+                        while self.rfile.readline() not in (b'.\r\n', b''):
+                            pass
+                        stub.messages += 1
+                        self.reply('250 queued')
+                    elif command == b'QUIT':
+                        self.reply('221 bye')
+                        return
+                    else:
+                        self.reply('250 ok')
+
+        self.handshake = handshake
+        self.connections = 0
+        self.messages = 0
+        self.server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+
+    def __enter__(self):
+        import threading
+
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@scenario('outbox', uses_db=True)
+def bench_outbox(emails=300, handshake_ms=30, batch_size=50):
+    """Emails/sec through a local SMTP stub: send_mail per email in the request vs the batched outbox."""
+    from django.core.mail import send_mail
+    from django.db import transaction
+    from django.test import override_settings
+
+    from . import outbox
+
+    rows = []
+    with _SMTPStub(handshake_ms / 1000) as stub, override_settings(
+        EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend', EMAIL_HOST='127.0.0.1', EMAIL_PORT=stub.port,
+        EMAIL_USE_TLS=False, EMAIL_HOST_USER='', EMAIL_HOST_PASSWORD='', JOB_RUNNER='immediate',
+        EMAIL_OUTBOX={'BATCH_SIZE': batch_size},
+    ):
+        addresses = iter(range(emails * 2))
+
+        def direct():
+            send_mail('Your OTP', 'Your OTP is 123456', 'bench@example.com', [f'u{next(addresses)}@example.com'])
+
+        latencies = measure(direct, emails)
+        rows.append(summarize('send_mail in request (old)', latencies, **{
+            "emails/sec": round(emails / sum(latencies), 1), "connections": stub.connections,
+        }))
+
+        # Request side: the view only inserts a row. Everything is queued in one
+        # transaction, so the drains submitted on commit find the whole backlog.
+        stub.connections = 0
+        with transaction.atomic():
+            enqueue = measure(lambda: outbox.send('Your OTP', 'Your OTP is 123456',
+                                                  [f'u{next(addresses)}@example.com']), emails)
+            # Worker side: leaving the block commits, and the immediate runner
+            # then drains the backlog in batches, one connection each.
+            start = time.perf_counter()
+        elapsed = time.perf_counter() - start
+        rows.append(summarize('outbox.send in request', enqueue))
+        sent = outbox.stats()['sent']
+        rows.append({
+            "case": f'outbox drain (batches of {batch_size})', "n": sent,
+            "emails/sec": round(sent / elapsed, 1), "connections": stub.connections,
+        })
+    return rows
+
+
+@scenario('otp', uses_db=True)
+def bench_otp(users=2000, iterations=2000):
+    """OTP issue and verify throughput: OTP table rows vs hashed codes in the cache."""
+    from django.contrib.auth.models import User
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    from . import otp
+    from .models import OTP
+
+    players = User.objects.bulk_create([User(username=f'bench-otp-{i}') for i in range(users)])
+    rng = random.Random(5)
+    rows = []
+    for label, backend in (('db (old)', otp.DatabaseOTPBackend(600)), ('cache', otp.CacheOTPBackend(600))):
+        issued = []
+
+        def issue():
+            user = rng.choice(players)
+            issued.append((user, backend.issue(user, OTP.EMAIL, 'bench@example.com')))
+
+        with CaptureQueriesContext(connection) as queries:
+            issue_latencies = measure(issue, iterations)
+        rows.append(summarize(f'{label} issue', issue_latencies, **{
+            "queries/op": round(len(queries) / iterations, 2),
+        }))
+
+        pending = iter(issued)
+
+        def verify():
+            user, code = next(pending)
+            backend.verify(user, code, OTP.EMAIL)
+
+        with CaptureQueriesContext(connection) as queries:
+            verify_latencies = measure(verify, iterations)
+        rows.append(summarize(f'{label} verify', verify_latencies, **{
+            "queries/op": round(len(queries) / iterations, 2),
+        }))
+    rows.append({"case": 'OTP rows left behind', "n": OTP.objects.count()})
+    return rows
+
+
+def _seed_auth_rows(otps, tokens, expired_ratio, now):
+    """Bulk-insert OTP rows and outstanding (every 4th blacklisted) tokens, ``expired_ratio`` of them expired."""
+    import datetime
+
+    from django.contrib.auth.models import User
+    from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+
+    from .models import OTP
+
+    user = User.objects.create(username=f'bench-purge-{now.timestamp()}')
+    rng = random.Random(2)
+
+    def expires():
+        return now + datetime.timedelta(hours=-1 if rng.random() < expired_ratio else 1)
+
+    for start in range(0, otps, 20000):
+        OTP.objects.bulk_create([
+            OTP(user=user, otp_code='123456', otp_type=OTP.EMAIL, contact_info='x@example.com', expires_at=expires())
+            for _ in range(start, min(start + 20000, otps))
+        ])
+    for start in range(0, tokens, 20000):
+        created = OutstandingToken.objects.bulk_create([
+            OutstandingToken(user=user, jti=f'{now.timestamp()}-{i}', token='t', expires_at=expires())
+            for i in range(start, min(start + 20000, tokens))
+        ])
+        BlacklistedToken.objects.bulk_create([BlacklistedToken(token=token) for token in created[::4]])
+
+
+@scenario('auth_purge', uses_db=True)
+def bench_auth_purge(otps=2_000_000, tokens=1_000_000, expired_ratio=0.9, chunk_size=1000):
+    """Purging expired OTP/token rows: one DELETE per table vs bounded pk-range chunks."""
+    from django.db import transaction
+    from django.utils import timezone
+
+    from . import purge
+
+    rows = []
+    for label in ('single DELETE per table (naive)', f'pk-range chunks of {chunk_size}'):
+        now = timezone.now()
+        _seed_auth_rows(otps, tokens, expired_ratio, now)
+        transactions = []
+        last = [time.perf_counter()]
+
+        def progress(*args):
+            current = time.perf_counter()
+            transactions.append(current - last[0])
+            last[0] = current
+
+        start = time.perf_counter()
+        if label.startswith('single'):
+            deleted = 0
+            for _, queryset in purge.expired_querysets(now):
+                last[0] = time.perf_counter()
+                with transaction.atomic():
+                    deleted += queryset.delete()[1].get(queryset.model._meta.label, 0)
+                progress()
+        else:
+            deleted = sum(purge.purge_expired(chunk_size=chunk_size, throttle=0, now=now,
+                                              progress=progress).values())
+        elapsed = time.perf_counter() - start
+        rows.append(summarize(label, transactions, **{
+            "rows deleted": deleted,
+            "rows/sec": round(deleted / elapsed),
+            "total s": round(elapsed, 2),
+            "longest txn ms": round(max(transactions) * 1000, 1),
+        }))
+    return rows
+
+
+@scenario('rate_limit', uses_db=True)
+def bench_rate_limit(requests=100):
+    """A password-guessing burst against /login/ from one client, with and without rate limits."""
+    from django.contrib.auth.models import User
+    from django.core.cache import cache
+    from django.test import override_settings
+    from rest_framework.test import APIClient
+
+    User.objects.create_user(username='bench-victim', password='correct horse battery staple')
+    client = APIClient()
+
+    def guess():
+        return client.post('/banana/login/', {'username': 'bench-victim', 'password': 'guess'}, format='json')
+
+    rows = []
+    for label, enabled in (('no rate limit (old)', False), ('sliding window', True)):
+        cache.clear()
+        statuses = []
+        with override_settings(RATE_LIMITS={'ENABLED': enabled, 'RATES': {'login': {'ip': '30/min',
+                                                                                     'username+ip': '10/10min'}}}):
+            latencies = measure(lambda: statuses.append(guess().status_code), requests)
+        rows.append(summarize(label, latencies, **{
+            "burst s": round(sum(latencies), 2),
+            "hashed": statuses.count(400),
+            "429s": statuses.count(429),
+        }))
+    return rows
+
+
+@scenario('logout_all', uses_db=True)
+def bench_logout_all(users=20, tokens_per_user=1000):
+    """logout_all for users with many sessions: get_or_create per token vs one SELECT + bulk INSERT."""
+    import datetime
+
+    from django.contrib.auth.models import User
+    from django.db import connection
+    from django.utils import timezone
+    from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+
+    from . import sessions
+
+    expires = timezone.now() + datetime.timedelta(days=1)
+    players = User.objects.bulk_create([User(username=f'bench-sessions-{i}') for i in range(users * 2)])
+    for user in players:
+        OutstandingToken.objects.bulk_create([
+            OutstandingToken(user=user, jti=f'{user.username}-{i}', token='t', expires_at=expires)
+            for i in range(tokens_per_user)
+        ])
+
+    def per_token(user):
+        for outstanding_token in OutstandingToken.objects.filter(user=user):
+            BlacklistedToken.objects.get_or_create(token=outstanding_token)
+
+    rows = []
+    for label, revoke, group in (
+        ('get_or_create per token (old)', per_token, players[:users]),
+        ('SELECT + bulk_create(ignore_conflicts)', lambda user: sessions.revoke_all_sessions([user.pk]), players[users:]),
+    ):
+        pending, queries = iter(group), []
+
+        def count(execute, sql, params, many, context):
+            queries.append(sql)
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(count):
+            latencies = measure(lambda: revoke(next(pending)), users)
+        rows.append(summarize(label, latencies, **{"queries/call": len(queries) // users}))
+    rows.append({"case": 'tokens blacklisted', "n": BlacklistedToken.objects.count()})
+    return rows
+
+
+@scenario('auth_cache', uses_db=True)
+def bench_auth_cache(users=200, requests=5000):
+    """Resolving user + player per request: JWTAuthentication and get_or_create vs CachedJWTAuthentication."""
+    from django.contrib.auth.models import User
+    from django.core.cache import cache
+    from django.db import connection
+    from django.test import RequestFactory, override_settings
+    from rest_framework.request import Request
+    from rest_framework_simplejwt.authentication import JWTAuthentication
+    from rest_framework_simplejwt.tokens import AccessToken
+
+    from .authentication import CachedJWTAuthentication, get_player
+    from .models import Player
+
+    players = User.objects.bulk_create([User(username=f'bench-auth-{i}') for i in range(users)])
+    Player.objects.bulk_create([Player(user=user) for user in players])
+    factory = RequestFactory()
+    requests_ = [factory.get('/', HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}') for user in players]
+    rng = random.Random(4)
+
+    def old():
+        request = Request(rng.choice(requests_))
+        user, _ = JWTAuthentication().authenticate(request)
+        Player.objects.get_or_create(user=user)
+
+    def cached():
+        request = Request(rng.choice(requests_), authenticators=[CachedJWTAuthentication()])
+        get_player(request)
+
+    rows = []
+    cache.clear()
+    cases = (
+        ('JWTAuthentication + get_or_create (old)', old, None),
+        ('CachedJWTAuthentication, locmem', cached, None),
+        # What a shared cache gets: no per-request state check.
+        ('CachedJWTAuthentication, CHECK_STATE off', cached, False),
+    )
+    for label, resolve, check_state in cases:
+        queries = []
+
+        def count(execute, sql, params, many, context):
+            queries.append(sql)
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(count), override_settings(AUTH_USER_CACHE={'CHECK_STATE': check_state}):
+            latencies = measure(resolve, requests)
+        rows.append(summarize(label, latencies, **{"queries/request": round(len(queries) / requests, 3)}))
+    return rows
+
+
+@scenario('login', uses_db=True)
+def bench_login(logins=48, concurrency=16, probe_interval=0.02):
+    """
+    Concurrent logins as ASGI serves them: the sync DRF view, which hashes on
+    the one thread all sync views share, vs the async view hashing on
+    Banana.hashing's pool. A cheap sync view is probed throughout. Latencies
+    are of successful logins; 503s come back at once and are only counted.
+    """
+    from asgiref.sync import sync_to_async
+    from django.contrib.auth.hashers import make_password
+    from django.contrib.auth.models import User
+    from django.test import AsyncRequestFactory, RequestFactory, override_settings
+
+    from . import hashing, views
+    from .models import Player
+
+    password_hash = make_password('correct horse')
+    User.objects.bulk_create([User(username=f'bench-login-{i}', password=password_hash) for i in range(concurrency)])
+    body = [f'{{"username": "bench-login-{i}", "password": "correct horse"}}' for i in range(concurrency)]
+    factory, async_factory = RequestFactory(), AsyncRequestFactory()
+    sync_view = sync_to_async(views.login)
+    probe_view = sync_to_async(lambda: Player.objects.exists())
+
+    async def old(i):
+        return await sync_view(factory.post('/banana/login/', body[i], content_type='application/json'))
+
+    async def new(i):
+        return await views.login_async(async_factory.post('/banana/login/async/', body[i], content_type='application/json'))
+
+    async def storm(login):
+        latencies, probes, statuses = [], [], []
+        remaining = iter(range(logins))
+
+        async def client(i):
+            for _ in remaining:
+                start = time.perf_counter()
+                response = await login(i)
+                if response.status_code == 200:
+                    latencies.append(time.perf_counter() - start)
+                statuses.append(response.status_code)
+
+        async def probe():
+            while True:
+                start = time.perf_counter()
+                await probe_view()
+                probes.append(time.perf_counter() - start)
+                await asyncio.sleep(probe_interval)
+
+        prober = asyncio.create_task(probe())
+        start = time.perf_counter()
+        await asyncio.gather(*(client(i) for i in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        prober.cancel()
+        return latencies, probes, statuses, elapsed
+
+    rows = []
+    pool = hashing.get_hashing_settings()
+    cases = (
+        ('sync DRF view (login/)', old, {}),
+        (f'async view, {concurrency} pending max', new, {'MAX_PENDING': concurrency}),
+        (f'async view, {pool["MAX_PENDING"]} pending max', new, {}),
+    )
+    for label, login, hashing_settings in cases:
+        with override_settings(RATE_LIMITS={'ENABLED': False}, PASSWORD_HASHING=hashing_settings):
+            latencies, probes, statuses, elapsed = asyncio.run(storm(login))
+        probes.sort()
+        rows.append(summarize(label, latencies, **{
+            "hashing threads": pool['WORKERS'] if login is new else 1,
+            "logins/sec": round(statuses.count(200) / elapsed, 1),
+            "503s": statuses.count(503),
+            "probe p99 ms": round(probes[min(len(probes) - 1, int(0.99 * len(probes)))] * 1000, 3),
+        }))
+    hashing.reset_executor()
+    return rows
+
+
+@scenario('ratings', uses_db=True)
+def bench_ratings(rows=500_000, iterations=1, summary_iterations=1000, submits=2000):
+    """GET /ratings/ at N ratings: the old load-everything view vs the RatingSummary row and a list page."""
+    from django.contrib.auth.models import User
+    from django.test import RequestFactory
+    from django.utils import timezone
+    from rest_framework.test import force_authenticate
+
+    from . import pagination, ratings, views
+    from .models import Rating
+    from .serializers import RatingSerializer
+
+    rng = random.Random(8)
+    user_ids = _seed_scores(rows + submits, 0, prefix='bench-rater')
+    now = timezone.now()
+    Rating.objects.bulk_create(
+        [Rating(user_id=user_id, rating=rng.randint(1, 5), created_at=now) for user_id in user_ids[:rows]],
+        batch_size=20000,
+    )
+    ratings.rebuild()
+
+    def old():
+        # The view before RatingSummary, minus the Response.
+        queryset = Rating.objects.all()
+        data = RatingSerializer(queryset, many=True).data
+        if queryset.exists():
+            average = sum(r.rating for r in queryset) / queryset.count()
+            total = queryset.count()
+        return data, average, total
+
+    factory = RequestFactory()
+    raters = iter(User.objects.filter(pk__in=user_ids[rows:]))
+    middle = Rating.objects.order_by('-created_at', '-id')[rows // 2]
+    deep_cursor = pagination.encode_cursor(middle.created_at, middle.pk)
+
+    def submit():
+        request = factory.post('/banana/ratings/submit/', {'rating': rng.randint(1, 5)}, content_type='application/json')
+        force_authenticate(request, next(raters))
+        views.submit_rating(request)
+
+    return [
+        summarize(f'old get_ratings ({rows} rows)', measure(old, iterations)),
+        summarize('RatingSummary', measure(ratings.summary, summary_iterations)),
+        summarize('list page 1 (20 rows)', measure(lambda: views.get_rating_list(factory.get('/')), summary_iterations)),
+        summarize(f'list page at row {rows // 2}', measure(
+            lambda: views.get_rating_list(factory.get('/', {'cursor': deep_cursor})), summary_iterations,
+        )),
+        summarize('submit_rating + summary UPDATE', measure(submit, submits)),
+    ]
+
+
+@scenario('reviews', uses_db=True)
+def bench_reviews(reviews=100_000, users=5_000, iterations=200, old_iterations=1):
+    """GET /reviews/ at N reviews: the old unpaginated N+1 view vs keyset pages, shallow and deep."""
+    from datetime import timedelta
+
+    from django.core.cache import cache
+    from django.db import connection
+    from django.test import RequestFactory
+    from django.utils import timezone
+
+    from . import pagination, views
+    from .models import Review
+    from .serializers import ReviewSerializer
+
+    user_ids = _seed_scores(users, 0, prefix='bench-reviewer')
+    rng = random.Random(9)
+    now = timezone.now()
+    Review.objects.bulk_create([
+        Review(user_id=rng.choice(user_ids), title=f'Review {i}', content='Great game! ' * 10,
+               rating=rng.randint(1, 5), is_approved=rng.random() < 0.8, created_at=now - timedelta(seconds=i))
+        for i in range(reviews)
+    ], batch_size=5000)
+    cache.clear()
+
+    def old():
+        # The view before keyset pagination, minus the Response.
+        queryset = Review.objects.filter(is_approved=True)
+        return ReviewSerializer(queryset, many=True).data, queryset.count()
+
+    factory = RequestFactory()
+    approved = Review.objects.filter(is_approved=True)
+    total = approved.count()
+    depth = total // 2
+    middle = approved.order_by('-created_at', '-id')[depth - 1]
+    deep_cursor = pagination.encode_cursor(middle.created_at, middle.pk)
+
+    def queries_per_call(func):
+        queries = []
+
+        def count(execute, sql, params, many, context):
+            queries.append(sql)
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(count):
+            latencies = measure(func, iterations)
+        return latencies, round(len(queries) / iterations, 2)
+
+    rows = [summarize(f'old get_reviews (all {total} approved)', measure(old, old_iterations))]
+    for label, func in (
+        ('get_reviews, first page', lambda: views.get_reviews(factory.get('/'))),
+        (f'get_reviews, page at row {depth}', lambda: views.get_reviews(factory.get('/', {'cursor': deep_cursor}))),
+        (f'keyset query at row {depth}', lambda: pagination.paginate(approved, deep_cursor)),
+        (f'OFFSET {depth} LIMIT 21', lambda: list(approved.order_by('-created_at', '-id')[depth:depth + 21])),
+    ):
+        latencies, per_call = queries_per_call(func)
+        rows.append(summarize(label, latencies, **{"queries/request": per_call}))
+    return rows
+
+
+_SEARCH_WORDS = (
+    'banana puzzle game fun hard easy level hint freeze coins streak daily challenge score friend family '
+    'bug crash slow fast love hate great awesome boring colorful music sound timer brain monkey jungle '
+    'leaderboard certificate login email password review rating update android iphone browser'
+).split()
+
+
+@scenario('search', uses_db=True)
+def bench_search(reviews=200_000, contacts=50_000, iterations=50):
+    """The admin's LIKE search_fields vs the FTS5 index (match, ranked top 20) over a seeded corpus."""
+    from django.contrib import admin
+
+    from . import search
+    from .admin import ContactAdmin, ReviewAdmin
+    from .models import Contact, Review
+
+    user_ids = _seed_scores(2_000, 0, prefix='bench-critic')
+    rng = random.Random(10)
+
+    def text(words):
+        return ' '.join(rng.choice(_SEARCH_WORDS) for _ in range(words))
+
+    start = time.perf_counter()
+    Review.objects.bulk_create([
+        Review(user_id=rng.choice(user_ids), title=text(4), content=text(60), is_approved=True)
+        for _ in range(reviews)
+    ], batch_size=5000)
+    Contact.objects.bulk_create([
+        Contact(name=f'Person {i}', email=f'person{i}@example.com', subject=text(5), message=text(80))
+        for i in range(contacts)
+    ], batch_size=5000)
+    seeded = time.perf_counter() - start
+    if not search.is_indexed(Review):
+        return [{"case": "search", "error": "this database has no FTS5 index"}]
+    start = time.perf_counter()
+    search.rebuild()
+    rebuilt = time.perf_counter() - start
+
+    # A rare word and a rare pair, as moderators look for specific complaints.
+    rare = 'Xylophone'
+    for review in Review.objects.order_by('?')[:20]:
+        review.content += f' {rare.lower()}'
+        review.save(update_fields=['content'])
+    queries = ['crash', 'android crash', rare]
+
+    def like(model_admin, query):
+        # What the changelist did before FullTextSearchMixin.
+        return admin.ModelAdmin.get_search_results(model_admin, None, model_admin.model.objects.all(), query)[0]
+
+    review_admin, contact_admin = ReviewAdmin(Review, admin.site), ContactAdmin(Contact, admin.site)
+
+    rows = [
+        {"case": f"seed {reviews} reviews + {contacts} contacts", "seconds": round(seeded, 2)},
+        {"case": "rebuild_search_index", "seconds": round(rebuilt, 2)},
+    ]
+    for query in queries:
+        rows.append(summarize(f'LIKE review count {query!r}', measure(
+            lambda: like(review_admin, query).count(), iterations)))
+        rows.append(summarize(f'FTS5 review count {query!r}', measure(
+            lambda: Review.objects.filter(search.match_q(Review, query)).count(), iterations)))
+        rows.append(summarize(f'FTS5 ranked top 20 {query!r}', measure(
+            lambda: list(search.ranked(Review.objects.all(), query)[:20]), iterations)))
+    rows.append(summarize("LIKE contact count 'crash'", measure(
+        lambda: like(contact_admin, 'crash').count(), iterations)))
+    rows.append(summarize("FTS5 contact count 'crash'", measure(
+        lambda: Contact.objects.filter(search.match_q(Contact, 'crash')).count(), iterations)))
+    return rows
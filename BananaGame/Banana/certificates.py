@@ -0,0 +1,501 @@
+"""
+Top-3 certificate PDFs.
+
+Only the username, score and date differ between two certificates of the
+same rank, so each rank's static layout is rendered by ReportLab once per
+process (``CertificateTemplate``) and ``render_certificate`` just appends the
+variable strings to its content stream. Each template renders a sample and
+checks its xref table when it is built (``manage.py check`` builds all
+three); a rank whose template can't be built or fails to render for any
+reason is drawn in full by ReportLab instead.
+``CERTIFICATE_RENDERER['BACKEND']`` can move rendering to a process pool so
+bursts stay off the API workers' GIL.
+
+Rendered PDFs are stored on disk under a digest of the username, rank,
+score and date (``<root>/<ab>/<sha256>.pdf``) and served from there until one
+of them changes. The store is bounded by ``CERTIFICATE_CACHE['MAX_BYTES']``: reads
+refresh a file's mtime and the least recently used files are evicted once
+the total grows past the bound. The digest doubles as the response ETag.
+When the all-time top 3 changes, ``schedule_prerender`` queues a job that
+renders their certificates ahead of the download (``manage.py
+prerender_certificates`` does the same from cron, e.g. just after midnight).
+"""
+import concurrent.futures
+import datetime
+import hashlib
+import io
+import json
+import logging
+import multiprocessing
+import os
+import re
+import threading
+from pathlib import Path
+
+import django
+from django.conf import settings
+from django.core import checks
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import jobs, leaderboard
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CERTIFICATE_SETTINGS = {
+    'ENABLED': True,
+    'DIR': None,
+    'MAX_BYTES': 50 * 1024 * 1024,
+    'PRERENDER': True,
+}
+DEFAULT_RENDERER_SETTINGS = {
+    'BACKEND': 'inline',
+    'WORKERS': 2,
+    'TIMEOUT': 30,
+}
+
+PLACE_TEXTS = {1: "CHAMPION", 2: "RUNNER-UP", 3: "THIRD PLACE"}
+PLACE_COLORS = {1: '#FCD34D', 2: '#9CA3AF', 3: '#FB923C'}
+
+
+def get_certificate_settings():
+    conf = {**DEFAULT_CERTIFICATE_SETTINGS, **getattr(settings, 'CERTIFICATE_CACHE', {})}
+    if conf['DIR'] is None:
+        conf['DIR'] = Path(settings.BASE_DIR) / 'certificate_cache'
+    return conf
+
+
+def _variable_text(username, score, day, height):
+    """(text, font, size, fill colour, y) of every string that differs between certificates."""
+    return [
+        (username, "Helvetica-Bold", 42, '#1F2937', height - 380),
+        (f"Final Score: {score} Points", "Helvetica-Bold", 28, '#78350F', height - 540),
+        (f"Date: {day.strftime('%B %d, %Y')}", "Helvetica", 16, '#78350F', 80),
+    ]
+
+
+def _draw_static(p, rank, width, height):
+    """Everything on a certificate that only depends on the rank."""
+    from reportlab.lib import colors
+
+    p.setFillColor(colors.HexColor('#FCD34D'))
+    p.rect(0, 0, width, height, fill=1)
+
+    p.setStrokeColor(colors.HexColor('#F59E0B'))
+    p.setLineWidth(20)
+    p.rect(10, 10, width - 20, height - 20, fill=0, stroke=1)
+
+    p.setStrokeColor(colors.HexColor('#D97706'))
+    p.setLineWidth(5)
+    p.rect(30, 30, width - 60, height - 60, fill=0, stroke=1)
+
+    p.setFillColor(colors.HexColor('#92400E'))
+    p.setFont("Helvetica-Bold", 48)
+    title = "CERTIFICATE OF ACHIEVEMENT"
+    title_width = p.stringWidth(title, "Helvetica-Bold", 48)
+    p.drawString((width - title_width) / 2, height - 120, title)
+
+    p.setStrokeColor(colors.HexColor('#92400E'))
+    p.setLineWidth(3)
+    p.line(width * 0.2, height - 160, width * 0.8, height - 160)
+
+    p.setFillColor(colors.HexColor(PLACE_COLORS[rank]))
+    p.setFont("Helvetica-Bold", 36)
+    place_text = PLACE_TEXTS[rank]
+    place_width = p.stringWidth(place_text, "Helvetica-Bold", 36)
+    p.drawString((width - place_width) / 2, height - 220, place_text)
+
+    p.setFillColor(colors.HexColor('#78350F'))
+    p.setFont("Helvetica", 24)
+    subtitle = f"{'First' if rank == 1 else 'Second' if rank == 2 else 'Third'} Place Winner"
+    subtitle_width = p.stringWidth(subtitle, "Helvetica", 24)
+    p.drawString((width - subtitle_width) / 2, height - 270, subtitle)
+
+    p.setFillColor(colors.HexColor('#78350F'))
+    p.setFont("Helvetica", 20)
+    certify_text = "This is to certify that"
+    certify_width = p.stringWidth(certify_text, "Helvetica", 20)
+    p.drawString((width - certify_width) / 2, height - 320, certify_text)
+
+    p.setFillColor(colors.HexColor('#78350F'))
+    p.setFont("Helvetica", 22)
+    achievement_text = f"Has achieved {rank}{'st' if rank == 1 else 'nd' if rank == 2 else 'rd'} Place"
+    achievement_width = p.stringWidth(achievement_text, "Helvetica", 22)
+    p.drawString((width - achievement_width) / 2, height - 440, achievement_text)
+
+    p.setFont("Helvetica", 20)
+    game_text = "in the Banana Brain Blitz Game"
+    game_width = p.stringWidth(game_text, "Helvetica", 20)
+    p.drawString((width - game_width) / 2, height - 480, game_text)
+
+    p.setFont("Helvetica-Bold", 40)
+    p.setFillColor(colors.HexColor('#92400E'))
+    p.drawString(100, height - 100, "*")
+    p.drawString(width - 140, height - 100, "*")
+    p.drawString(100, 120, "*")
+    p.drawString(width - 140, 120, "*")
+
+
+def render_certificate_reportlab(username, rank, score, day):
+    """Draw the whole certificate with ReportLab and return the PDF bytes."""
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import A4, landscape
+    from reportlab.pdfgen import canvas
+
+    buffer = io.BytesIO()
+    p = canvas.Canvas(buffer, pagesize=landscape(A4))
+    width, height = landscape(A4)
+    _draw_static(p, rank, width, height)
+    for text, font, size, color, y in _variable_text(username, score, day, height):
+        p.setFillColor(colors.HexColor(color))
+        p.setFont(font, size)
+        p.drawString((width - p.stringWidth(text, font, size)) / 2, y, text)
+    p.showPage()
+    p.save()
+    return buffer.getvalue()
+
+
+class CertificateTemplate:
+    """
+    The static layer of one rank's certificate, rendered once by ReportLab.
+
+    ``render`` appends the variable strings to the page's content stream and
+    writes the rest of the file back unchanged: the content stream is the last
+    object ReportLab writes, so every other object keeps its xref offset and
+    only ``startxref`` moves.
+    """
+
+    def __init__(self, rank):
+        from reportlab.lib.pagesizes import A4, landscape
+        from reportlab.pdfgen import canvas
+
+        buffer = io.BytesIO()
+        p = canvas.Canvas(buffer, pagesize=landscape(A4), pageCompression=0)
+        self.width, self.height = landscape(A4)
+        _draw_static(p, rank, self.width, self.height)
+        p.showPage()
+        p.save()
+        self._split(buffer.getvalue())
+        self._check(self.render("Check (1)", 0, datetime.date(2000, 1, 1)))
+
+    def _split(self, pdf):
+        contents = int(re.search(rb'/Contents (\d+) 0 R', pdf).group(1))
+        start = pdf.index(b'\n%d 0 obj\n' % contents) + 1
+        stream_start = pdf.index(b'stream\n', start) + len(b'stream\n')
+        stream_end = pdf.index(b'endstream', stream_start)
+        xref = pdf.index(b'\nxref\n') + 1
+        if pdf.index(b'endobj\n', stream_end) + len(b'endobj\n') != xref:
+            raise ValueError("Certificate template content stream is not the last object")
+        self.contents = contents
+        self.prefix = pdf[:start]
+        self.static_ops = pdf[stream_start:stream_end]
+        self.xref_and_trailer = pdf[xref:pdf.index(b'startxref', xref)]
+        self.fonts = {
+            base.decode(): name.decode()
+            for base, name in re.findall(rb'/BaseFont /([\w-]+) .*?/Name /(F\d+)', pdf)
+        }
+
+    @staticmethod
+    def _check(pdf):
+        """Raise ValueError unless every xref entry of ``pdf`` points at its object."""
+        xref = pdf.index(b'\nxref\n') + 1
+        if int(pdf[pdf.rindex(b'startxref\n') + len(b'startxref\n'):].split()[0]) != xref:
+            raise ValueError("Certificate template startxref is off")
+        lines = pdf[xref:pdf.index(b'trailer', xref)].split(b'\n')
+        first, count = map(int, lines[1].split())
+        for number, entry in enumerate(lines[2:2 + count], first):
+            if entry.endswith(b'n') and not pdf[int(entry[:10]):].startswith(b'%d 0 obj\n' % number):
+                raise ValueError(f"Certificate template xref entry for object {number} is off")
+
+    def render(self, username, score, day):
+        from reportlab.lib import colors
+        from reportlab.lib.rl_accel import fp_str
+        from reportlab.pdfbase.pdfmetrics import stringWidth
+
+        ops = []
+        for text, font, size, color, y in _variable_text(username, score, day, self.height):
+            x = (self.width - stringWidth(text, font, size)) / 2
+            escaped = text.encode('cp1252').replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)')
+            rgb = colors.HexColor(color)
+            ops.append(b'%s rg BT /%s %s Tf 1 0 0 1 %s Tm (%s) Tj ET\n' % (
+                fp_str(rgb.red, rgb.green, rgb.blue).encode(), self.fonts[font].encode(),
+                fp_str(size).encode(), fp_str(x, y).encode(), escaped,
+            ))
+        stream = self.static_ops + b''.join(ops)
+        body = self.prefix + b'%d 0 obj\n<<\n/Length %d\n>>\nstream\n%sendstream\nendobj\n' % (
+            self.contents, len(stream), stream)
+        return body + self.xref_and_trailer + b'startxref\n%d\n%%%%EOF\n' % len(body)
+
+
+_templates = {}
+_templates_lock = threading.Lock()
+
+
+def get_template(rank):
+    """The rank's template, or None if it couldn't be built (tried once per process)."""
+    if rank not in _templates:
+        with _templates_lock:
+            if rank not in _templates:
+                try:
+                    _templates[rank] = CertificateTemplate(rank)
+                except Exception:
+                    logger.exception("Certificate template for rank %d is unusable; rendering in full", rank)
+                    _templates[rank] = None
+    return _templates[rank]
+
+
+def render_certificate(username, rank, score, day):
+    """Certificate PDF bytes: the rank's pre-rendered template plus the variable text."""
+    template = get_template(rank)
+    if template is not None:
+        try:
+            return template.render(username, score, day)
+        except UnicodeEncodeError:
+            # The standard PDF fonts only cover cp1252; let ReportLab handle anything else.
+            pass
+        except Exception:
+            logger.exception("Certificate template for rank %d failed; rendering in full", rank)
+    return render_certificate_reportlab(username, rank, score, day)
+
+
+def check_templates(app_configs=None, **kwargs):
+    """System check: build every rank's template, warning about any that fall back to ReportLab."""
+    return [
+        checks.Warning(
+            f"The rank {rank} certificate template is unusable; those certificates are drawn in full.",
+            hint="See the logged exception. The ReportLab fallback is correct, only slower.",
+            obj='Banana.certificates', id='Banana.W001',
+        )
+        for rank in PLACE_TEXTS
+        if get_template(rank) is None
+    ]
+
+
+def get_renderer_settings():
+    return {**DEFAULT_RENDERER_SETTINGS, **getattr(settings, 'CERTIFICATE_RENDERER', {})}
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                # Not fork: a forked worker inherits the parent's locks and threads mid-use.
+                # Spawned workers start clean and set Django up before unpickling a job.
+                _executor = concurrent.futures.ProcessPoolExecutor(
+                    get_renderer_settings()['WORKERS'],
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=django.setup,
+                )
+    return _executor
+
+
+def reset_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def render(username, rank, score, day):
+    """render_certificate on the configured backend: this thread, or a worker process."""
+    conf = get_renderer_settings()
+    if conf['BACKEND'] == 'process':
+        future = get_executor().submit(render_certificate, username, rank, score, day)
+        return future.result(timeout=conf['TIMEOUT'])
+    if conf['BACKEND'] != 'inline':
+        raise ImproperlyConfigured(f"Unknown CERTIFICATE_RENDERER backend {conf['BACKEND']!r}")
+    return render_certificate(username, rank, score, day)
+
+
+def certificate_key(username, rank, score, day):
+    inputs = json.dumps([username, rank, score, day.isoformat()], separators=(',', ':'))
+    return hashlib.sha256(inputs.encode()).hexdigest()
+
+
+class CertificateStore:
+    """Size-bounded, content-addressed directory of rendered certificates."""
+
+    def __init__(self, root, max_bytes):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._total = None
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Keys written by prerender() and not downloaded yet.
+        self._prerendered = set()
+        self.prerendered = 0
+        self.prerender_hits = 0
+
+    def path(self, key):
+        return self.root / key[:2] / f'{key}.pdf'
+
+    def _files(self):
+        return self.root.glob('*/*.pdf')
+
+    def total_bytes(self):
+        with self._lock:
+            if self._total is None:
+                self._total = sum(path.stat().st_size for path in self._files())
+            return self._total
+
+    def open(self, key):
+        """Open the stored file for ``key`` (marking it recently used), or None."""
+        path = self.path(key)
+        try:
+            handle = path.open('rb')
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # Evicted after we opened it; the open handle still reads the content.
+            pass
+        return handle
+
+    def put(self, key, data):
+        path = self.path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f'.{os.getpid()}.{threading.get_ident()}.tmp')
+        tmp.write_bytes(data)
+        existed = path.exists()
+        os.replace(tmp, path)
+        if not existed:
+            self.total_bytes()
+            with self._lock:
+                self._total += len(data)
+        if self.total_bytes() > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """Delete least recently used files until the store fits in ``max_bytes``."""
+        with self._lock:
+            entries = []
+            for path in self._files():
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+                total -= size
+                self.evictions += 1
+            self._total = total
+
+    def open_or_render(self, username, rank, score, day):
+        """``(file, key)`` for the certificate, rendering and storing it on a miss."""
+        key = certificate_key(username, rank, score, day)
+        handle = self.open(key)
+        if handle is not None:
+            self.hits += 1
+            with self._lock:
+                if key in self._prerendered:
+                    self._prerendered.discard(key)
+                    self.prerender_hits += 1
+            return handle, key
+        self.misses += 1
+        data = render(username, rank, score, day)
+        self.put(key, data)
+        return io.BytesIO(data), key
+
+    def prerender(self, username, rank, score, day):
+        """Render the certificate into the store unless it is already there. Returns True if rendered."""
+        key = certificate_key(username, rank, score, day)
+        if self.path(key).exists():
+            return False
+        self.put(key, render(username, rank, score, day))
+        with self._lock:
+            self._prerendered.add(key)
+            self.prerendered += 1
+        return True
+
+    def stats(self):
+        served = self.hits + self.misses
+        first_downloads = self.prerender_hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / served, 4) if served else 0.0,
+            'evictions': self.evictions,
+            'bytes': self.total_bytes(),
+            'max_bytes': self.max_bytes,
+            'prerendered': self.prerendered,
+            'prerender_hits': self.prerender_hits,
+            # Share of first downloads that found a pre-rendered file instead of rendering inline.
+            'prerender_hit_rate': round(self.prerender_hits / first_downloads, 4) if first_downloads else 0.0,
+        }
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def prerender_top(day=None):
+    """Job: render the current top 3's certificates into the store. Returns how many were rendered."""
+    day = day or timezone.localdate()
+    store = get_store()
+    # The same LeaderboardEntry order get_certificate checks ranks against.
+    return sum(
+        store.prerender(entry['username'], rank, entry['score'], day)
+        for rank, entry in enumerate(leaderboard.top_entries(3), 1)
+    )
+
+
+_scheduled_top = None
+
+
+def schedule_prerender():
+    """
+    Queue prerender_top if the top 3 differs from the last one queued. Called
+    by submit_score after a commit that changed the all-time top 10.
+    """
+    global _scheduled_top
+    conf = get_certificate_settings()
+    if not (conf['ENABLED'] and conf['PRERENDER']):
+        return False
+    top = tuple((entry['username'], entry['score']) for entry in leaderboard.top_entries(3))
+    if top == _scheduled_top:
+        return False
+    _scheduled_top = top
+    jobs.submit(prerender_top)
+    return True
+
+
+def get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                conf = get_certificate_settings()
+                _store = CertificateStore(conf['DIR'], conf['MAX_BYTES'])
+    return _store
+
+
+def reset_store():
+    global _store, _scheduled_top
+    _store = _scheduled_top = None
+
+
+@receiver(setting_changed)
+def _reset_on_setting_change(setting, **kwargs):
+    if setting in ('CERTIFICATE_CACHE', 'BASE_DIR'):
+        reset_store()
+    if setting == 'CERTIFICATE_RENDERER':
+        reset_executor()
@@ -0,0 +1,137 @@
+"""
+Password hashing off the request path.
+
+PBKDF2 costs hundreds of milliseconds of CPU per login or registration.
+The opt-in async views behind ``login/async/`` and ``register/async/`` hand
+it to one bounded thread pool per process (hashlib releases the GIL while it
+hashes, so threads run in parallel up to the number of cores) and await the
+result, so under ASGI a login storm never ties up the event loop or the
+thread that runs sync views and ORM calls. Under WSGI they gain nothing, so
+the default ``login/`` and ``register/`` remain the sync DRF views.
+
+At most ``PASSWORD_HASHING['MAX_PENDING']`` hashes may be running or queued;
+beyond that ``run`` raises ``HashingBusy`` straight away and the views answer
+``503`` with ``Retry-After``, instead of letting the queue (and every
+caller's latency) grow without bound.
+"""
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import check_password, make_password
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+DEFAULT_HASHING_SETTINGS = {
+    # None: one worker per core
+    'WORKERS': None,
+    # None: four per worker
+    'MAX_PENDING': None,
+    'RETRY_AFTER': 1,
+}
+
+
+class HashingBusy(Exception):
+    pass
+
+
+def get_hashing_settings():
+    conf = {**DEFAULT_HASHING_SETTINGS, **getattr(settings, 'PASSWORD_HASHING', {})}
+    conf['WORKERS'] = conf['WORKERS'] or os.cpu_count() or 1
+    conf['MAX_PENDING'] = conf['MAX_PENDING'] or conf['WORKERS'] * 4
+    return conf
+
+
+class HashingExecutor:
+    def __init__(self, workers, max_pending):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix='banana-hashing')
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self.completed = 0
+        self.rejected = 0
+
+    def _done(self, future):
+        # Freed when the hash finishes, not when its caller stops waiting for it.
+        self._slots.release()
+        with self._lock:
+            self.completed += 1
+
+    async def run(self, func, *args):
+        """Await ``func(*args)`` on the pool. Raises HashingBusy when the pool is full."""
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise HashingBusy
+        future = self._executor.submit(func, *args)
+        future.add_done_callback(self._done)
+        return await asyncio.wrap_future(future)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'max_pending': self.max_pending,
+                'completed': self.completed,
+                'rejected': self.rejected,
+            }
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                conf = get_hashing_settings()
+                _executor = HashingExecutor(conf['WORKERS'], conf['MAX_PENDING'])
+    return _executor
+
+
+def reset_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown()
+        _executor = None
+
+
+@receiver(setting_changed)
+def _reset_on_setting_change(setting, **kwargs):
+    if setting in ('PASSWORD_HASHING', 'PASSWORD_HASHERS'):
+        reset_executor()
+
+
+def _verify(password, encoded):
+    """``(matches, new_encoded)``; ``new_encoded`` is set when the stored hash needs upgrading."""
+    outdated = []
+    # check_password calls the setter when the hasher or its parameters have changed.
+    if not check_password(password, encoded, setter=outdated.append):
+        return False, None
+    return True, make_password(password) if outdated else None
+
+
+async def verify_password(user, password):
+    """
+    Check ``password`` against ``user`` (may be None) on the pool, upgrading
+    an outdated hash the way ``User.check_password`` does. Returns
+    ``(matches, new_encoded)``; the caller saves ``new_encoded`` if set.
+    """
+    if user is None or not user.has_usable_password():
+        # Hash anyway, so unknown usernames take as long as wrong passwords.
+        await get_executor().run(make_password, password)
+        return False, None
+    return await get_executor().run(_verify, password, user.password)
+
+
+async def hash_password(password):
+    return await get_executor().run(make_password, password)
@@ -0,0 +1,148 @@
+"""
+In-process background jobs.
+
+``JOB_RUNNER`` picks how ``submit`` runs a job: ``'thread'`` hands it to one
+daemon worker thread per process, ``'immediate'`` runs it on the caller's
+thread (tests, management commands). A job that is already waiting in the
+queue is not queued again, so a burst of identical submissions collapses
+into one run. Jobs are plain callables and must be safe to run twice.
+"""
+import logging
+import queue
+import threading
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.db import close_old_connections
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+
+class ImmediateRunner:
+    def __init__(self):
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+
+    def submit(self, func, *args):
+        self.submitted += 1
+        try:
+            func(*args)
+        except Exception:
+            self.failed += 1
+            logger.exception("Job %s failed", getattr(func, '__name__', func))
+        else:
+            self.completed += 1
+        return True
+
+    def join(self):
+        pass
+
+    def stop(self, timeout=None):
+        pass
+
+    def stats(self):
+        return {
+            'runner': 'immediate',
+            'submitted': self.submitted,
+            'completed': self.completed,
+            'failed': self.failed,
+            'pending': 0,
+        }
+
+
+class ThreadRunner(ImmediateRunner):
+    def __init__(self):
+        super().__init__()
+        self._queue = queue.Queue()
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _ensure_started(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='banana-jobs', daemon=True)
+            self._thread.start()
+
+    def submit(self, func, *args):
+        """Queue ``func(*args)``. Returns False if the same job is already waiting."""
+        job = (func, args)
+        with self._lock:
+            if job in self._pending:
+                return False
+            self._pending.add(job)
+            self.submitted += 1
+            self._ensure_started()
+        self._queue.put(job)
+        return True
+
+    def join(self):
+        """Block until every queued job has finished."""
+        self._queue.join()
+
+    def stop(self, timeout=None):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                self._queue.task_done()
+                break
+            with self._lock:
+                self._pending.discard(job)
+            func, args = job
+            try:
+                func(*args)
+            except Exception:
+                self.failed += 1
+                logger.exception("Job %s failed", getattr(func, '__name__', func))
+            else:
+                self.completed += 1
+            finally:
+                close_old_connections()
+                self._queue.task_done()
+
+    def stats(self):
+        return {**super().stats(), 'runner': 'thread', 'pending': self._queue.qsize()}
+
+
+RUNNERS = {'immediate': ImmediateRunner, 'thread': ThreadRunner}
+
+_runner = None
+_runner_lock = threading.Lock()
+
+
+def get_runner():
+    global _runner
+    if _runner is None:
+        with _runner_lock:
+            if _runner is None:
+                name = getattr(settings, 'JOB_RUNNER', 'thread')
+                if name not in RUNNERS:
+                    raise ImproperlyConfigured(f"Unknown JOB_RUNNER {name!r}")
+                _runner = RUNNERS[name]()
+    return _runner
+
+
+def reset_runner():
+    global _runner
+    with _runner_lock:
+        if _runner is not None:
+            _runner.stop(timeout=1)
+        _runner = None
+
+
+@receiver(setting_changed)
+def _reset_on_setting_change(setting, **kwargs):
+    if setting == 'JOB_RUNNER':
+        reset_runner()
+
+
+def submit(func, *args):
+    return get_runner().submit(func, *args)
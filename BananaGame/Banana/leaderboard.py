@@ -0,0 +1,190 @@
+"""
+Leaderboards backed by materialized best-score tables.
+
+``record_score`` is called from submit_score and only writes when a user
+beats a stored best: the all-time best in ``LeaderboardEntry`` and the best
+for the current UTC day in ``DailyBest``. Reading a window is then an index
+range scan over at most one row per user per day instead of a GROUP BY over
+every ``Score`` ever submitted. Weekly boards combine the daily buckets of
+the current ISO week (Monday-Sunday, UTC), and buckets older than
+``LEADERBOARD_BUCKET_RETENTION_DAYS`` are expired once a day by a job queued
+after the submitting transaction commits.
+``backfill`` rebuilds the all-time table from ``Score`` in user-id chunks.
+``top_n_changed`` tells callers which boards a write actually reordered, and
+``rank_within`` whether a player is near the top of the all-time board.
+"""
+import datetime
+import functools
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Max, Min, OuterRef, Q, Subquery
+from django.utils import timezone
+
+from . import jobs
+from .models import DailyBest, LeaderboardEntry, Score
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TOP_N = 10
+ALL_TIME, DAILY, WEEKLY = 'all', 'daily', 'weekly'
+WINDOWS = (ALL_TIME, DAILY, WEEKLY)
+DEFAULT_RETENTION_DAYS = 14
+
+
+def utc_day(moment):
+    return moment.astimezone(datetime.timezone.utc).date()
+
+
+def week_start(day):
+    return day - datetime.timedelta(days=day.weekday())
+
+
+def _upsert_best(queryset, score, achieved_at, **lookup):
+    def raise_best():
+        return bool(queryset.filter(best_score__lt=score, **lookup).update(best_score=score, achieved_at=achieved_at))
+
+    if raise_best():
+        return True
+    _, created = queryset.get_or_create(**lookup, defaults={'best_score': score, 'achieved_at': achieved_at})
+    # Lost the race to a concurrent first submit: its row may hold a lower score.
+    return created or raise_best()
+
+
+def record_score(user, score, achieved_at):
+    """
+    Upsert ``user``'s all-time and daily bests. Returns the set of windows
+    whose stored best changed (a daily change also affects the weekly board).
+    """
+    changed = set()
+    if _upsert_best(LeaderboardEntry.objects, score, achieved_at, user=user):
+        changed.add(ALL_TIME)
+    if _upsert_best(DailyBest.objects, score, achieved_at, user=user, day=utc_day(achieved_at)):
+        changed.update((DAILY, WEEKLY))
+    # Not inside the caller's transaction: the DELETE would hold the write lock with it.
+    transaction.on_commit(functools.partial(maybe_expire_buckets, utc_day(achieved_at)))
+    return changed
+
+
+def _window_rows(window, today):
+    if window == ALL_TIME:
+        return LeaderboardEntry.objects.values_list('user__username', 'best_score')
+    if window == DAILY:
+        return DailyBest.objects.filter(day=today).values_list('user__username', 'best_score')
+    if window == WEEKLY:
+        week = DailyBest.objects.filter(day__gte=week_start(today), day__lte=today)
+        # Ties go to whoever reached the score first, not to whoever played first that week.
+        best_reached = week.filter(user=OuterRef('user')).order_by('-best_score', 'achieved_at')
+        return (
+            week
+            .values('user__username')
+            .annotate(week_best=Max('best_score'), best_achieved=Subquery(best_reached.values('achieved_at')[:1]))
+            .order_by('-week_best', 'best_achieved')
+            .values_list('user__username', 'week_best')
+        )
+    raise ValueError(f"Unknown leaderboard window {window!r}")
+
+
+def top_entries(limit=DEFAULT_TOP_N, window=ALL_TIME, now=None):
+    """The ``limit`` best players in ``window`` as ``[{'username', 'score'}]``, best first."""
+    today = utc_day(now or timezone.now())
+    rows = _window_rows(window, today)[:limit]
+    return [{'username': username, 'score': score} for username, score in rows]
+
+
+def rank_within(user, limit):
+    """
+    ``(rank, best_score)`` of ``user`` on the all-time board, read from
+    LeaderboardEntry. ``rank`` is None when they have no score or are below
+    ``limit``; only up to ``limit`` rows ahead of them are read.
+    """
+    entry = LeaderboardEntry.objects.filter(user=user).order_by().values_list('best_score', 'achieved_at')[:1]
+    if not entry:
+        return None, None
+    score, achieved_at = entry[0]
+    # The board's order, with the user id as the final tie-break the way Banana.ranking has it.
+    ahead = LeaderboardEntry.objects.filter(
+        Q(best_score__gt=score)
+        | Q(best_score=score, achieved_at__lt=achieved_at)
+        | Q(best_score=score, achieved_at=achieved_at, user_id__lt=user.pk)
+    )
+    rank = len(ahead.order_by().values_list('pk', flat=True)[:limit]) + 1
+    return (rank if rank <= limit else None), score
+
+
+def top_n_changed(changed, score, achieved_at, limit=DEFAULT_TOP_N):
+    """
+    The windows in ``changed`` (as returned by record_score) whose top
+    ``limit`` now include ``score``. Ties with the cutoff count as changed.
+    """
+    today = utc_day(achieved_at)
+    affected = set()
+    for window in changed:
+        cutoff = list(_window_rows(window, today)[limit - 1:limit])
+        if not cutoff or score >= cutoff[0][1]:
+            affected.add(window)
+    return affected
+
+
+def expire_buckets(today=None, retention_days=None):
+    """Delete daily buckets older than the retention period. Returns the number deleted."""
+    if retention_days is None:
+        retention_days = getattr(settings, 'LEADERBOARD_BUCKET_RETENTION_DAYS', DEFAULT_RETENTION_DAYS)
+    # Weekly boards need the whole current week.
+    retention_days = max(retention_days, 7)
+    cutoff = (today or utc_day(timezone.now())) - datetime.timedelta(days=retention_days)
+    deleted, _ = DailyBest.objects.filter(day__lt=cutoff).delete()
+    return deleted
+
+
+def _expire_job(today):
+    deleted = expire_buckets(today)
+    if deleted:
+        logger.info("Expired %d daily leaderboard buckets", deleted)
+
+
+def maybe_expire_buckets(today):
+    """Queue expire_buckets on the job runner at most once per UTC day (per cache)."""
+    if cache.add(f'leaderboard:buckets-expired:{today.isoformat()}', 1, timeout=2 * 24 * 60 * 60):
+        jobs.submit(_expire_job, today)
+
+
+def backfill(chunk_size=1000, progress=None):
+    """
+    Rebuild LeaderboardEntry from Score, ``chunk_size`` user ids at a time.
+    Returns the number of entries written.
+    """
+    bounds = Score.objects.aggregate(low=Min('user_id'), high=Max('user_id'))
+    if bounds['low'] is None:
+        return 0
+
+    written = 0
+    for start in range(bounds['low'], bounds['high'] + 1, chunk_size):
+        chunk = Score.objects.filter(user_id__gte=start, user_id__lt=start + chunk_size)
+        best = dict(chunk.values_list('user_id').annotate(Max('score')))
+        if not best:
+            continue
+        # Earliest time each user reached their best score, to break ties fairly.
+        achieved = {}
+        for user_id, score, first_date in (
+            chunk.values_list('user_id', 'score').annotate(Min('date'))
+        ):
+            if best[user_id] == score:
+                achieved[user_id] = first_date
+
+        entries = [
+            LeaderboardEntry(user_id=user_id, best_score=score, achieved_at=achieved[user_id])
+            for user_id, score in best.items()
+        ]
+        LeaderboardEntry.objects.bulk_create(
+            entries,
+            update_conflicts=True,
+            unique_fields=['user'],
+            update_fields=['best_score', 'achieved_at'],
+        )
+        written += len(entries)
+        if progress:
+            progress(start + chunk_size - 1, written)
+    return written
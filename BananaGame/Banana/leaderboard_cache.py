@@ -0,0 +1,133 @@
+"""
+Response cache for the public leaderboard endpoint.
+
+Each window has a version counter in the Django cache. A cached top-N body
+is stored under a key containing that version, and the same version is the
+response's strong ETag, so a client that already has the current board gets
+``304 Not Modified`` without the body being read at all. submit_score bumps a
+window's version only when the submitted score lands in that window's top N
+(``leaderboard.top_n_changed``); every other submission leaves the cache
+warm. Daily and weekly keys also carry the current day/week, so they roll
+over on their own at UTC midnight.
+
+The cache alias comes from ``LEADERBOARD_CACHE['ALIAS']``. With the default
+per-process locmem cache every worker keeps its own versions; point the alias
+at a shared backend (Redis, Memcached) to invalidate all workers at once.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+
+from . import leaderboard
+
+DEFAULT_CACHE_SETTINGS = {
+    'ENABLED': True,
+    'ALIAS': 'default',
+    'TIMEOUT': 300,
+}
+
+
+def get_cache_settings():
+    return {**DEFAULT_CACHE_SETTINGS, **getattr(settings, 'LEADERBOARD_CACHE', {})}
+
+
+def enabled():
+    return get_cache_settings()['ENABLED']
+
+
+def _cache():
+    return caches[get_cache_settings()['ALIAS']]
+
+
+class CacheStats:
+    """Per-process hit/miss counters for the leaderboard cache."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+            self.not_modified = 0
+            self.invalidations = 0
+
+    def incr(self, counter, amount=1):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + amount)
+
+    def snapshot(self):
+        with self._lock:
+            served = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'not_modified': self.not_modified,
+                'invalidations': self.invalidations,
+                'hit_rate': round(self.hits / served, 3) if served else None,
+            }
+
+
+stats = CacheStats()
+
+
+def _version_key(window):
+    return f'leaderboard:version:{window}'
+
+
+def _new_version():
+    # Seeded from the clock so that a counter lost to eviction or a restart
+    # never hands out an ETag a client may still hold for different content.
+    return time.time_ns()
+
+
+def get_version(window):
+    cache = _cache()
+    version = cache.get(_version_key(window))
+    if version is None:
+        cache.add(_version_key(window), _new_version(), timeout=None)
+        version = cache.get(_version_key(window))
+    return version
+
+
+def invalidate(windows):
+    """Bump the version of each window in ``windows``."""
+    cache = _cache()
+    for window in windows:
+        try:
+            cache.incr(_version_key(window))
+        except ValueError:
+            cache.add(_version_key(window), _new_version(), timeout=None)
+    stats.incr('invalidations', len(windows))
+
+
+def _period(window, today):
+    if window == leaderboard.DAILY:
+        return today.isoformat()
+    if window == leaderboard.WEEKLY:
+        return leaderboard.week_start(today).isoformat()
+    return window
+
+
+def etag(window, now=None):
+    """Strong ETag for the current contents of ``window``."""
+    today = leaderboard.utc_day(now or timezone.now())
+    return f'"{window}-{_period(window, today)}-{get_version(window)}"'
+
+
+def top_entries(window, tag, now=None):
+    """``leaderboard.top_entries`` for ``window``, cached under ``tag``."""
+    cache = _cache()
+    key = f'leaderboard:top:{tag}'
+    entries = cache.get(key)
+    if entries is not None:
+        stats.incr('hits')
+        return entries
+    stats.incr('misses')
+    entries = leaderboard.top_entries(leaderboard.DEFAULT_TOP_N, window=window, now=now)
+    cache.set(key, entries, timeout=get_cache_settings()['TIMEOUT'])
+    return entries
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from Banana import leaderboard
+
+
+class Command(BaseCommand):
+    help = "Build the LeaderboardEntry table from existing Score rows"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help="Number of user ids aggregated per query (default: 1000)")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+
+        def progress(last_user_id, written):
+            self.stdout.write(f"  users up to id {last_user_id}: {written} entries written")
+
+        written = leaderboard.backfill(chunk_size=options['chunk_size'], progress=progress)
+        self.stdout.write(self.style.SUCCESS(
+            f"Backfilled {written} leaderboard entries in {time.perf_counter() - start:.2f}s"
+        ))
@@ -0,0 +1,67 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from Banana.benchmarks import SCENARIOS
+
+
+def _parse_value(value):
+    for cast in (int, float):
+        try:
+            return cast(value)
+        except ValueError:
+            pass
+    return value
+
+
+class Command(BaseCommand):
+    help = "Run a benchmark scenario from Banana.benchmarks"
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenario', nargs='?', help="Scenario name (omit to list scenarios)")
+        parser.add_argument('-p', '--param', action='append', default=[], metavar='KEY=VALUE',
+                            help="Scenario parameter, may be repeated")
+
+    def handle(self, *args, **options):
+        name = options['scenario']
+        if not name:
+            for scenario_name, (func, _) in sorted(SCENARIOS.items()):
+                self.stdout.write(f"{scenario_name:<20} {(func.__doc__ or '').strip()}")
+            return
+        if name not in SCENARIOS:
+            raise CommandError(f"Unknown scenario {name!r}. Available: {', '.join(sorted(SCENARIOS))}")
+
+        params = {}
+        for item in options['param']:
+            key, sep, value = item.partition('=')
+            if not sep:
+                raise CommandError(f"Parameters must look like key=value, got {item!r}")
+            params[key.replace('-', '_')] = _parse_value(value)
+
+        func, uses_db = SCENARIOS[name]
+        # Same environment as the test runner: locmem email, 'testserver' allowed host.
+        setup_test_environment()
+        try:
+            if uses_db:
+                old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+                try:
+                    rows = func(**params)
+                finally:
+                    connection.creation.destroy_test_db(old_name, verbosity=0)
+            else:
+                rows = func(**params)
+        finally:
+            teardown_test_environment()
+        self._print_table(rows)
+
+    def _print_table(self, rows):
+        columns = []
+        for row in rows:
+            for key in row:
+                if key not in columns:
+                    columns.append(key)
+        widths = {c: max(len(c), *(len(str(row.get(c, ''))) for row in rows)) for c in columns}
+        self.stdout.write('  '.join(c.ljust(widths[c]) for c in columns))
+        self.stdout.write('  '.join('-' * widths[c] for c in columns))
+        for row in rows:
+            self.stdout.write('  '.join(str(row.get(c, '')).ljust(widths[c]) for c in columns))
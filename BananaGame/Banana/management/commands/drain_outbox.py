@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from Banana import outbox
+
+
+class Command(BaseCommand):
+    help = "Send the queued emails in the outbox that are due"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--watch', action='store_true',
+                            help="Keep draining every --interval seconds, for a dedicated mail worker")
+        parser.add_argument('--interval', type=float, default=5.0)
+
+    def handle(self, *args, **options):
+        if options['watch']:
+            self.stdout.write(f"Draining the outbox every {options['interval']}s")
+            outbox.watch(options['interval'], options['batch_size'])
+            return
+        totals = outbox.drain_all(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Sent {totals['sent']} emails, {totals['retried']} to retry, {totals['failed']} failed"
+        ))
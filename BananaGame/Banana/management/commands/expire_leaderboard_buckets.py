@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from Banana import leaderboard
+
+
+class Command(BaseCommand):
+    help = "Delete daily leaderboard buckets older than LEADERBOARD_BUCKET_RETENTION_DAYS"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retention-days', type=int, default=None,
+                            help="Override LEADERBOARD_BUCKET_RETENTION_DAYS (minimum 7)")
+
+    def handle(self, *args, **options):
+        deleted = leaderboard.expire_buckets(retention_days=options['retention_days'])
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} expired daily leaderboard buckets"))
@@ -0,0 +1,42 @@
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from Banana import puzzlegen
+
+
+class Command(BaseCommand):
+    help = "Pre-generate a corpus of local banana puzzles using a process pool"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=1000, help="Number of puzzles to generate")
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help="Worker processes (default: number of CPUs)")
+        parser.add_argument('--chunksize', type=int, default=32)
+
+    def handle(self, *args, **options):
+        count = options['count']
+        store_root = str(settings.PUZZLE_STORE_DIR)
+        base_url = settings.PUZZLE_STORE_URL
+        seeds = [random.getrandbits(64) for _ in range(count)]
+
+        start = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=options['workers']) as executor:
+            results = list(executor.map(
+                puzzlegen.generate_into_store,
+                seeds,
+                [store_root] * count,
+                [base_url] * count,
+                chunksize=options['chunksize'],
+            ))
+        elapsed = time.perf_counter() - start
+
+        puzzlegen.append_manifest(settings.PUZZLE_CORPUS_MANIFEST, results)
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated {count} puzzles in {elapsed:.2f}s ({count / elapsed:.1f} puzzles/sec) "
+            f"with {options['workers']} worker(s) into {store_root}"
+        ))
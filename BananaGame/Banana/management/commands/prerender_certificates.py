@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from Banana import certificates, ranking
+
+
+class Command(BaseCommand):
+    help = "Render today's certificates for the current top 3 into the certificate store"
+
+    def handle(self, *args, **options):
+        ranking.rebuild()
+        rendered = certificates.prerender_top()
+        self.stdout.write(self.style.SUCCESS(f"Pre-rendered {rendered} certificates"))
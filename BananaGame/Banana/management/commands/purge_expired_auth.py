@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from Banana import purge
+
+
+class Command(BaseCommand):
+    help = "Delete expired OTP, OutstandingToken and BlacklistedToken rows and old sent emails in bounded chunks"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=None,
+                            help="Primary keys deleted per transaction (default: AUTH_PURGE['CHUNK_SIZE'])")
+        parser.add_argument('--throttle', type=float, default=None,
+                            help="Seconds to sleep between chunks (default: AUTH_PURGE['THROTTLE'])")
+        parser.add_argument('--dry-run', action='store_true', help="Count the expired rows without deleting them")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        verb = "found" if options['dry_run'] else "deleted"
+
+        def progress(label, last_pk, rows):
+            if options['verbosity'] > 1:
+                self.stdout.write(f"  {label} up to id {last_pk}: {rows} rows {verb}")
+
+        purged = purge.purge_expired(
+            chunk_size=options['chunk_size'], dry_run=options['dry_run'],
+            throttle=options['throttle'], progress=progress,
+        )
+        for label, rows in purged.items():
+            self.stdout.write(f"{label}: {rows} expired rows {verb}")
+        self.stdout.write(self.style.SUCCESS(
+            f"{'Dry run' if options['dry_run'] else 'Purge'} finished in {time.perf_counter() - start:.2f}s"
+        ))
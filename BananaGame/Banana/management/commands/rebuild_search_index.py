@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from Banana import search
+
+
+class Command(BaseCommand):
+    help = "Reinstall the FTS5 search tables and triggers and reindex reviews and contact submissions"
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        indexed = search.rebuild()
+        if indexed is None:
+            self.stdout.write(self.style.WARNING(
+                "This database has no FTS5; search falls back to icontains and there is nothing to rebuild."
+            ))
+            return
+        for label, rows in indexed.items():
+            self.stdout.write(f"{label}: {rows} rows indexed")
+        self.stdout.write(self.style.SUCCESS(f"Search index rebuilt in {time.perf_counter() - start:.2f}s"))
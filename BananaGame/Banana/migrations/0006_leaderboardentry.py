@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:26
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Banana', '0005_contact_review_rating'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeaderboardEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('best_score', models.IntegerField()),
+                ('achieved_at', models.DateTimeField()),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='leaderboard_entry', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-best_score', 'achieved_at'],
+                'indexes': [models.Index(fields=['-best_score', 'achieved_at'], name='leaderboard_best_score_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:35
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Banana', '0006_leaderboardentry'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyBest',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('best_score', models.IntegerField()),
+                ('achieved_at', models.DateTimeField()),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_bests', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-day', '-best_score', 'achieved_at'],
+                'indexes': [models.Index(fields=['day', '-best_score', 'achieved_at'], name='daily_best_day_score_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'day'), name='daily_best_user_day_uniq')],
+            },
+        ),
+    ]
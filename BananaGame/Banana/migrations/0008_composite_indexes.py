@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:43
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Banana', '0007_dailybest'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='otp',
+            index=models.Index(condition=models.Q(('is_used', False)), fields=['user', 'otp_type', '-created_at'], name='otp_unused_lookup_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(condition=models.Q(('is_approved', True)), fields=['-created_at', '-id'], name='review_approved_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='review_user_created_idx'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+from django.db import migrations
+from django.db.models import Count
+
+
+def check_duplicate_emails(apps, schema_editor):
+    """
+    Stop with the offending emails instead of the bare IntegrityError the
+    CREATE UNIQUE INDEX would give. Which account keeps an email is for an
+    admin to decide, so nothing is merged here.
+    """
+    User = apps.get_model('auth', 'User')
+    duplicates = list(
+        User.objects.exclude(email='').values('email').annotate(accounts=Count('id')).filter(accounts__gt=1)
+        .order_by('email').values_list('email', 'accounts')[:20]
+    )
+    if duplicates:
+        listed = ', '.join(f'{email} ({accounts} accounts)' for email, accounts in duplicates)
+        raise RuntimeError(
+            f"Cannot make auth_user.email unique; these emails are shared: {listed}. "
+            "Change or clear the email of all but one account for each, then migrate again."
+        )
+
+
+class Migration(migrations.Migration):
+    """
+    Registration relies on the database to reject a second account with the
+    same email, so two concurrent sign-ups can't both get through. Accounts
+    without an email (createsuperuser allows that) are left out of the index.
+
+    After auth's own migrations: on SQLite, altering auth_user rebuilds the
+    table and drops indexes Django doesn't know about.
+    """
+
+    dependencies = [
+        ('Banana', '0009_outboxemail'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_duplicate_emails, migrations.RunPython.noop),
+        migrations.RunSQL(
+            "CREATE UNIQUE INDEX user_email_unique_idx ON auth_user (email) WHERE email <> ''",
+            reverse_sql="DROP INDEX user_email_unique_idx",
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:24
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def summarize_ratings(apps, schema_editor):
+    Rating = apps.get_model('Banana', 'Rating')
+    RatingSummary = apps.get_model('Banana', 'RatingSummary')
+    histogram = dict(Rating.objects.order_by().values_list('rating').annotate(n=Count('id')))
+    RatingSummary.objects.create(
+        pk=1,
+        count=sum(histogram.values()),
+        total=sum(stars * n for stars, n in histogram.items()),
+        **{f'stars_{stars}': histogram.get(stars, 0) for stars in range(1, 6)},
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Banana', '0010_user_email_unique'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RatingSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.IntegerField(default=0)),
+                ('total', models.IntegerField(default=0)),
+                ('stars_1', models.IntegerField(default=0)),
+                ('stars_2', models.IntegerField(default=0)),
+                ('stars_3', models.IntegerField(default=0)),
+                ('stars_4', models.IntegerField(default=0)),
+                ('stars_5', models.IntegerField(default=0)),
+            ],
+            options={
+                'verbose_name_plural': 'Rating summary',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='rating',
+            index=models.Index(fields=['-created_at', '-id'], name='rating_created_idx'),
+        ),
+        migrations.RunPython(summarize_ratings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,66 @@
+from django.db import migrations
+
+# Frozen copies of Banana.search.install_sql/drop_sql as they were when this
+# migration was written, so later changes to that module can't change it.
+TABLES = {
+    'Banana_review': ('Banana_review_fts', ('title', 'content')),
+    'Banana_contact': ('Banana_contact_fts', ('name', 'email', 'subject', 'message')),
+}
+
+
+def install_sql(table, fts, columns):
+    names = ', '.join(f'"{column}"' for column in columns)
+    new = ', '.join(f'new."{column}"' for column in columns)
+    old = ', '.join(f'old."{column}"' for column in columns)
+    delete = f"""INSERT INTO "{fts}"("{fts}", rowid, {names}) VALUES ('delete', old."id", {old});"""
+    insert = f"""INSERT INTO "{fts}"(rowid, {names}) VALUES (new."id", {new});"""
+    return [
+        f"""CREATE VIRTUAL TABLE IF NOT EXISTS "{fts}" USING fts5({names}, content='{table}', """
+        f"""content_rowid='id', tokenize='porter unicode61')""",
+        f"""CREATE TRIGGER IF NOT EXISTS "{fts}_ai" AFTER INSERT ON "{table}" BEGIN {insert} END""",
+        f"""CREATE TRIGGER IF NOT EXISTS "{fts}_ad" AFTER DELETE ON "{table}" BEGIN {delete} END""",
+        f"""CREATE TRIGGER IF NOT EXISTS "{fts}_au" AFTER UPDATE OF {names} ON "{table}" """
+        f"""BEGIN {delete} {insert} END""",
+        f"""INSERT INTO "{fts}"("{fts}") VALUES ('rebuild')""",
+    ]
+
+
+def fts5_available(connection):
+    if connection.vendor != 'sqlite':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+        return bool(cursor.fetchone()[0])
+
+
+def install(apps, schema_editor):
+    if not fts5_available(schema_editor.connection):
+        return
+    for table, (fts, columns) in TABLES.items():
+        for statement in install_sql(table, fts, columns):
+            schema_editor.execute(statement)
+
+
+def uninstall(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for fts, _ in TABLES.values():
+        for suffix in ('_ai', '_ad', '_au'):
+            schema_editor.execute(f'DROP TRIGGER IF EXISTS "{fts}{suffix}"')
+        schema_editor.execute(f'DROP TABLE IF EXISTS "{fts}"')
+
+
+class Migration(migrations.Migration):
+    """
+    FTS5 tables and sync triggers for Review and Contact (see Banana.search).
+    Does nothing on other databases or on SQLite built without FTS5; search
+    falls back to icontains there.
+    """
+
+    dependencies = [
+        ('Banana', '0011_rating_summary'),
+    ]
+
+    operations = [
+        migrations.RunPython(install, uninstall),
+    ]
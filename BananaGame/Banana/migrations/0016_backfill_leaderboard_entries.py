@@ -0,0 +1,43 @@
+from django.db import migrations
+from django.db.models import Max, Min
+
+CHUNK_SIZE = 1000
+
+
+def fill_leaderboard(apps, schema_editor):
+    """
+    LeaderboardEntry from the scores submitted before 0006 created it; the
+    same as Banana.leaderboard.backfill, against the historical models.
+    """
+    Score = apps.get_model('Banana', 'Score')
+    LeaderboardEntry = apps.get_model('Banana', 'LeaderboardEntry')
+    bounds = Score.objects.aggregate(low=Min('user_id'), high=Max('user_id'))
+    if bounds['low'] is None:
+        return
+    for start in range(bounds['low'], bounds['high'] + 1, CHUNK_SIZE):
+        chunk = Score.objects.filter(user_id__gte=start, user_id__lt=start + CHUNK_SIZE)
+        best = dict(chunk.values_list('user_id').annotate(Max('score')))
+        achieved = {}
+        for user_id, score, first_date in chunk.values_list('user_id', 'score').annotate(Min('date')):
+            if best[user_id] == score:
+                achieved[user_id] = first_date
+        LeaderboardEntry.objects.bulk_create(
+            [
+                LeaderboardEntry(user_id=user_id, best_score=score, achieved_at=achieved[user_id])
+                for user_id, score in best.items()
+            ],
+            update_conflicts=True,
+            unique_fields=['user'],
+            update_fields=['best_score', 'achieved_at'],
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Banana', '0013_search_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_leaderboard, migrations.RunPython.noop),
+    ]
@@ -30,6 +30,42 @@ class Score(models.Model):
     date = models.DateTimeField(auto_now_add=True)
 
 
+class LeaderboardEntry(models.Model):
+    """Best score per user, maintained by submit_score (see Banana.leaderboard)"""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='leaderboard_entry')
+    best_score = models.IntegerField()
+    achieved_at = models.DateTimeField()
+
+    class Meta:
+        ordering = ['-best_score', 'achieved_at']
+        indexes = [
+            models.Index(fields=['-best_score', 'achieved_at'], name='leaderboard_best_score_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} - {self.best_score}"
+
+
+class DailyBest(models.Model):
+    """Best score per user per UTC day; the buckets behind daily and weekly leaderboards"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='daily_bests')
+    day = models.DateField()
+    best_score = models.IntegerField()
+    achieved_at = models.DateTimeField()
+
+    class Meta:
+        ordering = ['-day', '-best_score', 'achieved_at']
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'day'], name='daily_best_user_day_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['day', '-best_score', 'achieved_at'], name='daily_best_day_score_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} - {self.day} - {self.best_score}"
+
+
 class OTP(models.Model):
     EMAIL = 'email'
 
@@ -47,6 +83,12 @@ class OTP(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # generate_otp / verify_otp: unused codes for a user and type, newest first. Partial,
+            # because Django renders is_used=False as NOT "is_used", which a column index can't seek on.
+            models.Index(fields=['user', 'otp_type', '-created_at'], condition=models.Q(is_used=False),
+                         name='otp_unused_lookup_idx'),
+        ]
 
     @classmethod
     def _generate_code(cls):
@@ -128,11 +170,32 @@ class Rating(models.Model):
     class Meta:
         ordering = ['-created_at']
         unique_together = ['user']  
+        indexes = [
+            # get_rating_list pages newest first.
+            models.Index(fields=['-created_at', '-id'], name='rating_created_idx'),
+        ]
     
     def __str__(self):
         return f"{self.user.username} - {self.rating} stars"
 
 
+class RatingSummary(models.Model):
+    """Count, total and per-star histogram of all Ratings in one row, maintained by Banana.ratings"""
+    count = models.IntegerField(default=0)
+    total = models.IntegerField(default=0)
+    stars_1 = models.IntegerField(default=0)
+    stars_2 = models.IntegerField(default=0)
+    stars_3 = models.IntegerField(default=0)
+    stars_4 = models.IntegerField(default=0)
+    stars_5 = models.IntegerField(default=0)
+
+    class Meta:
+        verbose_name_plural = "Rating summary"
+
+    def __str__(self):
+        return f"{self.count} ratings, {self.total} stars"
+
+
 class Review(models.Model):
     """User reviews for the game"""
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='reviews')
@@ -147,6 +210,54 @@ class Review(models.Model):
         ordering = ['-created_at']
         verbose_name = "Review"
         verbose_name_plural = "Reviews"
+        indexes = [
+            # get_reviews; partial for the same boolean-rendering reason as OTP's index.
+            # Both end in id for Banana.pagination's (created_at, id) keyset.
+            models.Index(fields=['-created_at', '-id'], condition=models.Q(is_approved=True),
+                         name='review_approved_created_idx'),
+            models.Index(fields=['user', '-created_at', '-id'], name='review_user_created_idx'),
+        ]
     
     def __str__(self):
-        return f"{self.user.username} - {self.title}"
\ No newline at end of file
+        return f"{self.user.username} - {self.title}"
+
+class OutboxEmail(models.Model):
+    """Email queued by a request and sent later in batches (see Banana.outbox)"""
+    PENDING = 'pending'
+    SENT = 'sent'
+    FAILED = 'failed'
+
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+    )
+
+    PRIORITY_HIGH = 0
+    PRIORITY_NORMAL = 5
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=255)
+    to = models.JSONField(default=list)
+    priority = models.PositiveSmallIntegerField(default=PRIORITY_NORMAL)
+    # The body (a login code) is blanked once the email is sent or given up on.
+    secret = models.BooleanField(default=False)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # Earliest next send; while a worker holds the row (claim set), the end of its lease.
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    claim = models.CharField(max_length=32, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['priority', 'next_attempt_at', 'id']
+        indexes = [
+            models.Index(fields=['priority', 'next_attempt_at', 'id'],
+                         condition=models.Q(status='pending'), name='outbox_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} -> {', '.join(self.to)} ({self.status})"
@@ -0,0 +1,139 @@
+"""
+One-time login codes.
+
+``OTP_STORE['BACKEND']`` picks where live codes are kept:
+
+``'cache'`` (default) keeps one entry per user and OTP type in the cache
+named by ``OTP_STORE['CACHE']``. The entry holds a keyed hash of the code,
+never the code itself, and expires through the cache's own TTL, so nothing
+has to be cleaned up. Issuing a new code overwrites the previous one, and a
+code is consumed by deleting its entry: only the request whose ``delete``
+actually removed it logs in. The default locmem cache is per process; point
+``CACHE`` at a shared backend (Redis, Memcached) when running several
+workers or nodes.
+
+``'db'`` uses ``OTP`` rows as before, which leaves an audit trail of every
+code issued and whether it was used, with the code in plain text.
+
+Either way the email carrying the code goes through the outbox at high
+priority as a ``secret`` message, whose body is blanked as soon as it is
+sent or given up on, so with the cache store the server keeps no copy of a
+code beyond its delivery.
+"""
+import hmac
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.crypto import salted_hmac
+
+from .models import OTP
+
+DEFAULT_OTP_SETTINGS = {
+    'BACKEND': 'cache',
+    'CACHE': 'default',
+    'TTL': 10 * 60,
+}
+
+EXPIRED = "OTP has expired or does not exist."
+INVALID = "Invalid OTP provided."
+VERIFIED = "OTP verified successfully."
+
+
+def get_otp_settings():
+    return {**DEFAULT_OTP_SETTINGS, **getattr(settings, 'OTP_STORE', {})}
+
+
+def validity_minutes():
+    return get_otp_settings()['TTL'] // 60
+
+
+class DatabaseOTPBackend:
+    def __init__(self, ttl):
+        self.ttl = ttl
+
+    def issue(self, user, otp_type, contact_info):
+        """Create a code for ``user``, replacing any live one. Returns the code."""
+        return OTP.generate_otp(user, otp_type, contact_info, validity_minutes=self.ttl / 60).otp_code
+
+    def verify(self, user, otp_code, otp_type):
+        """``(ok, message)``; a correct code is consumed."""
+        return OTP.verify_otp(user, otp_code, otp_type)
+
+
+class CacheOTPBackend:
+    SALT = 'Banana.otp'
+
+    def __init__(self, ttl, alias='default'):
+        self.ttl = ttl
+        self.alias = alias
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def _key(self, user, otp_type):
+        return f'otp:{otp_type}:{user.pk}'
+
+    def _digest(self, user, otp_type, otp_code):
+        # Bound to the user and type, so a stolen cache entry can't be replayed elsewhere.
+        return salted_hmac(self.SALT, f'{user.pk}:{otp_type}:{otp_code}', algorithm='sha256').hexdigest()
+
+    def issue(self, user, otp_type, contact_info):
+        otp_code = OTP._generate_code()
+        self.cache.set(self._key(user, otp_type), self._digest(user, otp_type, otp_code), timeout=self.ttl)
+        return otp_code
+
+    def verify(self, user, otp_code, otp_type):
+        key = self._key(user, otp_type)
+        stored = self.cache.get(key)
+        if stored is None:
+            return False, EXPIRED
+        if not hmac.compare_digest(stored, self._digest(user, otp_type, str(otp_code))):
+            return False, INVALID
+        # Two requests racing with the right code both get here; only one deletes the entry.
+        if not self.cache.delete(key):
+            return False, EXPIRED
+        return True, VERIFIED
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                conf = get_otp_settings()
+                if conf['BACKEND'] == 'db':
+                    _backend = DatabaseOTPBackend(conf['TTL'])
+                elif conf['BACKEND'] == 'cache':
+                    _backend = CacheOTPBackend(conf['TTL'], conf['CACHE'])
+                else:
+                    raise ImproperlyConfigured(f"Unknown OTP_STORE backend {conf['BACKEND']!r}")
+    return _backend
+
+
+def reset_backend():
+    global _backend
+    with _backend_lock:
+        _backend = None
+
+
+@receiver(setting_changed)
+def _reset_on_setting_change(setting, **kwargs):
+    if setting == 'OTP_STORE':
+        reset_backend()
+
+
+def issue(user, otp_type, contact_info):
+    return get_backend().issue(user, otp_type, contact_info)
+
+
+def verify(user, otp_code, otp_type):
+    return get_backend().verify(user, otp_code, otp_type)
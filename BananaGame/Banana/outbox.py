@@ -0,0 +1,190 @@
+"""
+Outgoing email outbox.
+
+``send`` stores a message as an ``OutboxEmail`` row and, once the request's
+transaction commits, submits ``drain_all`` to the background job runner, so
+a request never waits on an SMTP handshake. ``drain`` claims a batch of due
+rows in priority order, opens a single connection with
+``get_connection`` and sends the whole batch over it. A message that fails
+is retried with exponential backoff and marked failed after
+``EMAIL_OUTBOX['MAX_ATTEMPTS']`` attempts.
+
+Retries come due with no request to trigger them, so run
+``manage.py drain_outbox --watch`` (or ``drain_outbox`` from cron) next to the
+web workers. Rows are claimed with a lease, so several drainers can run at
+once and a crashed one's batch is picked up again when its lease runs out.
+
+With ``EMAIL_OUTBOX['ENABLED'] = False`` ``send`` delivers synchronously
+inside the request instead.
+
+Bodies stay in the table after they are sent, except for ``secret``
+messages (login OTPs), whose body is blanked once they are sent or marked
+failed. Sent rows are deleted after ``AUTH_PURGE['SENT_EMAIL_DAYS']`` by
+``Banana.purge``.
+"""
+import datetime
+import logging
+import time
+import uuid
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection, send_mail
+from django.db import close_old_connections, transaction
+from django.db.models import Case, Count, F, TextField, Value, When
+from django.utils import timezone
+
+from . import jobs
+from .models import OutboxEmail
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OUTBOX_SETTINGS = {
+    'ENABLED': True,
+    'BATCH_SIZE': 50,
+    'MAX_ATTEMPTS': 5,
+    'BACKOFF': 30,
+    'MAX_BACKOFF': 60 * 60,
+    'LEASE': 5 * 60,
+}
+
+
+def get_outbox_settings():
+    return {**DEFAULT_OUTBOX_SETTINGS, **getattr(settings, 'EMAIL_OUTBOX', {})}
+
+
+def default_from_email():
+    return getattr(settings, 'DEFAULT_FROM_EMAIL', getattr(settings, 'EMAIL_HOST_USER', None))
+
+
+def send(subject, body, to, priority=OutboxEmail.PRIORITY_NORMAL, from_email=None, secret=False):
+    """
+    Queue an email to the ``to`` addresses; ``secret`` blanks its body once
+    it is sent. Returns the ``OutboxEmail``, or None when the outbox is
+    disabled and the email was sent right away.
+    """
+    from_email = from_email or default_from_email()
+    if not get_outbox_settings()['ENABLED']:
+        send_mail(subject, body, from_email, list(to), fail_silently=False)
+        return None
+    email = OutboxEmail.objects.create(
+        subject=subject, body=body, from_email=from_email, to=list(to), priority=priority, secret=secret,
+    )
+    transaction.on_commit(lambda: jobs.submit(drain_all))
+    return email
+
+
+def backoff(attempts, conf=None):
+    """Delay before the retry that follows attempt number ``attempts``."""
+    conf = conf or get_outbox_settings()
+    return datetime.timedelta(seconds=min(conf['BACKOFF'] * 2 ** (attempts - 1), conf['MAX_BACKOFF']))
+
+
+def _claim(batch_size, now, lease):
+    due = OutboxEmail.objects.filter(status=OutboxEmail.PENDING, next_attempt_at__lte=now)
+    ids = list(due.order_by('priority', 'next_attempt_at', 'id').values_list('id', flat=True)[:batch_size])
+    if not ids:
+        return []
+    claim = uuid.uuid4().hex
+    # Re-checking the due condition makes the UPDATE the lock: a row another
+    # drainer claimed in the meantime has moved its next_attempt_at past now.
+    due.filter(id__in=ids).update(claim=claim, next_attempt_at=now + lease)
+    return list(OutboxEmail.objects.filter(claim=claim).order_by('priority', 'next_attempt_at', 'id'))
+
+
+def drain(batch_size=None, now=None):
+    """
+    Send one batch of due emails over one connection. Returns
+    ``{'sent', 'retried', 'failed'}`` counts for the batch.
+    """
+    conf = get_outbox_settings()
+    now = now or timezone.now()
+    rows = _claim(batch_size or conf['BATCH_SIZE'], now, datetime.timedelta(seconds=conf['LEASE']))
+    result = {'sent': 0, 'retried': 0, 'failed': 0}
+    if not rows:
+        return result
+
+    sent = []
+    connection = get_connection()
+    try:
+        connection.open()
+    except Exception as exc:
+        logger.warning("Outbox could not connect: %s", exc)
+        for row in rows:
+            _reschedule(row, exc, now, conf, result)
+        return result
+    try:
+        for index, row in enumerate(rows):
+            message = EmailMessage(row.subject, row.body, row.from_email, row.to, connection=connection)
+            # One message per call: the connection stays open between calls, and a
+            # failure is pinned on the message that caused it instead of the batch.
+            try:
+                connection.send_messages([message])
+            except Exception as exc:
+                logger.warning("Outbox email %s failed: %s", row.pk, exc)
+                _reschedule(row, exc, now, conf, result)
+                # The server may have dropped us. Reconnect once here: left closed,
+                # every later send_messages would open and close a connection of its own.
+                connection.close()
+                try:
+                    connection.open()
+                except Exception as exc:
+                    logger.warning("Outbox could not reconnect: %s", exc)
+                    for rest in rows[index + 1:]:
+                        _reschedule(rest, exc, now, conf, result)
+                    break
+            else:
+                sent.append(row.pk)
+    finally:
+        connection.close()
+
+    if sent:
+        OutboxEmail.objects.filter(pk__in=sent).update(
+            status=OutboxEmail.SENT, sent_at=timezone.now(), attempts=F('attempts') + 1, claim='', last_error='',
+            body=Case(When(secret=True, then=Value('')), default=F('body'), output_field=TextField()),
+        )
+    result['sent'] = len(sent)
+    return result
+
+
+def _reschedule(row, exc, now, conf, result):
+    attempts = row.attempts + 1
+    if attempts >= conf['MAX_ATTEMPTS']:
+        status, next_attempt_at = OutboxEmail.FAILED, now
+        result['failed'] += 1
+    else:
+        status, next_attempt_at = OutboxEmail.PENDING, now + backoff(attempts, conf)
+        result['retried'] += 1
+    extra = {'body': ''} if row.secret and status == OutboxEmail.FAILED else {}
+    OutboxEmail.objects.filter(pk=row.pk).update(
+        status=status, attempts=attempts, next_attempt_at=next_attempt_at, claim='', last_error=str(exc)[:1000],
+        **extra,
+    )
+
+
+def drain_all(batch_size=None):
+    """Drain batches until nothing is due. Returns the summed counts."""
+    batch_size = batch_size or get_outbox_settings()['BATCH_SIZE']
+    totals = {'sent': 0, 'retried': 0, 'failed': 0}
+    while True:
+        result = drain(batch_size)
+        for key, value in result.items():
+            totals[key] += value
+        if sum(result.values()) < batch_size:
+            return totals
+
+
+def watch(interval=5.0, batch_size=None, stop=None):
+    """Drain every ``interval`` seconds until ``stop()`` returns true."""
+    while not (stop and stop()):
+        try:
+            drain_all(batch_size)
+        except Exception:
+            logger.exception("Outbox drain failed")
+        finally:
+            close_old_connections()
+        time.sleep(interval)
+
+
+def stats():
+    counts = dict(OutboxEmail.objects.values_list('status').order_by().annotate(Count('id')))
+    return {status: counts.get(status, 0) for status, _ in OutboxEmail.STATUS_CHOICES}
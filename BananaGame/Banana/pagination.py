@@ -0,0 +1,60 @@
+"""
+Keyset (cursor) pagination for newest-first lists.
+
+An offset page makes the database walk and discard every row before it,
+and rows shift between pages when new ones arrive. ``paginate`` orders by
+``(-created_at, -id)`` instead and continues after the last row the client
+saw: ``created_at <= t AND NOT (created_at = t AND id >= pk)``, which an
+index on ``(-created_at, -id)`` answers with a range scan at any depth.
+The cursor handed to the client is that ``(t, pk)`` pair, url-safe encoded.
+"""
+import base64
+import binascii
+import datetime
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(created_at, pk):
+    return base64.urlsafe_b64encode(f'{created_at.isoformat()}|{pk}'.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """``(created_at, pk)`` from ``encode_cursor``'s output. Raises InvalidCursor."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        created_at, pk = raw.split('|')
+        return datetime.datetime.fromisoformat(created_at), int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError) as exc:
+        raise InvalidCursor(f"Invalid cursor {cursor!r}") from exc
+
+
+def page_params(query_params):
+    """``(cursor, page_size)`` from a request's query string. Raises InvalidCursor."""
+    try:
+        page_size = int(query_params.get('page_size', DEFAULT_PAGE_SIZE))
+    except ValueError as exc:
+        raise InvalidCursor("page_size must be an integer") from exc
+    return query_params.get('cursor') or None, min(max(page_size, 1), MAX_PAGE_SIZE)
+
+
+def paginate(queryset, cursor=None, page_size=DEFAULT_PAGE_SIZE):
+    """
+    One page of ``queryset`` newest first, in one query. Returns ``(rows,
+    next_cursor)``; ``next_cursor`` is None on the last page.
+    """
+    queryset = queryset.order_by('-created_at', '-id')
+    if cursor:
+        created_at, pk = decode_cursor(cursor)
+        queryset = queryset.filter(created_at__lte=created_at).exclude(created_at=created_at, id__gte=pk)
+    # One row past the page says whether there is another, without a COUNT.
+    rows = list(queryset[:page_size + 1])
+    if len(rows) <= page_size:
+        return rows, None
+    rows = rows[:page_size]
+    return rows, encode_cursor(rows[-1].created_at, rows[-1].pk)
@@ -0,0 +1,110 @@
+"""
+Purge of expired authentication rows.
+
+``OTP`` rows (from the 'db' OTP store) and simplejwt's ``OutstandingToken``
+and ``BlacklistedToken`` rows are useless once they expire, and sent
+``OutboxEmail`` rows once ``SENT_EMAIL_DAYS`` have passed, but nothing
+removes them. ``purge_expired`` deletes them in primary-key ranges of
+``chunk_size`` rows, one short transaction per range, optionally sleeping
+``throttle`` seconds in between, so that on SQLite other writers only ever
+wait for one chunk rather than for the whole purge.
+
+Blacklist entries go before the outstanding tokens they point to, so the
+token deletes find nothing left to cascade to. ``maybe_schedule`` queues a
+purge on the job runner at most once per day; ``manage.py
+purge_expired_auth`` runs one from cron.
+"""
+import datetime
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Max, Min
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+
+from . import jobs
+from .models import OTP, OutboxEmail
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PURGE_SETTINGS = {
+    'CHUNK_SIZE': 1000,
+    'THROTTLE': 0.0,
+    'AUTO': True,
+    'SENT_EMAIL_DAYS': 7,
+}
+
+
+def get_purge_settings():
+    return {**DEFAULT_PURGE_SETTINGS, **getattr(settings, 'AUTH_PURGE', {})}
+
+
+def expired_querysets(now):
+    """``(label, queryset)`` of expired rows for each table, in deletion order."""
+    sent_before = now - datetime.timedelta(days=get_purge_settings()['SENT_EMAIL_DAYS'])
+    return [
+        ('OTP', OTP.objects.filter(expires_at__lt=now)),
+        ('BlacklistedToken', BlacklistedToken.objects.filter(token__expires_at__lt=now)),
+        ('OutstandingToken', OutstandingToken.objects.filter(expires_at__lt=now)),
+        ('OutboxEmail', OutboxEmail.objects.filter(status=OutboxEmail.SENT, sent_at__lt=sent_before)),
+    ]
+
+
+def purge_queryset(queryset, chunk_size=1000, dry_run=False, throttle=0.0, progress=None):
+    """
+    Delete the rows of ``queryset`` ``chunk_size`` primary keys at a time.
+    With ``dry_run`` only count them. Returns the number of rows.
+    """
+    bounds = queryset.aggregate(low=Min('pk'), high=Max('pk'))
+    if bounds['low'] is None:
+        return 0
+    total = 0
+    for start in range(bounds['low'], bounds['high'] + 1, chunk_size):
+        chunk = queryset.filter(pk__gte=start, pk__lt=start + chunk_size)
+        if dry_run:
+            count = chunk.count()
+        else:
+            with transaction.atomic():
+                count, _ = chunk.delete()
+        total += count
+        if progress:
+            progress(start + chunk_size - 1, total)
+        if throttle and count and not dry_run:
+            time.sleep(throttle)
+    return total
+
+
+def purge_expired(chunk_size=None, dry_run=False, throttle=None, now=None, progress=None):
+    """
+    Purge every expired auth row. Returns ``{label: rows}``. ``progress`` is
+    called as ``progress(label, last_pk, rows_so_far)`` after each chunk.
+    """
+    conf = get_purge_settings()
+    chunk_size = chunk_size or conf['CHUNK_SIZE']
+    throttle = conf['THROTTLE'] if throttle is None else throttle
+    now = now or timezone.now()
+    purged = {}
+    for label, queryset in expired_querysets(now):
+        report = (lambda last_pk, rows, label=label: progress(label, last_pk, rows)) if progress else None
+        purged[label] = purge_queryset(queryset, chunk_size, dry_run, throttle, report)
+    return purged
+
+
+def _purge_job():
+    purged = purge_expired()
+    if any(purged.values()):
+        logger.info("Purged expired auth rows: %s", purged)
+
+
+def maybe_schedule(today=None):
+    """Queue a purge at most once per UTC day (per cache)."""
+    if not get_purge_settings()['AUTO']:
+        return False
+    today = today or timezone.now().astimezone(datetime.timezone.utc).date()
+    if not cache.add(f'auth-purge:{today.isoformat()}', 1, timeout=2 * 24 * 60 * 60):
+        return False
+    jobs.submit(_purge_job)
+    return True
@@ -0,0 +1,181 @@
+"""
+Pool of pre-fetched puzzles for fetch_puzzle.
+
+Each worker process keeps a bounded deque of puzzles that a daemon thread
+tops back up to the high watermark whenever it drains to the low watermark,
+so a request normally pops a ready puzzle instead of waiting on the puzzle
+source (the upstream banana API, or the local generator when PUZZLE_SOURCE is
+'local'). The request thread only fetches live when the pool is empty.
+"""
+import collections
+import logging
+import threading
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from . import puzzlegen, upstream
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POOL_SETTINGS = {
+    'ENABLED': True,
+    'LOW_WATERMARK': 5,
+    'HIGH_WATERMARK': 20,
+    'REFILL_INTERVAL': 1.0,
+}
+
+
+class PuzzlePool:
+    def __init__(self, fetch, low_watermark=5, high_watermark=20, refill_interval=1.0):
+        if low_watermark >= high_watermark:
+            raise ValueError("low_watermark must be below high_watermark")
+        self.fetch = fetch
+        self.low_watermark = low_watermark
+        self.high_watermark = high_watermark
+        self.refill_interval = refill_interval
+
+        self._puzzles = collections.deque(maxlen=high_watermark)
+        self._refill_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+
+        self.hits = 0
+        self.misses = 0
+        self.refilled = 0
+        self.refill_errors = 0
+
+    def __len__(self):
+        return len(self._puzzles)
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name='puzzle-pool-refiller', daemon=True)
+        self._thread.start()
+        self._wake.set()
+
+    def stop(self, timeout=None):
+        self._stopping.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def get(self):
+        """Pop a ready puzzle, falling back to a live fetch when the pool is empty."""
+        try:
+            puzzle = self._puzzles.popleft()
+        except IndexError:
+            puzzle = None
+
+        if len(self._puzzles) <= self.low_watermark:
+            self._wake.set()
+
+        if puzzle is not None:
+            self.hits += 1
+            return puzzle
+
+        self.misses += 1
+        return self.fetch()
+
+    def refill(self):
+        """Fetch puzzles until the pool reaches the high watermark. Returns the number added."""
+        added = 0
+        with self._refill_lock:
+            while len(self._puzzles) < self.high_watermark and not self._stopping.is_set():
+                try:
+                    puzzle = self.fetch()
+                except Exception as exc:
+                    self.refill_errors += 1
+                    logger.warning("Puzzle pool refill failed: %s", exc)
+                    break
+                self._puzzles.append(puzzle)
+                added += 1
+        self.refilled += added
+        return added
+
+    def stats(self):
+        served = self.hits + self.misses
+        return {
+            "depth": len(self._puzzles),
+            "low_watermark": self.low_watermark,
+            "high_watermark": self.high_watermark,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / served, 4) if served else 0.0,
+            "refilled": self.refilled,
+            "refill_errors": self.refill_errors,
+            "refiller_running": self._thread is not None and self._thread.is_alive(),
+        }
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wake.wait(self.refill_interval)
+            self._wake.clear()
+            if self._stopping.is_set():
+                break
+            if len(self._puzzles) <= self.low_watermark:
+                self.refill()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool_settings():
+    return {**DEFAULT_POOL_SETTINGS, **getattr(settings, 'PUZZLE_POOL', {})}
+
+
+def get_puzzle_source():
+    """The fetch callable for the configured PUZZLE_SOURCE ('upstream' or 'local')."""
+    source = getattr(settings, 'PUZZLE_SOURCE', 'upstream')
+    if source == 'local':
+        return puzzlegen.generate_local_puzzle
+    if source == 'upstream':
+        return upstream.fetch_puzzle
+    raise ImproperlyConfigured(f"Unknown PUZZLE_SOURCE {source!r}")
+
+
+def get_pool():
+    """Return this worker's puzzle pool, creating and starting it on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                conf = get_pool_settings()
+                pool = PuzzlePool(
+                    get_puzzle_source(),
+                    low_watermark=conf['LOW_WATERMARK'],
+                    high_watermark=conf['HIGH_WATERMARK'],
+                    refill_interval=conf['REFILL_INTERVAL'],
+                )
+                pool.start()
+                _pool = pool
+    return _pool
+
+
+def reset_pool():
+    """Stop and discard the current pool; the next get_pool() builds a fresh one."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.stop(timeout=1)
+        _pool = None
+
+
+@receiver(setting_changed)
+def _reset_on_setting_change(setting, **kwargs):
+    if setting in ('PUZZLE_POOL', 'PUZZLE_SOURCE', 'PUZZLE_API_URL', 'PUZZLE_UPSTREAM'):
+        reset_pool()
+
+
+def get_puzzle():
+    """Return a puzzle dict, from the pool when it is enabled."""
+    if not get_pool_settings()['ENABLED']:
+        return get_puzzle_source()()
+    return get_pool().get()
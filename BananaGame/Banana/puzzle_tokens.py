@@ -0,0 +1,87 @@
+"""
+Stateless signed puzzle tokens.
+
+With ``PUZZLE_STATE_MODE = 'token'`` fetch_puzzle hands the client an
+HMAC-signed, timestamped token instead of storing the puzzle in
+``Player.current_puzzle``. The token carries the user id, question,
+difficulty, a nonce and a keyed hash of the solution (never the solution
+itself), so check_puzzle_answer and use_hint can verify it without reading
+or writing puzzle state. Each nonce can be answered once: used nonces are
+remembered in the cache until the token would have expired anyway.
+"""
+import hmac
+import secrets
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import caches
+from django.utils.crypto import salted_hmac
+
+SALT = 'Banana.puzzle_tokens'
+DEFAULT_MAX_AGE = 15 * 60
+
+
+class InvalidPuzzleToken(Exception):
+    pass
+
+
+def enabled():
+    return getattr(settings, 'PUZZLE_STATE_MODE', 'db') == 'token'
+
+
+def max_age():
+    return getattr(settings, 'PUZZLE_TOKEN_MAX_AGE', DEFAULT_MAX_AGE)
+
+
+def _solution_hash(nonce, solution):
+    value = f"{nonce}:{str(solution).strip()}"
+    return salted_hmac(SALT + '.solution', value, algorithm='sha256').hexdigest()[:32]
+
+
+def issue(user_id, question, solution, difficulty):
+    """Return a signed token for a puzzle issued to ``user_id``."""
+    nonce = secrets.token_urlsafe(12)
+    payload = {
+        'u': user_id,
+        'q': question,
+        'd': difficulty,
+        'n': nonce,
+        'h': _solution_hash(nonce, solution),
+    }
+    return signing.dumps(payload, salt=SALT, compress=True)
+
+
+def load(token, user_id):
+    """Verify signature, age and owner of ``token`` and return its payload."""
+    if not token:
+        raise InvalidPuzzleToken("No puzzle stored. Please fetch again.")
+    try:
+        payload = signing.loads(token, salt=SALT, max_age=max_age())
+    except signing.SignatureExpired:
+        raise InvalidPuzzleToken("Puzzle has expired. Please fetch again.")
+    except signing.BadSignature:
+        raise InvalidPuzzleToken("Invalid puzzle token.")
+    if payload.get('u') != user_id:
+        raise InvalidPuzzleToken("Invalid puzzle token.")
+    return payload
+
+
+def check_answer(payload, answer):
+    return hmac.compare_digest(_solution_hash(payload['n'], answer), payload['h'])
+
+
+def recover_solution(payload):
+    """Solutions are single digits, so the server can recover one from its keyed hash."""
+    for digit in range(10):
+        if check_answer(payload, str(digit)):
+            return str(digit)
+    return None
+
+
+def _nonce_cache():
+    return caches[getattr(settings, 'PUZZLE_TOKEN_CACHE', 'default')]
+
+
+def consume(payload):
+    """Mark the token's nonce as used. Returns False if it was already used."""
+    return _nonce_cache().add(f"puzzle-nonce:{payload['n']}", 1, timeout=max_age())
@@ -0,0 +1,196 @@
+"""
+Local banana puzzle generator.
+
+Renders "hidden digit" equations (one operand covered by a banana) with
+Pillow and writes the PNG into a content-addressed store, so puzzles can be
+served without calling the upstream API. Generated puzzles use the same
+``{"question": <image url>, "solution": <digit>}`` shape as the upstream API.
+
+A corpus can be pre-generated in bulk with ``manage.py generate_puzzles``;
+its manifest (image digest + solution) lives outside the media directory so
+solutions are never publicly served.
+"""
+import hashlib
+import io
+import json
+import os
+import random
+import threading
+from pathlib import Path
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from PIL import Image, ImageDraw, ImageFont
+
+IMAGE_SIZE = (480, 180)
+BACKGROUNDS = ['#FEF3C7', '#FDE68A', '#ECFCCB', '#E0F2FE', '#FCE7F3']
+OPERATORS = ['+', '-', 'x']
+
+_font_cache = {}
+
+
+def _font(size):
+    if size not in _font_cache:
+        try:
+            _font_cache[size] = ImageFont.load_default(size=size)
+        except TypeError:
+            # Pillow < 10.1 only ships the fixed-size bitmap font.
+            _font_cache[size] = ImageFont.load_default()
+    return _font_cache[size]
+
+
+def make_equation(rng):
+    """Return (tokens, hidden_index, solution) for a random single-digit equation."""
+    op = rng.choice(OPERATORS)
+    if op == '+':
+        a, b = rng.randint(0, 9), rng.randint(0, 9)
+        c = a + b
+    elif op == '-':
+        a = rng.randint(0, 9)
+        b = rng.randint(0, a)
+        c = a - b
+    else:
+        # No zero operands: "? x 0 = 0" would accept every digit.
+        a, b = rng.randint(1, 9), rng.randint(1, 9)
+        c = a * b
+    hidden = rng.choice([0, 2])
+    solution = a if hidden == 0 else b
+    return [str(a), op, str(b), '=', str(c)], hidden, solution
+
+
+def _draw_banana(draw, box):
+    x0, y0, x1, y1 = box
+    draw.chord((x0, y0 - (y1 - y0) // 2, x1, y1), 20, 160, fill='#FACC15', outline='#A16207', width=3)
+    draw.rectangle((x1 - 14, y0 + 6, x1 - 4, y0 + 16), fill='#78350F')
+
+
+def render_puzzle(seed):
+    """Render the puzzle for ``seed``. Returns (png_bytes, solution)."""
+    rng = random.Random(seed)
+    tokens, hidden, solution = make_equation(rng)
+
+    image = Image.new('RGB', IMAGE_SIZE, rng.choice(BACKGROUNDS))
+    draw = ImageDraw.Draw(image)
+    for _ in range(40):
+        x, y = rng.randrange(IMAGE_SIZE[0]), rng.randrange(IMAGE_SIZE[1])
+        draw.ellipse((x, y, x + 3, y + 3), fill='#D6D3D1')
+
+    font = _font(64)
+    x = 30
+    for index, token in enumerate(tokens):
+        if index == hidden:
+            _draw_banana(draw, (x, 70, x + 70, 130))
+            x += 90
+            continue
+        draw.text((x, 55), token, fill='#1F2937', font=font)
+        x += int(draw.textlength(token, font=font)) + 25
+
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG', optimize=False)
+    return buffer.getvalue(), solution
+
+
+class PuzzleImageStore:
+    """Content-addressed directory of puzzle images (``<root>/<ab>/<sha256>.png``)."""
+
+    def __init__(self, root, base_url):
+        self.root = Path(root)
+        self.base_url = base_url if base_url.endswith('/') else base_url + '/'
+
+    def relative_path(self, digest):
+        return f"{digest[:2]}/{digest}.png"
+
+    def put(self, data):
+        """Store ``data`` and return its digest. Existing content is not rewritten."""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.root / self.relative_path(digest)
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(f'.{os.getpid()}.{threading.get_ident()}.tmp')
+            tmp.write_bytes(data)
+            os.replace(tmp, path)
+        return digest
+
+    def url(self, digest):
+        return self.base_url + self.relative_path(digest)
+
+
+def get_store():
+    return PuzzleImageStore(settings.PUZZLE_STORE_DIR, settings.PUZZLE_STORE_URL)
+
+
+def generate_into_store(seed, store_root, base_url):
+    """Render one puzzle into the store. Module-level so process pools can pickle it."""
+    data, solution = render_puzzle(seed)
+    digest = PuzzleImageStore(store_root, base_url).put(data)
+    return digest, solution
+
+
+class LocalPuzzleSource:
+    """Serves puzzles from the pre-generated corpus, rendering new ones when it is empty."""
+
+    def __init__(self, store, manifest_path):
+        self.store = store
+        self.manifest_path = Path(manifest_path)
+        self._corpus = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        corpus = []
+        if self.manifest_path.exists():
+            with self.manifest_path.open() as fh:
+                for line in fh:
+                    if line.strip():
+                        entry = json.loads(line)
+                        corpus.append((entry['digest'], entry['solution']))
+        return corpus
+
+    @property
+    def corpus(self):
+        if self._corpus is None:
+            with self._lock:
+                if self._corpus is None:
+                    self._corpus = self._load()
+        return self._corpus
+
+    def __call__(self):
+        if self.corpus:
+            digest, solution = random.choice(self.corpus)
+        else:
+            data, solution = render_puzzle(random.getrandbits(64))
+            digest = self.store.put(data)
+        return {"question": self.store.url(digest), "solution": solution}
+
+
+def append_manifest(manifest_path, entries):
+    manifest_path = Path(manifest_path)
+    manifest_path.parent.mkdir(parents=True, exist_ok=True)
+    with manifest_path.open('a') as fh:
+        for digest, solution in entries:
+            fh.write(json.dumps({"digest": digest, "solution": solution}) + '\n')
+
+
+_source = None
+
+
+def get_local_source():
+    global _source
+    if _source is None:
+        _source = LocalPuzzleSource(get_store(), settings.PUZZLE_CORPUS_MANIFEST)
+    return _source
+
+
+def reset_local_source():
+    global _source
+    _source = None
+
+
+@receiver(setting_changed)
+def _reset_on_setting_change(setting, **kwargs):
+    if setting in ('PUZZLE_STORE_DIR', 'PUZZLE_STORE_URL', 'PUZZLE_CORPUS_MANIFEST'):
+        reset_local_source()
+
+
+def generate_local_puzzle():
+    return get_local_source()()
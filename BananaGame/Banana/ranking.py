@@ -0,0 +1,229 @@
+"""
+In-memory ranked leaderboard.
+
+Players are kept in an indexable skip list ordered like ``LeaderboardEntry``
+(best score descending, then earliest ``achieved_at``, then user id), which
+gives O(log n) rank-of-user, top-N and "around me" lookups. The index is
+built from ``LeaderboardEntry`` on first use and kept current by
+submit_score after each commit. Every worker process holds its own copy, so
+call ``rebuild()`` (or ``reset_ranking()``) if scores are written elsewhere.
+"""
+import random
+import threading
+
+from .models import LeaderboardEntry
+
+MAX_LEVELS = 24
+
+
+class _Node:
+    __slots__ = ('key', 'value', 'next', 'width')
+
+    def __init__(self, key, value, levels):
+        self.key = key
+        self.value = value
+        self.next = [None] * levels
+        # width[i]: number of bottom-level steps from this node to next[i].
+        self.width = [1] * levels
+
+
+class IndexableSkipList:
+    """Sorted container with O(log n) insert, remove, rank and positional access."""
+
+    def __init__(self, rng=None):
+        self._rng = rng or random.Random()
+        self.head = _Node(None, None, MAX_LEVELS)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def _random_level(self):
+        level = 1
+        while level < MAX_LEVELS and self._rng.random() < 0.5:
+            level += 1
+        return level
+
+    def _search(self, key):
+        chain = [None] * MAX_LEVELS
+        steps = [0] * MAX_LEVELS
+        node = self.head
+        for level in reversed(range(MAX_LEVELS)):
+            while node.next[level] is not None and node.next[level].key < key:
+                steps[level] += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+        return chain, steps
+
+    def insert(self, key, value=None):
+        chain, steps_at_level = self._search(key)
+        levels = self._random_level()
+        new = _Node(key, value, levels)
+        steps = 0
+        for level in range(levels):
+            prev = chain[level]
+            new.next[level] = prev.next[level]
+            prev.next[level] = new
+            new.width[level] = prev.width[level] - steps
+            prev.width[level] = steps + 1
+            steps += steps_at_level[level]
+        for level in range(levels, MAX_LEVELS):
+            chain[level].width[level] += 1
+        self.size += 1
+
+    def remove(self, key):
+        chain, _ = self._search(key)
+        target = chain[0].next[0]
+        if target is None or target.key != key:
+            raise KeyError(key)
+        for level in range(len(target.next)):
+            prev = chain[level]
+            prev.width[level] += target.width[level] - 1
+            prev.next[level] = target.next[level]
+        for level in range(len(target.next), MAX_LEVELS):
+            chain[level].width[level] -= 1
+        self.size -= 1
+
+    def index(self, key):
+        """0-based position of ``key``."""
+        node = self.head
+        position = 0
+        for level in reversed(range(MAX_LEVELS)):
+            while node.next[level] is not None and node.next[level].key < key:
+                position += node.width[level]
+                node = node.next[level]
+        found = node.next[0]
+        if found is None or found.key != key:
+            raise KeyError(key)
+        return position
+
+    def _node_at(self, index):
+        remaining = index + 1
+        node = self.head
+        for level in reversed(range(MAX_LEVELS)):
+            while node.next[level] is not None and node.width[level] <= remaining:
+                remaining -= node.width[level]
+                node = node.next[level]
+        return node
+
+    def slice(self, start, stop):
+        """Values at positions [start, stop)."""
+        start, stop = max(0, start), min(stop, self.size)
+        if start >= stop:
+            return []
+        node = self._node_at(start)
+        values = []
+        for _ in range(stop - start):
+            values.append(node.value)
+            node = node.next[0]
+        return values
+
+    @classmethod
+    def from_sorted(cls, items, rng=None):
+        """Build from ``(key, value)`` pairs already in key order, in O(n)."""
+        skiplist = cls(rng)
+        last = [skiplist.head] * MAX_LEVELS
+        last_position = [0] * MAX_LEVELS
+        position = 0
+        for key, value in items:
+            position += 1
+            node = _Node(key, value, skiplist._random_level())
+            for level in range(len(node.next)):
+                last[level].next[level] = node
+                last[level].width[level] = position - last_position[level]
+                last[level], last_position[level] = node, position
+        skiplist.size = position
+        for level in range(MAX_LEVELS):
+            last[level].width[level] = position + 1 - last_position[level]
+        return skiplist
+
+
+class RankedLeaderboard:
+    """Thread-safe rank index of each user's best score."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._index = IndexableSkipList()
+        self._keys = {}
+
+    @staticmethod
+    def _key(user_id, score, achieved_at):
+        return (-score, achieved_at.timestamp(), user_id)
+
+    def __len__(self):
+        return len(self._index)
+
+    def load(self, rows):
+        """Replace the contents with ``(user_id, username, score, achieved_at)`` rows."""
+        entries = sorted(
+            (self._key(user_id, score, achieved_at), {'user_id': user_id, 'username': username, 'score': score})
+            for user_id, username, score, achieved_at in rows
+        )
+        index = IndexableSkipList.from_sorted(entries)
+        keys = {value['user_id']: key for key, value in entries}
+        with self._lock:
+            self._index, self._keys = index, keys
+
+    def update(self, user_id, username, score, achieved_at):
+        """Record a best score. Returns False if the user already has an equal or better one."""
+        key = self._key(user_id, score, achieved_at)
+        with self._lock:
+            old_key = self._keys.get(user_id)
+            if old_key is not None:
+                if old_key[0] <= key[0]:
+                    return False
+                self._index.remove(old_key)
+            self._index.insert(key, {'user_id': user_id, 'username': username, 'score': score})
+            self._keys[user_id] = key
+            return True
+
+    def rank_of(self, user_id):
+        """1-based rank of ``user_id``, or None if they have no score."""
+        with self._lock:
+            key = self._keys.get(user_id)
+            return None if key is None else self._index.index(key) + 1
+
+    def _ranked(self, start, stop):
+        return [
+            {'rank': rank, 'username': value['username'], 'score': value['score']}
+            for rank, value in enumerate(self._index.slice(start, stop), start + 1)
+        ]
+
+    def top(self, n):
+        with self._lock:
+            return self._ranked(0, n)
+
+    def around(self, user_id, window=2):
+        """(rank, entries) for ``user_id`` and up to ``window`` players either side."""
+        with self._lock:
+            key = self._keys.get(user_id)
+            if key is None:
+                return None, []
+            position = self._index.index(key)
+            return position + 1, self._ranked(position - window, position + window + 1)
+
+
+_ranking = None
+_ranking_lock = threading.Lock()
+
+
+def rebuild():
+    """Build a fresh index from LeaderboardEntry and make it current."""
+    global _ranking
+    ranking = RankedLeaderboard()
+    ranking.load(LeaderboardEntry.objects.values_list('user_id', 'user__username', 'best_score', 'achieved_at'))
+    _ranking = ranking
+    return ranking
+
+
+def get_ranking():
+    if _ranking is None:
+        with _ranking_lock:
+            if _ranking is None:
+                rebuild()
+    return _ranking
+
+
+def reset_ranking():
+    global _ranking
+    _ranking = None
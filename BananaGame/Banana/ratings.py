@@ -0,0 +1,80 @@
+"""
+Rating totals without reading every Rating.
+
+``RatingSummary`` is a single row (pk 1) holding the number of ratings, the
+sum of their stars and a count per star. ``submit`` writes a user's rating
+and folds the change into that row with one ``UPDATE ... SET n = n + 1`` in
+the same transaction, and ratings deleted anywhere else (the admin, a
+deleted user) are subtracted by a post_delete handler, so ``summary`` reads
+one row however many ratings there are. ``bulk_create`` and queryset
+``update`` bypass both; call ``rebuild`` after those. A missing row is
+rebuilt on first use.
+"""
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Count, F
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .models import Rating, RatingSummary
+
+SUMMARY_PK = 1
+STARS = range(1, 6)
+
+
+def _star_field(stars):
+    return f'stars_{stars}'
+
+
+def rebuild():
+    """Recount the summary row from Rating."""
+    histogram = dict(Rating.objects.order_by().values_list('rating').annotate(n=Count('id')))
+    summary, _ = RatingSummary.objects.update_or_create(pk=SUMMARY_PK, defaults={
+        'count': sum(histogram.values()),
+        'total': sum(stars * n for stars, n in histogram.items()),
+        **{_star_field(stars): histogram.get(stars, 0) for stars in STARS},
+    })
+    return summary
+
+
+def apply_change(old, new):
+    """Fold one rating going from ``old`` to ``new`` stars (None: no rating) into the summary row."""
+    if old == new:
+        return
+    deltas = Counter()
+    if old is not None:
+        deltas.update({'count': -1, 'total': -old, _star_field(old): -1})
+    if new is not None:
+        deltas.update({'count': 1, 'total': new, _star_field(new): 1})
+    updates = {field: F(field) + delta for field, delta in deltas.items() if delta}
+    if not RatingSummary.objects.filter(pk=SUMMARY_PK).update(**updates):
+        rebuild()
+
+
+def submit(user, stars):
+    """Create or change ``user``'s rating. Returns ``(rating, created)``."""
+    with transaction.atomic():
+        rating, created = Rating.objects.select_for_update().get_or_create(user=user, defaults={'rating': stars})
+        if created:
+            apply_change(None, stars)
+            return rating, True
+        old = rating.rating
+        rating.rating = stars
+        rating.save(update_fields=['rating', 'updated_at'])
+        apply_change(old, stars)
+        return rating, False
+
+
+def summary():
+    row = RatingSummary.objects.filter(pk=SUMMARY_PK).first() or rebuild()
+    return {
+        'average_rating': round(row.total / row.count, 2) if row.count else 0,
+        'total_ratings': row.count,
+        'histogram': {str(stars): getattr(row, _star_field(stars)) for stars in STARS},
+    }
+
+
+@receiver(post_delete, sender=Rating)
+def _rating_deleted(sender, instance, **kwargs):
+    apply_change(instance.rating, None)
@@ -0,0 +1,355 @@
+"""
+Realtime leaderboard push over server-sent events.
+
+submit_score calls ``notify`` after commit when a score enters a top 10.
+Each worker process has one ``LeaderboardBroadcaster`` that coalesces those
+notifications: a daemon thread pushes at most once per
+``LEADERBOARD_STREAM['INTERVAL']`` seconds, reads each changed board once and
+publishes only the ranks that differ from its previous push. The broker then
+fans the pre-encoded message out to every subscribed connection.
+
+``InMemoryBroker``, which serves the connections of the current process, is
+the only broker there is. The broadcaster's ``seq`` numbers and the boards it
+diffs against are per process too, so each worker pushes to its own
+connections with its own sequence; a client that reconnects to another worker
+starts again from that worker's snapshot. ``Broker`` spells out the interface
+``LEADERBOARD_STREAM['BROKER']`` must provide. A broker shared between nodes
+(e.g. over Redis pub/sub) would also need one broadcaster, or shared seq and
+board state, so that nodes don't publish competing sequences.
+
+``/leaderboard/stream/`` is an async view and holds its connection open, so
+it must be served through ``BananaGame.asgi`` (uvicorn, daphne, ...).
+"""
+import asyncio
+import collections
+import json
+import logging
+import threading
+import time
+import typing
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import close_old_connections
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from . import leaderboard, leaderboard_cache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STREAM_SETTINGS = {
+    'BROKER': 'Banana.realtime.InMemoryBroker',
+    'INTERVAL': 1.0,
+    'KEEPALIVE': 15.0,
+    'QUEUE_SIZE': 16,
+}
+
+# Queued in place of a slow subscriber's backlog; the stream answers it with a fresh snapshot.
+RESYNC = object()
+
+
+def get_stream_settings():
+    return {**DEFAULT_STREAM_SETTINGS, **getattr(settings, 'LEADERBOARD_STREAM', {})}
+
+
+def format_event(event, data, event_id=None):
+    lines = [f'event: {event}']
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'data: {json.dumps(data, separators=(",", ":"))}')
+    return ('\n'.join(lines) + '\n\n').encode()
+
+
+class Subscription:
+    __slots__ = ('window', 'loop', 'queue')
+
+    def __init__(self, window, loop, queue_size):
+        self.window = window
+        self.loop = loop
+        self.queue = asyncio.Queue(queue_size)
+
+    def deliver(self, message):
+        """Queue ``message``; must run on ``self.loop``."""
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESYNC)
+
+
+def _deliver_all(subscriptions, message):
+    for subscription in subscriptions:
+        subscription.deliver(message)
+
+
+class Broker(typing.Protocol):
+    """What the broadcaster and ``event_stream`` need from a broker. ``publish`` may be called from any thread."""
+
+    def subscribe(self, window, loop=None):
+        """A new ``Subscription`` to ``window``, delivered on ``loop`` (default: the running loop)."""
+
+    def unsubscribe(self, subscription):
+        """Stop delivering to ``subscription``."""
+
+    def publish(self, window, message):
+        """Hand ``message`` to every subscription for ``window``. Returns how many there were."""
+
+    def has_subscribers(self, window):
+        """Whether any connection may be listening to ``window``; the broadcaster skips boards nobody is."""
+
+
+class InMemoryBroker:
+    def __init__(self, queue_size=16):
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        # window -> event loop -> subscriptions served by that loop
+        self._subscribers = collections.defaultdict(lambda: collections.defaultdict(set))
+
+    def subscribe(self, window, loop=None):
+        subscription = Subscription(window, loop or asyncio.get_running_loop(), self.queue_size)
+        with self._lock:
+            self._subscribers[window][subscription.loop].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            by_loop = self._subscribers.get(subscription.window, {})
+            group = by_loop.get(subscription.loop)
+            if group is not None:
+                group.discard(subscription)
+                if not group:
+                    del by_loop[subscription.loop]
+
+    def has_subscribers(self, window):
+        return bool(self._subscribers.get(window))
+
+    def count(self):
+        with self._lock:
+            return sum(len(group) for by_loop in self._subscribers.values() for group in by_loop.values())
+
+    def publish(self, window, message):
+        """Hand ``message`` to every subscription for ``window``. Returns how many there were."""
+        with self._lock:
+            groups = [(loop, list(group)) for loop, group in self._subscribers.get(window, {}).items()]
+        delivered = 0
+        for loop, group in groups:
+            try:
+                # One callback per event loop, not per connection.
+                loop.call_soon_threadsafe(_deliver_all, group, message)
+                delivered += len(group)
+            except RuntimeError:
+                # The loop has been closed; its connections are gone.
+                for subscription in group:
+                    self.unsubscribe(subscription)
+        return delivered
+
+
+def _fetch_board(window):
+    return leaderboard.top_entries(leaderboard.DEFAULT_TOP_N, window=window)
+
+
+def board_changes(previous, entries):
+    """Ranked entries of ``entries`` that differ from ``previous`` at the same rank."""
+    return [
+        {'rank': rank, **entry}
+        for rank, entry in enumerate(entries, 1)
+        if rank > len(previous) or previous[rank - 1] != entry
+    ]
+
+
+class LeaderboardBroadcaster:
+    """Coalesces top-N change notifications into at most one push per ``interval``."""
+
+    def __init__(self, broker, interval=1.0, fetch=_fetch_board):
+        self.broker = broker
+        self.interval = interval
+        self.fetch = fetch
+
+        self._lock = threading.Lock()
+        self._dirty = set()
+        # window -> (seq, utc day, entries) of the last push
+        self._boards = {}
+        self._last_push = float('-inf')
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+
+        self.notifications = 0
+        self.pushes = 0
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name='leaderboard-broadcaster', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stopping.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def notify(self, windows):
+        """Mark ``windows`` as changed; the next push publishes their deltas."""
+        with self._lock:
+            for window in windows:
+                if self.broker.has_subscribers(window):
+                    self._dirty.add(window)
+                else:
+                    # Nobody is listening, so the next listener must not diff against this board.
+                    self._boards.pop(window, None)
+            if not self._dirty:
+                return
+            self.notifications += 1
+        self.start()
+        self._wake.set()
+
+    def snapshot(self, window):
+        """``(seq, entries)`` last pushed for ``window`` today, or None."""
+        with self._lock:
+            seq, day, entries = self._boards.get(window, (0, None, None))
+        if day != leaderboard.utc_day(timezone.now()):
+            return None
+        return seq, entries
+
+    def last_seq(self, window):
+        with self._lock:
+            return self._boards.get(window, (0,))[0]
+
+    def flush(self, windows=None):
+        """
+        Publish a delta for each of ``windows`` (default: the changed ones) now.
+        Returns the number of messages published.
+        """
+        with self._lock:
+            if windows is None:
+                windows, self._dirty = self._dirty, set()
+            self._last_push = time.monotonic()
+        published = 0
+        today = leaderboard.utc_day(timezone.now())
+        for window in sorted(windows):
+            entries = self.fetch(window)
+            with self._lock:
+                seq, day, previous = self._boards.get(window, (0, None, []))
+                if day != today:
+                    previous = []
+                changes = board_changes(previous, entries)
+                if not changes and len(previous) == len(entries):
+                    continue
+                seq += 1
+                self._boards[window] = (seq, today, entries)
+            message = format_event('delta', {
+                'window': window, 'seq': seq, 'size': len(entries), 'changes': changes,
+            }, event_id=seq)
+            self.broker.publish(window, message)
+            published += 1
+        self.pushes += published
+        return published
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wake.wait()
+            self._wake.clear()
+            if self._stopping.is_set():
+                break
+            # Everything notified while we wait out the interval goes into one push.
+            delay = self._last_push + self.interval - time.monotonic()
+            if delay > 0 and self._stopping.wait(delay):
+                break
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Leaderboard broadcast failed")
+            finally:
+                close_old_connections()
+
+
+async def _snapshot_event(window, broadcaster):
+    pushed = broadcaster.snapshot(window)
+    if pushed is not None:
+        seq, entries = pushed
+    else:
+        seq = broadcaster.last_seq(window)
+        tag = await sync_to_async(leaderboard_cache.etag)(window)
+        entries = await sync_to_async(leaderboard_cache.top_entries)(window, tag)
+    return format_event('snapshot', {
+        'window': window, 'seq': seq,
+        'entries': [{'rank': rank, **entry} for rank, entry in enumerate(entries, 1)],
+    }, event_id=seq)
+
+
+async def event_stream(window, broker=None, broadcaster=None, keepalive=None):
+    """
+    Server-sent events for ``window``: a ``snapshot`` first, then ``delta``
+    events. Clients apply deltas whose ``seq`` is above the snapshot's.
+    """
+    broker = broker or get_broker()
+    broadcaster = broadcaster or get_broadcaster()
+    if keepalive is None:
+        keepalive = get_stream_settings()['KEEPALIVE']
+    # Subscribe before reading the snapshot so no push can fall between the two.
+    subscription = broker.subscribe(window)
+    try:
+        yield await _snapshot_event(window, broadcaster)
+        while True:
+            try:
+                message = await asyncio.wait_for(subscription.queue.get(), keepalive)
+            except asyncio.TimeoutError:
+                yield b': keepalive\n\n'
+                continue
+            if message is RESYNC:
+                message = await _snapshot_event(window, broadcaster)
+            yield message
+    finally:
+        broker.unsubscribe(subscription)
+
+
+_broker = None
+_broadcaster = None
+_stream_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        with _stream_lock:
+            if _broker is None:
+                conf = get_stream_settings()
+                _broker = import_string(conf['BROKER'])(queue_size=conf['QUEUE_SIZE'])
+    return _broker
+
+
+def get_broadcaster():
+    global _broadcaster
+    if _broadcaster is None:
+        broker = get_broker()
+        with _stream_lock:
+            if _broadcaster is None:
+                _broadcaster = LeaderboardBroadcaster(broker, interval=get_stream_settings()['INTERVAL'])
+    return _broadcaster
+
+
+def reset_stream():
+    """Stop the broadcaster and drop the broker; open streams keep their old subscriptions."""
+    global _broker, _broadcaster
+    with _stream_lock:
+        if _broadcaster is not None:
+            _broadcaster.stop(timeout=1)
+        _broker = _broadcaster = None
+
+
+@receiver(setting_changed)
+def _reset_on_setting_change(setting, **kwargs):
+    if setting == 'LEADERBOARD_STREAM':
+        reset_stream()
+
+
+def notify(windows):
+    """Called after a commit that changed the top N of ``windows``."""
+    get_broadcaster().notify(windows)
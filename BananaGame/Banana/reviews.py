@@ -0,0 +1,31 @@
+"""
+Cached count of approved reviews.
+
+get_reviews reports how many reviews are approved next to each page. The
+count is kept in the default cache for ``APPROVED_COUNT_TIMEOUT`` seconds
+and dropped whenever a Review is saved or deleted; the admin's bulk
+approve/disapprove actions use queryset ``update`` and drop it themselves.
+"""
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Review
+
+APPROVED_COUNT_KEY = 'reviews:approved_count'
+APPROVED_COUNT_TIMEOUT = 300
+
+
+def approved_count():
+    return cache.get_or_set(
+        APPROVED_COUNT_KEY, lambda: Review.objects.filter(is_approved=True).count(), APPROVED_COUNT_TIMEOUT
+    )
+
+
+def invalidate_approved_count():
+    cache.delete(APPROVED_COUNT_KEY)
+
+
+@receiver([post_save, post_delete], sender=Review)
+def _review_changed(sender, **kwargs):
+    invalidate_approved_count()
@@ -0,0 +1,144 @@
+"""
+Puzzle scoring.
+
+``score_solve`` is a pure function of the player's combo, the puzzle
+difficulty and the answer metadata. ``apply_solve``/``apply_miss`` persist the
+outcome as one conditional ``UPDATE`` built from ``F()`` expressions, so two
+answers racing for the same player cannot overwrite each other's XP, and
+only the columns that change are written. On SQLite the puzzle history is
+appended to by the same ``UPDATE`` with its JSON functions; elsewhere
+``apply_solve`` re-reads it with ``select_for_update`` in the transaction
+that ran the ``UPDATE`` and writes it back from there.
+"""
+import random
+from typing import NamedTuple
+
+from django.db import connections, router, transaction
+from django.db.models import F
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Greatest
+
+from .authentication import invalidate_user
+from .models import Player
+
+DIFFICULTY_MULTIPLIERS = {'easy': 0.7, 'medium': 1.0, 'hard': 1.5}
+XP_PER_LEVEL = 100
+PERFECT_BONUS = 10
+PERFECT_XP_BONUS = 5
+LUCKY_CHANCE = 0.05
+HISTORY_LIMIT = 50
+
+
+class SolveScore(NamedTuple):
+    base_points: float
+    time_bonus: float
+    combo_bonus: int
+    perfect_bonus: int
+    lucky_multiplier: float
+    total_points: int
+    xp_gained: int
+
+    @property
+    def perfect(self):
+        return self.perfect_bonus > 0
+
+
+def level_for_xp(xp):
+    return xp // XP_PER_LEVEL + 1
+
+
+def score_solve(combo_count, difficulty, time_taken=0, hints_used=0, rng=random):
+    """Points and XP for a correct answer given the combo the player had before it."""
+    base_points = 10 * DIFFICULTY_MULTIPLIERS.get(difficulty, 1.0)
+
+    time_bonus = max(0, (40 - time_taken) / 2) if time_taken > 0 else 0
+    time_bonus = min(time_bonus, 15)
+
+    combo_bonus = combo_count * 2
+    perfect_bonus = PERFECT_BONUS if hints_used == 0 else 0
+    lucky_multiplier = 2.0 if rng.random() < LUCKY_CHANCE else 1.0
+
+    total_points = int((base_points + time_bonus + combo_bonus + perfect_bonus) * lucky_multiplier)
+    xp_gained = total_points + (PERFECT_XP_BONUS if hints_used == 0 else 0)
+
+    return SolveScore(base_points, time_bonus, combo_bonus, perfect_bonus, lucky_multiplier,
+                      total_points, xp_gained)
+
+
+def _history_with(history, puzzle_id):
+    history = list(history or [])
+    if puzzle_id and puzzle_id not in history:
+        history.append(puzzle_id)
+    return history[-HISTORY_LIMIT:]
+
+
+def _history_append_sql(puzzle_id):
+    """``puzzle_history`` with ``puzzle_id`` appended unless present, oldest dropped past HISTORY_LIMIT (SQLite)."""
+    history = '"puzzle_history"'
+    appended = f"json_insert({history}, '$[#]', %s)"
+    return RawSQL(
+        f"CASE WHEN EXISTS (SELECT 1 FROM json_each({history}) WHERE value = %s) THEN {history} "
+        f"WHEN json_array_length({history}) >= %s THEN json_remove({appended}, '$[0]') "
+        f"ELSE {appended} END",
+        [puzzle_id, HISTORY_LIMIT, puzzle_id, puzzle_id],
+    )
+
+
+def _player_rows(player, puzzle_id, require_puzzle):
+    rows = Player.objects.filter(pk=player.pk)
+    if require_puzzle:
+        # Only the request that still sees the stored puzzle may consume it.
+        if puzzle_id:
+            rows = rows.filter(current_puzzle__question=puzzle_id)
+        else:
+            rows = rows.filter(current_puzzle__has_key='solution')
+    return rows
+
+
+def _update(player, puzzle_id, require_puzzle, updates):
+    updated = _player_rows(player, puzzle_id, require_puzzle).update(**updates) == 1
+    if updated:
+        # Queryset updates skip post_save, so drop the cached player here.
+        invalidate_user(player.user_id)
+    return updated
+
+
+def apply_solve(player, score, puzzle_id, clear_puzzle=False):
+    """
+    Persist a correct answer. Returns True if the row was updated, False if
+    ``clear_puzzle`` was requested and the stored puzzle had already been consumed.
+    """
+    new_xp = F('xp') + score.xp_gained
+    updates = {
+        'xp': new_xp,
+        'level': new_xp / XP_PER_LEVEL + 1,
+        'combo_count': F('combo_count') + 1,
+        'max_combo': Greatest('max_combo', F('combo_count') + 1),
+        'puzzles_solved': F('puzzles_solved') + 1,
+    }
+    if score.perfect:
+        updates['perfect_solves'] = F('perfect_solves') + 1
+    if clear_puzzle:
+        updates['current_puzzle'] = {}
+    if not puzzle_id:
+        return _update(player, puzzle_id, clear_puzzle, updates)
+    if connections[router.db_for_write(Player)].vendor == 'sqlite':
+        updates['puzzle_history'] = _history_append_sql(puzzle_id)
+        return _update(player, puzzle_id, clear_puzzle, updates)
+    with transaction.atomic():
+        if not _update(player, puzzle_id, clear_puzzle, updates):
+            return False
+        # The UPDATE above holds the row lock, so no other solve can append in between.
+        rows = Player.objects.filter(pk=player.pk)
+        history = rows.select_for_update().values_list('puzzle_history', flat=True).get()
+        if puzzle_id not in history:
+            rows.update(puzzle_history=_history_with(history, puzzle_id))
+    return True
+
+
+def apply_miss(player, puzzle_id, clear_puzzle=False):
+    """Persist a wrong answer (combo reset). Same return value as apply_solve."""
+    updates = {'combo_count': 0}
+    if clear_puzzle:
+        updates['current_puzzle'] = {}
+    return _update(player, puzzle_id, clear_puzzle, updates)
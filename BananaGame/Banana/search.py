@@ -0,0 +1,183 @@
+"""
+Full-text search over reviews and contact submissions.
+
+On SQLite with FTS5, each model in ``INDEXED`` gets an external-content
+FTS5 table, ``<db_table>_fts``, over its text columns. It stores only the
+token index, and the rows themselves stay in the model's table. Insert,
+delete and update triggers keep it in step, so no Python code has to
+remember to. ``match_q`` turns a search box string into a ``pk IN (...
+MATCH ...)`` filter and ``ranked`` annotates and orders by bm25 relevance. Both are index
+lookups instead of the ``LIKE '%term%'`` scans of ``search_fields``.
+
+Other databases, or SQLite built without FTS5, get the same functions
+answered with ``icontains`` over the same columns, ranked by recency.
+
+Rebuilding a model's table on SQLite (some ALTERs do) drops the triggers
+with it. ``rebuild_search_index`` reinstalls them and reindexes.
+"""
+import re
+
+from django.db import connections, router
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from .models import Contact, Review
+
+# model -> (indexed columns, bm25 weight per column)
+INDEXED = {
+    Review: (('title', 'content'), (5.0, 1.0)),
+    Contact: (('name', 'email', 'subject', 'message'), (3.0, 3.0, 2.0, 1.0)),
+}
+
+_WORD_RE = re.compile(r'\w+')
+# A shorter last word is matched whole: a one- or two-letter prefix expands
+# to a large part of the vocabulary and merges all of its doclists.
+MIN_PREFIX_LENGTH = 3
+_supported = {}
+
+
+def _connection(model):
+    return connections[router.db_for_read(model)]
+
+
+def fts_table(model):
+    return f'{model._meta.db_table}_fts'
+
+
+def install_sql(model, connection):
+    """Statements creating ``model``'s FTS5 table and sync triggers, if they don't exist."""
+    quote = connection.ops.quote_name
+    columns, _ = INDEXED[model]
+    table, fts = model._meta.db_table, fts_table(model)
+    pk = model._meta.pk.column
+    names = ', '.join(quote(column) for column in columns)
+    new = ', '.join(f'new.{quote(column)}' for column in columns)
+    old = ', '.join(f'old.{quote(column)}' for column in columns)
+    delete = f"INSERT INTO {quote(fts)}({quote(fts)}, rowid, {names}) VALUES ('delete', old.{quote(pk)}, {old});"
+    insert = f"INSERT INTO {quote(fts)}(rowid, {names}) VALUES (new.{quote(pk)}, {new});"
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {quote(fts)} USING fts5({names}, content='{table}', "
+        f"content_rowid='{pk}', tokenize='porter unicode61')",
+        f"CREATE TRIGGER IF NOT EXISTS {quote(fts + '_ai')} AFTER INSERT ON {quote(table)} BEGIN {insert} END",
+        f"CREATE TRIGGER IF NOT EXISTS {quote(fts + '_ad')} AFTER DELETE ON {quote(table)} BEGIN {delete} END",
+        f"CREATE TRIGGER IF NOT EXISTS {quote(fts + '_au')} AFTER UPDATE OF {names} ON {quote(table)} "
+        f"BEGIN {delete} {insert} END",
+    ]
+
+
+def drop_sql(model, connection):
+    quote = connection.ops.quote_name
+    fts = fts_table(model)
+    return [f"DROP TRIGGER IF EXISTS {quote(fts + suffix)}" for suffix in ('_ai', '_ad', '_au')] + [
+        f"DROP TABLE IF EXISTS {quote(fts)}",
+    ]
+
+
+def fts5_available(connection):
+    if connection.vendor != 'sqlite':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+        return bool(cursor.fetchone()[0])
+
+
+def install(connection):
+    """Create the FTS5 tables and triggers for every INDEXED model. False when FTS5 isn't available."""
+    _supported.clear()
+    if not fts5_available(connection):
+        return False
+    with connection.cursor() as cursor:
+        for model in INDEXED:
+            for statement in install_sql(model, connection):
+                cursor.execute(statement)
+    return True
+
+
+def uninstall(connection):
+    _supported.clear()
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for model in INDEXED:
+            for statement in drop_sql(model, connection):
+                cursor.execute(statement)
+
+
+def rebuild():
+    """
+    (Re)install the tables and triggers and reindex every INDEXED model from
+    its table. Returns ``{model label: rows indexed}``, or None without FTS5.
+    """
+    indexed = {}
+    for model in INDEXED:
+        connection = _connection(model)
+        if not install(connection):
+            return None
+        fts = connection.ops.quote_name(fts_table(model))
+        with connection.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+        indexed[model._meta.label] = model._default_manager.count()
+    return indexed
+
+
+def is_indexed(model):
+    """Whether ``model`` has a usable FTS5 table on its database (checked once per process)."""
+    if model not in _supported:
+        connection = _connection(model)
+        _supported[model] = connection.vendor == 'sqlite' and fts_table(model) in connection.introspection.table_names()
+    return _supported[model]
+
+
+def match_expression(text):
+    """
+    An FTS5 query for what a user typed: every word must appear, the last
+    one as a prefix if it has at least ``MIN_PREFIX_LENGTH`` characters.
+    Quoting each word keeps FTS5 operators and punctuation in ``text`` from
+    being parsed. None when ``text`` has no words.
+    """
+    words = _WORD_RE.findall(text)
+    if not words:
+        return None
+    expression = ' '.join(f'"{word}"' for word in words)
+    return expression + '*' if len(words[-1]) >= MIN_PREFIX_LENGTH else expression
+
+
+def match_q(model, text):
+    """A filter for ``model`` rows matching ``text``; ``Q(pk__in=[])`` when nothing can match."""
+    expression = match_expression(text)
+    if expression is None:
+        return Q(pk__in=[])
+    if is_indexed(model):
+        quote = _connection(model).ops.quote_name
+        fts = quote(fts_table(model))
+        return Q(pk__in=RawSQL(f"SELECT rowid FROM {fts} WHERE {fts} MATCH %s", [expression]))
+    columns, _ = INDEXED[model]
+    q = Q()
+    for word in _WORD_RE.findall(text):
+        q &= Q(*(Q(**{f'{column}__icontains': word}) for column in columns), _connector=Q.OR)
+    return q
+
+
+def ranked(queryset, text):
+    """``queryset`` narrowed to rows matching ``text``, best match first (newest first without FTS5)."""
+    model = queryset.model
+    expression = match_expression(text)
+    if expression is None:
+        return queryset.none()
+    if not is_indexed(model):
+        return queryset.filter(match_q(model, text)).order_by('-created_at', '-id')
+    connection = _connection(model)
+    quote = connection.ops.quote_name
+    fts, table = quote(fts_table(model)), quote(model._meta.db_table)
+    _, weights = INDEXED[model]
+    # bm25() only has a value in the MATCH query itself, so the scores are
+    # computed once into a CTE and each matching row looks its own up. Without
+    # MATERIALIZED SQLite may flatten that into one MATCH per row.
+    materialized = 'MATERIALIZED ' if connection.Database.sqlite_version_info >= (3, 35) else ''
+    rank = RawSQL(
+        f"WITH ranks AS {materialized}(SELECT rowid AS id, bm25({fts}, {', '.join(map(str, weights))}) AS score "
+        f"FROM {fts} WHERE {fts} MATCH %s) "
+        f"SELECT score FROM ranks WHERE id = {table}.{quote(model._meta.pk.column)}",
+        [expression],
+    )
+    return queryset.filter(match_q(model, text)).annotate(search_rank=rank).order_by('search_rank', '-id')
@@ -1,6 +1,8 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
+from django.contrib.auth.validators import UnicodeUsernameValidator
 from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 from django.contrib.auth import authenticate
 from rest_framework_simplejwt.tokens import RefreshToken
@@ -15,13 +17,8 @@ def validate_register_data(data):
     
     if data.get('password') != data.get('confirm_password'):
         raise ValidationError({"confirm_password": "Passwords don't match"})
-    
-    if User.objects.filter(email=data['email']).exists():
-        raise ValidationError({"email": "Email already exists"})
-    
-    if User.objects.filter(username=data['username']).exists():
-        raise ValidationError({"username": "Username taken"})
-    
+
+    # Taken usernames and emails are left to the unique indexes; see RegisterSerializer.create.
     return data
 
 class RegisterSerializer(serializers.ModelSerializer):
@@ -33,21 +30,47 @@ class RegisterSerializer(serializers.ModelSerializer):
         extra_kwargs = {
             'password': {'write_only': True},
             'email': {'required': True},
-            'username': {'required': True},
+            # Without the UniqueValidator's query; the unique index decides.
+            'username': {'required': True, 'validators': [UnicodeUsernameValidator()]},
         }
 
     def validate(self, data):
         return validate_register_data(data)
 
     def create(self, validated_data):
+        """
+        Insert the User and their Player in one transaction. A taken username
+        or email fails the insert and is raised as the ValidationError the
+        old ``exists()`` checks gave.
+        """
         validated_data.pop('confirm_password')
-        user = User.objects.create_user(
-            username=validated_data['username'],
-            email=validated_data['email'],
-            password=validated_data['password']
+        # The async register view hashes on Banana.hashing's pool and passes the result in.
+        password_hash = validated_data.pop('password_hash', None)
+        user = User(
+            username=User.normalize_username(validated_data['username']),
+            email=User.objects.normalize_email(validated_data['email']),
         )
+        if password_hash:
+            user.password = password_hash
+        else:
+            user.set_password(validated_data['password'])
+        try:
+            with transaction.atomic():
+                user.save()
+                Player.objects.create(user=user)
+        except IntegrityError:
+            if User.objects.filter(username=user.username).exists():
+                message = User._meta.get_field('username').error_messages['unique']
+                raise serializers.ValidationError({"username": [message]})
+            raise serializers.ValidationError({"email": ["Email already exists"]})
         return user
 
+
+class LoginSerializer(serializers.Serializer):
+    """Field checks for the async login view; the password is checked in Banana.hashing."""
+    username = serializers.CharField()
+    password = serializers.CharField()
+
 class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
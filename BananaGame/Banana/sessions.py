@@ -0,0 +1,42 @@
+"""
+Revoking JWT sessions in bulk.
+
+Every refresh token simplejwt issues is recorded as an ``OutstandingToken``;
+blacklisting it ends that session. ``revoke_all_sessions`` reads the ids of
+a chunk of users' live tokens that aren't blacklisted yet, then inserts
+their blacklist rows with one ``bulk_create(ignore_conflicts=True)``: a token
+blacklisted concurrently (a logout racing a logout-all) hits the unique
+``token_id`` and is skipped instead of failing the whole insert. Expired
+tokens are left alone: they can't be refreshed anyway, and Banana.purge
+deletes them.
+"""
+from django.db import router
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+
+USER_CHUNK_SIZE = 500
+TOKEN_BATCH_SIZE = 1000
+
+
+def revoke_all_sessions(user_ids, now=None):
+    """
+    Blacklist every live outstanding token of ``user_ids``. Returns the number
+    of tokens found unrevoked (a concurrent revoke may have beaten us to some).
+    """
+    user_ids = list(user_ids)
+    now = now or timezone.now()
+    db = router.db_for_write(BlacklistedToken)
+    revoked = 0
+    for start in range(0, len(user_ids), USER_CHUNK_SIZE):
+        token_ids = list(
+            OutstandingToken.objects.using(db)
+            .filter(user_id__in=user_ids[start:start + USER_CHUNK_SIZE], expires_at__gt=now,
+                    blacklistedtoken__isnull=True)
+            .values_list('id', flat=True)
+        )
+        BlacklistedToken.objects.using(db).bulk_create(
+            [BlacklistedToken(token_id=token_id) for token_id in token_ids],
+            batch_size=TOKEN_BATCH_SIZE, ignore_conflicts=True,
+        )
+        revoked += len(token_ids)
+    return revoked
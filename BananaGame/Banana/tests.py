@@ -1,3 +1,1904 @@
-from django.test import TestCase
+import asyncio
+import importlib
+import io
+import json
+import random
+import re
+import smtplib
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from pathlib import Path
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
-# Create your tests here.
+from django.apps import apps as django_apps
+from django.contrib import admin
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.contrib.auth.signals import user_login_failed
+from django.core.management import call_command
+from django.core import mail
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.mail.backends import locmem
+from django.db import connection
+from django.db.models import Max, QuerySet
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework import serializers as drf_serializers
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from . import (
+    certificates, hashing, jobs, leaderboard, leaderboard_cache, otp, outbox, purge, puzzle_pool, puzzle_tokens,
+    puzzlegen, ranking, ratings, realtime, scoring, search, sessions, throttling, upstream,
+)
+from .admin import ContactAdmin, ReviewAdmin
+from .models import (
+    Contact, DailyBest, LeaderboardEntry, OTP, OutboxEmail, Player, Rating, RatingSummary, Review, Score,
+)
+from .puzzle_pool import PuzzlePool
+from .serializers import RegisterSerializer
+from .upstream import CircuitBreaker, PuzzleFetchError, UpstreamClient, UpstreamUnavailable
+
+
+class StubPuzzleServer:
+    """Local HTTP server standing in for the upstream banana API."""
+
+    def __init__(self):
+        self.requests = 0
+        self.status = 200
+        self.fail_next = 0
+        self.delay = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                stub.requests += 1
+                if stub.delay:
+                    time.sleep(stub.delay)
+                status = stub.status
+                if stub.fail_next:
+                    stub.fail_next -= 1
+                    status = 500
+                body = json.dumps({
+                    "question": f"https://example.test/puzzle/{stub.requests}.png",
+                    "solution": stub.requests % 10,
+                }).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        class Server(ThreadingHTTPServer):
+            def handle_error(self, request, client_address):
+                pass  # clients that time out on purpose leave broken pipes behind
+
+        self.server = Server(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/api.php"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class PuzzlePoolTests(TestCase):
+    def setUp(self):
+        self.stub = StubPuzzleServer()
+        self.addCleanup(self.stub.close)
+        self.addCleanup(puzzle_pool.reset_pool)
+
+    def test_refill_tops_up_to_high_watermark(self):
+        with override_settings(PUZZLE_API_URL=self.stub.url):
+            pool = PuzzlePool(upstream.fetch_puzzle, low_watermark=2, high_watermark=5)
+            self.assertEqual(pool.refill(), 5)
+            self.assertEqual(len(pool), 5)
+            self.assertEqual(self.stub.requests, 5)
+
+    def test_get_serves_from_pool_and_falls_back_when_empty(self):
+        with override_settings(PUZZLE_API_URL=self.stub.url):
+            pool = PuzzlePool(upstream.fetch_puzzle, low_watermark=0, high_watermark=1)
+            pool.refill()
+            self.assertIn('question', pool.get())
+            self.assertIn('question', pool.get())
+            stats = pool.stats()
+            self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+            self.assertEqual(stats['hit_rate'], 0.5)
+
+    def test_refiller_thread_keeps_pool_topped_up(self):
+        with override_settings(PUZZLE_API_URL=self.stub.url):
+            pool = PuzzlePool(upstream.fetch_puzzle, low_watermark=1, high_watermark=4,
+                              refill_interval=0.05)
+            pool.start()
+            self.addCleanup(pool.stop, 1)
+            deadline = time.monotonic() + 2
+            while len(pool) < 4 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(len(pool), 4)
+
+    def test_fetch_puzzle_view_hides_solution(self):
+        user = User.objects.create_user(username='pooluser')
+        client = APIClient()
+        client.force_authenticate(user)
+        with override_settings(PUZZLE_API_URL=self.stub.url):
+            res = client.get('/banana/puzzle/')
+        self.assertEqual(res.status_code, 200)
+        self.assertNotIn('solution', res.json())
+        self.assertIn('solution', Player.objects.get(user=user).current_puzzle)
+
+    def test_upstream_outage_returns_degraded_response(self):
+        self.stub.status = 503
+        user = User.objects.create_user(username='pooluser')
+        client = APIClient()
+        client.force_authenticate(user)
+        with override_settings(PUZZLE_API_URL=self.stub.url, PUZZLE_POOL={'ENABLED': False}):
+            res = client.get('/banana/puzzle/')
+        self.assertEqual(res.status_code, 503)
+        self.assertTrue(res.json()['degraded'])
+
+
+class UpstreamClientTests(TestCase):
+    def setUp(self):
+        self.stub = StubPuzzleServer()
+        self.addCleanup(self.stub.close)
+
+    def make_client(self, **kwargs):
+        options = {'retries': 2, 'backoff_base': 0.001, 'backoff_max': 0.01, 'read_timeout': 0.5}
+        options.update(kwargs)
+        client = UpstreamClient(self.stub.url, **options)
+        self.addCleanup(client.close)
+        return client
+
+    def test_retries_transient_errors(self):
+        self.stub.fail_next = 2
+        client = self.make_client()
+        self.assertIn('solution', client.fetch_puzzle())
+        snapshot = client.metrics.snapshot()
+        self.assertEqual((snapshot['retries'], snapshot['failures'], snapshot['successes']), (2, 2, 1))
+
+    def test_timeout_counts_as_failure(self):
+        self.stub.delay = 0.3
+        client = self.make_client(retries=0, read_timeout=0.05)
+        with self.assertRaises(UpstreamUnavailable):
+            client.fetch_puzzle()
+        self.assertEqual(client.metrics.snapshot()['failures'], 1)
+
+    def test_circuit_opens_and_short_circuits(self):
+        self.stub.status = 500
+        client = self.make_client(retries=0, failure_threshold=3, reset_timeout=60)
+        for _ in range(3):
+            with self.assertRaises(UpstreamUnavailable):
+                client.fetch_puzzle()
+        self.assertEqual(client.breaker.state, CircuitBreaker.OPEN)
+
+        with self.assertRaises(UpstreamUnavailable) as ctx:
+            client.fetch_puzzle()
+        self.assertEqual(self.stub.requests, 3)
+        self.assertGreater(ctx.exception.retry_after, 0)
+        self.assertEqual(client.metrics.snapshot()['short_circuited'], 1)
+
+    def test_retries_stop_at_the_deadline(self):
+        self.stub.status = 500
+        self.stub.delay = 0.1
+        client = self.make_client(retries=10, deadline=0.25)
+        start = time.monotonic()
+        with self.assertRaises(UpstreamUnavailable):
+            client.fetch_puzzle()
+        self.assertLess(time.monotonic() - start, 0.5)
+        self.assertLessEqual(self.stub.requests, 3)
+
+    def test_client_error_leaves_the_circuit_half_open(self):
+        now = [0.0]
+        client = self.make_client(retries=0)
+        client.breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10, clock=lambda: now[0])
+        client.breaker.record_failure()
+        now[0] = 11
+        self.stub.status = 404
+        with self.assertRaises(PuzzleFetchError) as ctx:
+            client.fetch_puzzle()
+        self.assertEqual(ctx.exception.status_code, 404)
+        self.assertEqual(client.breaker.state, CircuitBreaker.HALF_OPEN)
+        # The probe slot is free again for the next call.
+        self.assertTrue(client.breaker.allow())
+
+    def test_half_open_probe_closes_circuit(self):
+        now = [0.0]
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10, clock=lambda: now[0])
+        breaker.record_failure()
+        self.assertFalse(breaker.allow())
+        now[0] = 11
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_open_circuit_serves_degraded_response(self):
+        self.stub.status = 500
+        user = User.objects.create_user(username='degraded')
+        client = APIClient()
+        client.force_authenticate(user)
+        upstream_conf = {'RETRIES': 0, 'FAILURE_THRESHOLD': 1, 'RESET_TIMEOUT': 60}
+        with override_settings(PUZZLE_API_URL=self.stub.url, PUZZLE_UPSTREAM=upstream_conf,
+                               PUZZLE_POOL={'ENABLED': False}):
+            client.get('/banana/puzzle/')
+            res = client.get('/banana/puzzle/')
+        self.assertEqual(self.stub.requests, 1)
+        self.assertEqual(res.status_code, 503)
+        self.assertIn('Retry-After', res)
+        self.assertNotIn('Traceback', res.json()['error'])
+
+
+class LocalPuzzlesMixin:
+    """Serve puzzles from the local generator in a temporary store."""
+
+    def use_local_puzzles(self, **extra_settings):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = Path(tmp.name)
+        overrides = override_settings(
+            PUZZLE_SOURCE='local',
+            PUZZLE_STORE_DIR=self.root / 'puzzles',
+            PUZZLE_STORE_URL='http://testserver/media/puzzles/',
+            PUZZLE_CORPUS_MANIFEST=self.root / 'corpus.jsonl',
+            PUZZLE_POOL={'ENABLED': False},
+            **extra_settings
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def make_client(self, username):
+        user = User.objects.create_user(username=username)
+        client = APIClient()
+        client.force_authenticate(user)
+        return user, client
+
+
+class PuzzleGeneratorTests(LocalPuzzlesMixin, TestCase):
+    def setUp(self):
+        self.use_local_puzzles()
+
+    def test_render_is_deterministic_and_content_addressed(self):
+        data, solution = puzzlegen.render_puzzle(42)
+        self.assertEqual(puzzlegen.render_puzzle(42), (data, solution))
+        self.assertIn(solution, range(10))
+
+        store = puzzlegen.get_store()
+        digest = store.put(data)
+        self.assertEqual(store.put(data), digest)
+        self.assertEqual((self.root / 'puzzles' / store.relative_path(digest)).read_bytes(), data)
+
+    def test_every_equation_has_exactly_one_answer(self):
+        apply = {'+': lambda a, b: a + b, '-': lambda a, b: a - b, 'x': lambda a, b: a * b}
+        for seed in range(2000):
+            tokens, hidden, solution = puzzlegen.make_equation(random.Random(seed))
+            a, op, b, _, c = tokens
+            answers = [
+                digit for digit in range(10)
+                if apply[op](*((digit, int(b)) if hidden == 0 else (int(a), digit))) == int(c)
+            ]
+            self.assertEqual(answers, [solution], tokens)
+
+    def test_generate_puzzles_command_builds_corpus(self):
+        call_command('generate_puzzles', count=5, workers=1, stdout=io.StringIO())
+        lines = (self.root / 'corpus.jsonl').read_text().splitlines()
+        self.assertEqual(len(lines), 5)
+        puzzle = puzzlegen.generate_local_puzzle()
+        digest = puzzle['question'].rsplit('/', 1)[1][:-4]
+        self.assertIn({"digest": digest, "solution": puzzle['solution']}, map(json.loads, lines))
+
+    def test_local_puzzle_round_trip_through_views(self):
+        user, client = self.make_client('localpuzzles')
+
+        res = client.get('/banana/puzzle/')
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res.json()['question'].startswith('http://testserver/media/puzzles/'))
+
+        solution = Player.objects.get(user=user).current_puzzle['solution']
+        res = client.post('/banana/check-puzzle/', {'answer': str(solution)}, format='json')
+        self.assertTrue(res.json()['correct'])
+
+
+class PuzzleTokenTests(LocalPuzzlesMixin, TestCase):
+    def setUp(self):
+        self.use_local_puzzles(PUZZLE_STATE_MODE='token')
+        cache.clear()
+        self.user, self.client = self.make_client('tokenplayer')
+
+    def fetch_token(self):
+        res = self.client.get('/banana/puzzle/')
+        self.assertEqual(res.status_code, 200)
+        body = res.json()
+        self.assertNotIn('solution', body)
+        return body['puzzle_token']
+
+    def solution_for(self, token):
+        return puzzle_tokens.recover_solution(puzzle_tokens.load(token, self.user.id))
+
+    def test_correct_answer_never_touches_current_puzzle(self):
+        token = self.fetch_token()
+        with CaptureQueriesContext(connection) as ctx:
+            res = self.client.post('/banana/check-puzzle/',
+                                   {'answer': self.solution_for(token), 'puzzle_token': token}, format='json')
+        self.assertTrue(res.json()['correct'])
+        writes = [q['sql'] for q in ctx.captured_queries if q['sql'].startswith('UPDATE')]
+        self.assertFalse(any('current_puzzle' in sql for sql in writes))
+        self.assertEqual(Player.objects.get(user=self.user).current_puzzle, {})
+
+    def test_token_cannot_be_replayed(self):
+        token = self.fetch_token()
+        answer = {'answer': self.solution_for(token), 'puzzle_token': token}
+        self.assertTrue(self.client.post('/banana/check-puzzle/', answer, format='json').json()['correct'])
+        res = self.client.post('/banana/check-puzzle/', answer, format='json')
+        self.assertEqual(res.status_code, 400)
+
+    def test_wrong_answer_reveals_solution(self):
+        token = self.fetch_token()
+        solution = self.solution_for(token)
+        wrong = str((int(solution) + 1) % 10)
+        res = self.client.post('/banana/check-puzzle/', {'answer': wrong, 'puzzle_token': token}, format='json')
+        self.assertEqual(res.json(), {"correct": False, "correct_answer": solution})
+
+    def test_tampered_foreign_and_expired_tokens_are_rejected(self):
+        token = self.fetch_token()
+        other, other_client = self.make_client('intruder')
+        self.assertEqual(other_client.post('/banana/check-puzzle/', {'answer': '1', 'puzzle_token': token},
+                                           format='json').status_code, 400)
+        self.assertEqual(self.client.post('/banana/check-puzzle/', {'answer': '1', 'puzzle_token': token[:-2] + 'xx'},
+                                          format='json').status_code, 400)
+        with override_settings(PUZZLE_TOKEN_MAX_AGE=-1):
+            res = self.client.post('/banana/check-puzzle/', {'answer': '1', 'puzzle_token': token}, format='json')
+        self.assertEqual(res.json()['error'], "Puzzle has expired. Please fetch again.")
+
+    def test_hint_uses_token(self):
+        token = self.fetch_token()
+        Player.objects.filter(user=self.user).update(hints=1)
+        res = self.client.post('/banana/use-hint/', {'puzzle_token': token}, format='json')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json()['hints_remaining'], 0)
+
+
+class FixedRandom:
+    def __init__(self, value):
+        self.value = value
+
+    def random(self):
+        return self.value
+
+
+class ScoringTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='scorer')
+        self.player = Player.objects.create(user=self.user, xp=95, level=1, combo_count=2, max_combo=2)
+
+    def test_score_solve_matches_documented_formula(self):
+        result = scoring.score_solve(combo_count=3, difficulty='hard', time_taken=20, hints_used=0,
+                                     rng=FixedRandom(0.5))
+        self.assertEqual(result.total_points, int(15 + 10 + 6 + 10))
+        self.assertEqual(result.xp_gained, result.total_points + 5)
+        lucky = scoring.score_solve(0, 'medium', 0, 1, rng=FixedRandom(0.01))
+        self.assertEqual((lucky.lucky_multiplier, lucky.total_points, lucky.perfect), (2.0, 20, False))
+
+    def test_apply_solve_updates_counters_and_level_in_sql(self):
+        result = scoring.score_solve(self.player.combo_count, 'medium', rng=FixedRandom(0.5))
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertTrue(scoring.apply_solve(self.player, result, 'q1'))
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertNotIn('"coins"', ctx.captured_queries[0]['sql'])
+        # The history append rides along in the same UPDATE.
+        self.assertIn('json_insert', ctx.captured_queries[0]['sql'])
+
+        self.player.refresh_from_db()
+        self.assertEqual(self.player.xp, 95 + result.xp_gained)
+        self.assertEqual(self.player.level, scoring.level_for_xp(self.player.xp))
+        self.assertEqual((self.player.combo_count, self.player.max_combo), (3, 3))
+        self.assertEqual((self.player.puzzles_solved, self.player.perfect_solves), (1, 1))
+        self.assertEqual(self.player.puzzle_history, ['q1'])
+
+    def test_stale_snapshots_do_not_lose_xp(self):
+        first = Player.objects.get(pk=self.player.pk)
+        second = Player.objects.get(pk=self.player.pk)
+        for snapshot in (first, second):
+            result = scoring.score_solve(snapshot.combo_count, 'medium', rng=FixedRandom(0.5))
+            scoring.apply_solve(snapshot, result, '')
+        self.player.refresh_from_db()
+        self.assertEqual(self.player.xp, 95 + 2 * result.xp_gained)
+        self.assertEqual(self.player.puzzles_solved, 2)
+
+    def test_stale_snapshots_do_not_lose_history(self):
+        first = Player.objects.get(pk=self.player.pk)
+        second = Player.objects.get(pk=self.player.pk)
+        result = scoring.score_solve(0, 'medium', rng=FixedRandom(0.5))
+        for snapshot, puzzle_id in ((first, 'q1'), (second, 'q2'), (first, 'q1')):
+            scoring.apply_solve(snapshot, result, puzzle_id)
+        self.player.refresh_from_db()
+        self.assertEqual(self.player.puzzle_history, ['q1', 'q2'])
+
+    def test_history_keeps_the_latest_puzzles(self):
+        Player.objects.filter(pk=self.player.pk).update(
+            puzzle_history=[f'q{i}' for i in range(scoring.HISTORY_LIMIT)])
+        result = scoring.score_solve(0, 'medium', rng=FixedRandom(0.5))
+        scoring.apply_solve(self.player, result, 'new')
+        self.player.refresh_from_db()
+        self.assertEqual(len(self.player.puzzle_history), scoring.HISTORY_LIMIT)
+        self.assertEqual(self.player.puzzle_history[0], 'q1')
+        self.assertEqual(self.player.puzzle_history[-1], 'new')
+
+    def test_stored_puzzle_without_a_question_is_still_consumed_once(self):
+        Player.objects.filter(pk=self.player.pk).update(current_puzzle={'solution': 3})
+        result = scoring.score_solve(0, 'medium', rng=FixedRandom(0.5))
+        self.assertTrue(scoring.apply_solve(self.player, result, '', clear_puzzle=True))
+        self.assertFalse(scoring.apply_solve(self.player, result, '', clear_puzzle=True))
+        self.assertFalse(scoring.apply_miss(self.player, '', clear_puzzle=True))
+
+    def test_stored_puzzle_is_consumed_once(self):
+        Player.objects.filter(pk=self.player.pk).update(current_puzzle={'question': 'q1', 'solution': 3})
+        self.player.refresh_from_db()
+        result = scoring.score_solve(0, 'medium', rng=FixedRandom(0.5))
+        self.assertTrue(scoring.apply_solve(self.player, result, 'q1', clear_puzzle=True))
+        self.assertFalse(scoring.apply_solve(self.player, result, 'q1', clear_puzzle=True))
+        self.assertFalse(scoring.apply_miss(self.player, 'q1', clear_puzzle=True))
+
+
+class ConcurrentScoringTests(LocalPuzzlesMixin, TransactionTestCase):
+    def test_parallel_answers_lose_no_xp(self):
+        self.use_local_puzzles(PUZZLE_STATE_MODE='token')
+        user, client = self.make_client('racer')
+        tokens = [client.get('/banana/puzzle/').json()['puzzle_token'] for _ in range(8)]
+        answers = [
+            {'answer': puzzle_tokens.recover_solution(puzzle_tokens.load(t, user.id)), 'puzzle_token': t}
+            for t in tokens
+        ]
+        gained = []
+        barrier = threading.Barrier(len(answers))
+
+        def answer(payload):
+            thread_client = APIClient()
+            thread_client.force_authenticate(user)
+            barrier.wait()
+            try:
+                res = thread_client.post('/banana/check-puzzle/', payload, format='json')
+                gained.append(res.json()['xp_gained'])
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=answer, args=(payload,)) for payload in answers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        player = Player.objects.get(user=user)
+        self.assertEqual(len(gained), len(answers))
+        self.assertEqual(player.xp, sum(gained))
+        self.assertEqual(player.puzzles_solved, len(answers))
+        self.assertEqual(player.level, scoring.level_for_xp(player.xp))
+        self.assertCountEqual(player.puzzle_history, {puzzle_tokens.load(t, user.id)['q'] for t in tokens})
+
+
+class FirstSubmitRace(QuerySet):
+    """A queryset whose first UPDATE is followed by another request's first submit: ``rival``'s row."""
+    rival = None
+
+    def update(self, **kwargs):
+        updated = super().update(**kwargs)
+        rival, FirstSubmitRace.rival = FirstSubmitRace.rival, None
+        if rival is not None:
+            self.model.objects.create(**rival)
+        return updated
+
+
+@override_settings(CERTIFICATE_CACHE={'PRERENDER': False}, JOB_RUNNER='immediate')
+class LeaderboardTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice')
+        self.bob = User.objects.create_user(username='bob')
+        self.client = APIClient()
+        cache.clear()
+        ranking.reset_ranking()
+        self.addCleanup(ranking.reset_ranking)
+
+    def submit(self, user, score):
+        self.client.force_authenticate(user)
+        with self.captureOnCommitCallbacks(execute=True):
+            res = self.client.post('/banana/submit-score/', {'score': score}, format='json')
+        self.assertEqual(res.status_code, 201)
+
+    def test_concurrent_first_submits_keep_the_higher_score(self):
+        now = timezone.now()
+        for model, extra in [(LeaderboardEntry, {}), (DailyBest, {'day': leaderboard.utc_day(now)})]:
+            for rival_score, ours, stored in [(10, 20, 20), (30, 25, 30)]:
+                model.objects.all().delete()
+                FirstSubmitRace.rival = {'user': self.alice, 'best_score': rival_score, 'achieved_at': now, **extra}
+                changed = leaderboard._upsert_best(FirstSubmitRace(model), ours, now, user=self.alice, **extra)
+                self.assertEqual(changed, ours > rival_score)
+                self.assertEqual(model.objects.get(user=self.alice).best_score, stored)
+
+    def test_submit_score_only_raises_best(self):
+        self.submit(self.alice, 50)
+        self.submit(self.alice, 30)
+        self.submit(self.alice, 70)
+        entry = LeaderboardEntry.objects.get(user=self.alice)
+        self.assertEqual(entry.best_score, 70)
+        self.assertEqual(entry.achieved_at, Score.objects.get(score=70).date)
+
+    def test_submit_expires_old_buckets(self):
+        old_day = leaderboard.utc_day(timezone.now()) - timedelta(days=30)
+        DailyBest.objects.create(user=self.bob, day=old_day, best_score=99, achieved_at=timezone.now() - timedelta(days=30))
+        self.submit(self.alice, 50)
+        self.assertFalse(DailyBest.objects.filter(day=old_day).exists())
+        self.assertEqual(list(DailyBest.objects.values_list('user__username', 'best_score')), [('alice', 50)])
+
+    def test_leaderboard_reads_entries(self):
+        self.submit(self.alice, 40)
+        self.submit(self.bob, 90)
+        with self.assertNumQueries(1):
+            res = self.client.get('/banana/leaderboard/')
+        self.assertEqual(res.json(), [{'username': 'bob', 'score': 90}, {'username': 'alice', 'score': 40}])
+
+    def test_backfill_matches_score_aggregation(self):
+        base = timezone.now()
+        for minute, (user, score) in enumerate([(self.alice, 10), (self.alice, 60), (self.bob, 60), (self.bob, 20)]):
+            Score.objects.filter(pk=Score.objects.create(user=user, score=score).pk).update(
+                date=base + timedelta(minutes=minute))
+        LeaderboardEntry.objects.create(user=self.bob, best_score=1, achieved_at=Score.objects.first().date)
+        out = io.StringIO()
+        call_command('backfill_leaderboard', chunk_size=1, stdout=out)
+        self.assertIn('Backfilled 2 leaderboard entries', out.getvalue())
+        self.assertEqual(
+            {(e.user.username, e.best_score) for e in LeaderboardEntry.objects.all()},
+            {('alice', 60), ('bob', 60)},
+        )
+        # Equal scores: whoever got there first ranks higher.
+        self.assertEqual([e['username'] for e in leaderboard.top_entries()], ['alice', 'bob'])
+
+    def test_migration_fills_entries_from_existing_scores(self):
+        fill = importlib.import_module('Banana.migrations.0016_backfill_leaderboard_entries').fill_leaderboard
+        for user, score in [(self.alice, 10), (self.alice, 60), (self.bob, 30)]:
+            Score.objects.create(user=user, score=score)
+        fill(django_apps, None)
+        self.assertEqual(
+            sorted(LeaderboardEntry.objects.values_list('user__username', 'best_score')),
+            [('alice', 60), ('bob', 30)],
+        )
+
+    @override_settings(CERTIFICATE_CACHE={'ENABLED': False})
+    def test_certificate_requires_top_three(self):
+        for index in range(4):
+            user = User.objects.create_user(username=f'top{index}')
+            self.submit(user, 100 - index)
+        res = self.client.get('/banana/certificate/')
+        self.assertEqual(res.status_code, 403)
+        self.client.force_authenticate(User.objects.get(username='top0'))
+        res = self.client.get('/banana/certificate/')
+        self.assertEqual(res['Content-Type'], 'application/pdf')
+
+    @override_settings(CERTIFICATE_CACHE={'ENABLED': False})
+    def test_certificate_rank_comes_from_the_table(self):
+        self.submit(self.alice, 50)
+        # Another worker's submits: in LeaderboardEntry, but not in this process's rank index.
+        now = timezone.now()
+        for index in range(3):
+            LeaderboardEntry.objects.create(
+                user=User.objects.create_user(username=f'elsewhere{index}'), best_score=90, achieved_at=now)
+        self.assertEqual(ranking.get_ranking().rank_of(self.alice.id), 1)
+        self.client.force_authenticate(self.alice)
+        self.assertEqual(self.client.get('/banana/certificate/').status_code, 403)
+        third = User.objects.get(username='elsewhere2')
+        with self.assertNumQueries(2):
+            self.assertEqual(leaderboard.rank_within(third, 3), (3, 90))
+        self.client.force_authenticate(third)
+        self.assertEqual(self.client.get('/banana/certificate/')['Content-Type'], 'application/pdf')
+
+
+@override_settings(JOB_RUNNER='immediate')
+class CertificateTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = Path(tmp.name)
+        override = override_settings(CERTIFICATE_CACHE={'DIR': self.root, 'MAX_BYTES': 10 * 1024 * 1024})
+        override.enable()
+        self.addCleanup(override.disable)
+        ranking.reset_ranking()
+        self.addCleanup(ranking.reset_ranking)
+        # A fresh runner per test, so its stats count only this test's jobs.
+        jobs.reset_runner()
+        self.user = User.objects.create_user(username='winner')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.set_score(100)
+
+    def set_score(self, score):
+        leaderboard.record_score(self.user, score, timezone.now())
+        ranking.reset_ranking()
+
+    def download(self, **headers):
+        res = self.client.get('/banana/certificate/', **headers)
+        body = b''.join(res.streaming_content) if res.streaming else res.content
+        return res, body
+
+    def test_repeat_downloads_are_served_from_the_store(self):
+        first, pdf = self.download()
+        self.assertEqual(first['Content-Type'], 'application/pdf')
+        self.assertIn('attachment; filename="Banana_Game_Certificate_winner_1st.pdf"', first['Content-Disposition'])
+        self.assertTrue(pdf.startswith(b'%PDF'))
+        second, again = self.download()
+        self.assertEqual(again, pdf)
+        self.assertEqual(second['ETag'], first['ETag'])
+        stats = certificates.get_store().stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+    def test_matching_etag_gets_304(self):
+        first, _ = self.download()
+        res, body = self.download(HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(body, b'')
+
+    def test_new_score_renders_a_new_certificate(self):
+        first, _ = self.download()
+        self.set_score(150)
+        second, _ = self.download(HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(second.status_code, 200)
+        self.assertNotEqual(second['ETag'], first['ETag'])
+        self.assertEqual(len(list(self.root.glob('*/*.pdf'))), 2)
+
+    def test_top_three_change_prerenders_certificates(self):
+        self.client.force_authenticate(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/banana/submit-score/', {'score': 500}, format='json')
+        key = certificates.certificate_key('winner', 1, 500, timezone.localdate())
+        self.assertTrue(certificates.get_store().path(key).exists())
+
+        res, _ = self.download()
+        self.assertEqual(res['ETag'], f'"{key}"')
+        stats = certificates.get_store().stats()
+        self.assertEqual((stats['prerendered'], stats['prerender_hits'], stats['misses']), (1, 1, 0))
+        self.assertEqual(stats['prerender_hit_rate'], 1.0)
+
+    def test_unchanged_top_three_is_not_requeued(self):
+        self.assertTrue(certificates.schedule_prerender())
+        self.assertFalse(certificates.schedule_prerender())
+        self.assertEqual(jobs.get_runner().stats()['completed'], 1)
+
+    def test_prerender_follows_the_table_not_the_rank_index(self):
+        ranking.get_ranking()
+        # Another worker's submit: in LeaderboardEntry, not in this process's rank index.
+        rival = User.objects.create_user(username='rival')
+        LeaderboardEntry.objects.create(user=rival, best_score=200, achieved_at=timezone.now())
+        self.assertTrue(certificates.schedule_prerender())
+        today = timezone.localdate()
+        store = certificates.get_store()
+        self.assertTrue(store.path(certificates.certificate_key('rival', 1, 200, today)).exists())
+        self.assertTrue(store.path(certificates.certificate_key('winner', 2, 100, today)).exists())
+        res, _ = self.download()
+        self.assertEqual(res['ETag'], f'"{certificates.certificate_key("winner", 2, 100, today)}"')
+
+    def test_prerender_command(self):
+        out = io.StringIO()
+        call_command('prerender_certificates', stdout=out)
+        self.assertIn('Pre-rendered 1 certificates', out.getvalue())
+        self.download()
+        self.assertEqual(certificates.get_store().stats()['prerender_hits'], 1)
+
+    def test_store_evicts_least_recently_used(self):
+        store = certificates.CertificateStore(self.root / 'lru', max_bytes=300)
+        for key in ('aa1', 'bb2', 'cc3'):
+            store.put(key, b'x' * 100)
+            time.sleep(0.01)
+        self.assertEqual(store.total_bytes(), 300)
+        store.open('aa1').close()
+        store.put('dd4', b'x' * 100)
+        self.assertIsNone(store.open('bb2'))
+        self.assertIsNotNone(store.open('aa1'))
+        self.assertEqual((store.total_bytes(), store.evictions), (300, 1))
+
+
+class JobRunnerTests(TestCase):
+    def test_thread_runner_collapses_queued_duplicates(self):
+        runner = jobs.ThreadRunner()
+        self.addCleanup(runner.stop, 1)
+        release, calls = threading.Event(), []
+
+        def blocker():
+            release.wait(2)
+
+        self.assertTrue(runner.submit(blocker))
+        self.assertTrue(runner.submit(calls.append, 1))
+        self.assertFalse(runner.submit(calls.append, 1))
+        release.set()
+        runner.join()
+        self.assertEqual(calls, [1])
+        self.assertEqual(runner.stats()['completed'], 2)
+
+    def test_failures_are_counted_not_raised(self):
+        runner = jobs.ImmediateRunner()
+        with self.assertLogs('Banana.jobs', 'ERROR'):
+            runner.submit(lambda: 1 / 0)
+        self.assertEqual(runner.stats()['failed'], 1)
+
+
+class CertificateRendererTests(TestCase):
+    DAY = datetime(2026, 1, 2).date()
+
+    def assertValidXref(self, pdf):
+        xref = int(pdf.rsplit(b'startxref\n', 1)[1].split()[0])
+        lines = pdf[xref:].split(b'\n')
+        self.assertEqual(lines[0], b'xref')
+        count = int(lines[1].split()[1])
+        for number, entry in enumerate(lines[3:count + 2], 1):
+            self.assertTrue(pdf[int(entry[:10]):].startswith(b'%d 0 obj\n' % number), number)
+
+    def test_overlay_keeps_the_file_consistent(self):
+        pdf = certificates.render_certificate('ann (1)', 2, 4321, self.DAY)
+        self.assertValidXref(pdf)
+        self.assertIn(b'(ann \\(1\\)) Tj', pdf)
+        self.assertIn(b'(Final Score: 4321 Points) Tj', pdf)
+        self.assertIn(b'(Date: January 02, 2026) Tj', pdf)
+        self.assertIn(b'(RUNNER-UP) Tj', pdf)
+        template = certificates.get_template(2)
+        self.assertTrue(pdf.startswith(template.prefix))
+        length = int(re.search(rb'/Length (\d+)', pdf[len(template.prefix):]).group(1))
+        self.assertGreater(length, len(template.static_ops))
+
+    def test_text_outside_cp1252_falls_back_to_reportlab(self):
+        pdf = certificates.render_certificate('\u5c0f\u660e', 1, 10, self.DAY)
+        self.assertTrue(pdf.startswith(b'%PDF'))
+
+    def test_any_template_failure_falls_back_to_reportlab(self):
+        class BrokenTemplate:
+            def render(self, username, score, day):
+                raise KeyError('F9')
+
+        self.addCleanup(certificates._templates.clear)
+        certificates._templates[1] = BrokenTemplate()
+        with self.assertLogs('Banana.certificates', 'ERROR'):
+            pdf = certificates.render_certificate('ann', 1, 10, self.DAY)
+        self.assertTrue(pdf.startswith(b'%PDF'))
+
+        certificates._templates[1] = None
+        self.assertEqual([warning.id for warning in certificates.check_templates()], ['Banana.W001'])
+        certificates._templates.clear()
+        self.assertEqual(certificates.check_templates(), [])
+
+    @override_settings(CERTIFICATE_RENDERER={'BACKEND': 'process', 'WORKERS': 1})
+    def test_process_pool_backend(self):
+        self.addCleanup(certificates.reset_executor)
+        pdf = certificates.render('ann', 3, 99, self.DAY)
+        self.assertValidXref(pdf)
+        self.assertIn(b'(THIRD PLACE) Tj', pdf)
+
+
+@override_settings(CERTIFICATE_CACHE={'PRERENDER': False}, JOB_RUNNER='immediate')
+class LeaderboardCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        for index in range(leaderboard.DEFAULT_TOP_N):
+            self.submit(User.objects.create_user(username=f'player{index}'), 100 + index)
+        leaderboard_cache.stats.reset()
+
+    def submit(self, user, score):
+        self.client.force_authenticate(user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/banana/submit-score/', {'score': score}, format='json')
+        self.client.force_authenticate(None)
+
+    def test_repeat_requests_are_served_from_cache(self):
+        first = self.client.get('/banana/leaderboard/')
+        with self.assertNumQueries(0):
+            second = self.client.get('/banana/leaderboard/')
+        self.assertEqual(first.json(), second.json())
+        self.assertEqual(first['ETag'], second['ETag'])
+        self.assertEqual(leaderboard_cache.stats.snapshot()['hits'], 1)
+        self.assertEqual(leaderboard_cache.stats.snapshot()['misses'], 1)
+
+    def test_matching_etag_gets_304_without_body(self):
+        tag = self.client.get('/banana/leaderboard/')['ETag']
+        with self.assertNumQueries(0):
+            res = self.client.get('/banana/leaderboard/', HTTP_IF_NONE_MATCH=tag)
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.content, b'')
+        self.assertEqual(res['ETag'], tag)
+        self.assertEqual(self.client.get('/banana/leaderboard/', HTTP_IF_NONE_MATCH='"stale"').status_code, 200)
+
+    def test_only_top_n_changes_invalidate(self):
+        tag = self.client.get('/banana/leaderboard/')['ETag']
+        # Below the current 10th place: every board's cached body stays valid.
+        self.submit(User.objects.create_user(username='low'), 5)
+        self.assertEqual(self.client.get('/banana/leaderboard/')['ETag'], tag)
+        self.assertEqual(leaderboard_cache.stats.snapshot()['invalidations'], 0)
+
+        self.submit(User.objects.create_user(username='high'), 500)
+        res = self.client.get('/banana/leaderboard/', HTTP_IF_NONE_MATCH=tag)
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res['ETag'], tag)
+        self.assertEqual(res.json()[0], {'username': 'high', 'score': 500})
+
+    def test_windows_have_separate_versions(self):
+        daily = self.client.get('/banana/leaderboard/', {'window': 'daily'})['ETag']
+        self.assertNotEqual(daily, self.client.get('/banana/leaderboard/', {'window': 'weekly'})['ETag'])
+        leaderboard_cache.invalidate({leaderboard.ALL_TIME})
+        self.assertEqual(self.client.get('/banana/leaderboard/', {'window': 'daily'})['ETag'], daily)
+
+    @override_settings(LEADERBOARD_CACHE={'ENABLED': False})
+    def test_disabled_cache_queries_every_time(self):
+        with self.assertNumQueries(1):
+            res = self.client.get('/banana/leaderboard/')
+        self.assertNotIn('ETag', res)
+
+
+class RankingTests(TestCase):
+    def test_skiplist_matches_sorted_list(self):
+        rng = random.Random(7)
+        skiplist = ranking.IndexableSkipList.from_sorted([(k, k) for k in range(0, 200, 2)], rng=rng)
+        model = list(range(0, 200, 2))
+        for step in range(2000):
+            key = rng.randrange(300)
+            if key in model:
+                skiplist.remove(key)
+                model.remove(key)
+            else:
+                skiplist.insert(key, key)
+                model.append(key)
+                model.sort()
+            if step % 100 == 0:
+                self.assertEqual(skiplist.slice(0, len(model)), model)
+        self.assertEqual(len(skiplist), len(model))
+        for position, key in enumerate(model):
+            self.assertEqual(skiplist.index(key), position)
+        self.assertEqual(skiplist.slice(5, 9), model[5:9])
+
+    def test_ranked_leaderboard_orders_by_score_then_time(self):
+        now = timezone.now()
+        board = ranking.RankedLeaderboard()
+        board.load([(1, 'ann', 50, now), (2, 'ben', 80, now), (3, 'cat', 50, now - timedelta(minutes=1))])
+        self.assertEqual([e['username'] for e in board.top(3)], ['ben', 'cat', 'ann'])
+        self.assertFalse(board.update(2, 'ben', 70, now))
+        self.assertTrue(board.update(1, 'ann', 90, now))
+        self.assertEqual(board.rank_of(1), 1)
+        rank, entries = board.around(3, window=1)
+        self.assertEqual((rank, [e['rank'] for e in entries]), (3, [2, 3]))
+        self.assertIsNone(board.rank_of(99))
+
+    def test_my_rank_endpoint(self):
+        ranking.reset_ranking()
+        self.addCleanup(ranking.reset_ranking)
+        users = [User.objects.create_user(username=f'ranked{i}') for i in range(6)]
+        for index, user in enumerate(users):
+            LeaderboardEntry.objects.create(user=user, best_score=index * 10, achieved_at=timezone.now())
+        client = APIClient()
+        client.force_authenticate(users[2])
+        res = client.get('/banana/leaderboard/me/?around=1')
+        self.assertEqual(res.status_code, 200)
+        body = res.json()
+        self.assertEqual((body['rank'], body['score'], body['total_players']), (4, 20, 6))
+        self.assertEqual([n['username'] for n in body['neighbours']], ['ranked3', 'ranked2', 'ranked1'])
+        # ``window`` is the board (all/daily/weekly) on the sibling endpoints, not a neighbour count here.
+        self.assertEqual(client.get('/banana/leaderboard/me/?window=daily').status_code, 200)
+        self.assertEqual(client.get('/banana/leaderboard/me/?around=x').status_code, 400)
+
+        client.force_authenticate(User.objects.create_user(username='unranked'))
+        self.assertEqual(client.get('/banana/leaderboard/me/').status_code, 404)
+
+
+@override_settings(JOB_RUNNER='immediate')
+class WindowedLeaderboardTests(TestCase):
+    # Sunday 2025-06-15 23:59:59 UTC is the last second of ISO week 24.
+    SUNDAY_NIGHT = datetime(2025, 6, 15, 23, 59, 59, tzinfo=dt_timezone.utc)
+    MONDAY_MORNING = datetime(2025, 6, 16, 0, 0, 0, tzinfo=dt_timezone.utc)
+
+    def setUp(self):
+        cache.clear()
+        self.users = {name: User.objects.create_user(username=name)
+                      for name in ('ann', 'ben', 'cat')}
+
+    def record(self, name, score, when):
+        return leaderboard.record_score(self.users[name], score, when)
+
+    def names(self, window, now):
+        return [(e['username'], e['score']) for e in leaderboard.top_entries(10, window=window, now=now)]
+
+    def test_daily_buckets_split_at_utc_midnight(self):
+        self.assertEqual(self.record('ann', 50, self.SUNDAY_NIGHT), {'all', 'daily', 'weekly'})
+        self.record('ben', 40, self.MONDAY_MORNING)
+        self.assertEqual(self.names('daily', self.SUNDAY_NIGHT), [('ann', 50)])
+        self.assertEqual(self.names('daily', self.MONDAY_MORNING), [('ben', 40)])
+        self.assertEqual(self.names('all', self.MONDAY_MORNING), [('ann', 50), ('ben', 40)])
+
+    def test_weekly_combines_days_of_the_iso_week_only(self):
+        monday = datetime(2025, 6, 9, 0, 0, tzinfo=dt_timezone.utc)
+        self.record('ann', 30, monday)
+        self.record('ann', 70, monday + timedelta(days=3))
+        self.record('ben', 60, monday + timedelta(days=1))
+        self.record('cat', 99, monday - timedelta(seconds=1))
+        self.assertEqual(self.names('weekly', self.SUNDAY_NIGHT), [('ann', 70), ('ben', 60)])
+        self.assertEqual(self.names('weekly', self.MONDAY_MORNING), [])
+
+    def test_weekly_ties_go_to_whoever_reached_the_score_first(self):
+        monday = datetime(2025, 6, 9, 0, 0, tzinfo=dt_timezone.utc)
+        # ann played first that week but only reached 80 on Thursday; ben had it on Tuesday.
+        self.record('ann', 10, monday)
+        self.record('ben', 80, monday + timedelta(days=1))
+        self.record('ann', 80, monday + timedelta(days=3))
+        self.assertEqual(self.names('weekly', self.SUNDAY_NIGHT), [('ben', 80), ('ann', 80)])
+
+    def test_bucket_expiry_waits_for_the_commit(self):
+        self.record('ann', 10, self.MONDAY_MORNING - timedelta(days=30))
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.record('ann', 20, self.MONDAY_MORNING)
+            self.assertEqual(DailyBest.objects.count(), 2)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(DailyBest.objects.count(), 1)
+
+    def test_lower_score_changes_nothing(self):
+        self.record('ann', 50, self.SUNDAY_NIGHT)
+        self.assertEqual(self.record('ann', 20, self.SUNDAY_NIGHT), set())
+        self.assertEqual(self.record('ann', 20, self.MONDAY_MORNING), {'daily', 'weekly'})
+
+    def test_expiry_keeps_retention_window(self):
+        for days_ago in (0, 6, 14, 15, 30):
+            self.record('ann', 10 + days_ago, self.MONDAY_MORNING - timedelta(days=days_ago))
+        deleted = leaderboard.expire_buckets(today=self.MONDAY_MORNING.date(), retention_days=14)
+        self.assertEqual(deleted, 2)
+        self.assertEqual(DailyBest.objects.count(), 3)
+
+    def test_leaderboard_window_parameter(self):
+        client = APIClient()
+        self.assertEqual(client.get('/banana/leaderboard/?window=daily').status_code, 200)
+        self.assertEqual(client.get('/banana/leaderboard/?window=monthly').status_code, 400)
+
+
+class RecordingBroker:
+    def __init__(self):
+        self.messages = []
+
+    def has_subscribers(self, window):
+        return True
+
+    def publish(self, window, message):
+        self.messages.append((window, json.loads(message.decode().split('data: ', 1)[1])))
+        return 1
+
+
+@override_settings(JOB_RUNNER='immediate')
+class RealtimeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        for index, score in enumerate((90, 80, 70)):
+            leaderboard.record_score(User.objects.create_user(username=f'p{index}'), score, timezone.now())
+
+    def test_board_changes_lists_only_moved_ranks(self):
+        previous = [{'username': 'a', 'score': 9}, {'username': 'b', 'score': 8}]
+        current = [{'username': 'a', 'score': 9}, {'username': 'c', 'score': 8}, {'username': 'b', 'score': 8}]
+        self.assertEqual(realtime.board_changes(previous, current), [
+            {'rank': 2, 'username': 'c', 'score': 8},
+            {'rank': 3, 'username': 'b', 'score': 8},
+        ])
+
+    def test_bursts_are_coalesced(self):
+        broker = RecordingBroker()
+        board = []
+        broadcaster = realtime.LeaderboardBroadcaster(broker, interval=0.3, fetch=lambda window: list(board))
+        self.addCleanup(broadcaster.stop, 1)
+        for score in range(50):
+            board.insert(0, {'username': f'u{score}', 'score': score})
+            broadcaster.notify({'all'})
+        deadline = time.monotonic() + 3
+        while (not broker.messages or broker.messages[-1][1]['size'] < 50) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertLessEqual(len(broker.messages), 2)
+        self.assertEqual(broker.messages[-1][1]['size'], 50)
+        self.assertEqual(broker.messages[-1][1]['changes'][0], {'rank': 1, 'username': 'u49', 'score': 49})
+
+    def test_unchanged_board_is_not_pushed(self):
+        broker = RecordingBroker()
+        broadcaster = realtime.LeaderboardBroadcaster(broker, fetch=lambda window: [{'username': 'a', 'score': 1}])
+        self.assertEqual(broadcaster.flush({'all'}), 1)
+        self.assertEqual(broadcaster.flush({'all'}), 0)
+
+    def test_no_listeners_means_no_broadcast(self):
+        broadcaster = realtime.LeaderboardBroadcaster(realtime.InMemoryBroker())
+        broadcaster.notify({'all', 'daily'})
+        self.assertIsNone(broadcaster._thread)
+
+    async def test_stream_sends_snapshot_then_deltas(self):
+        broker = realtime.InMemoryBroker()
+        board = [{'username': 'p0', 'score': 95}]
+        broadcaster = realtime.LeaderboardBroadcaster(broker, interval=0, fetch=lambda window: board)
+        self.addCleanup(broadcaster.stop, 1)
+        stream = realtime.event_stream('all', broker, broadcaster, keepalive=5)
+
+        snapshot = (await anext(stream)).decode()
+        self.assertTrue(snapshot.startswith('event: snapshot\nid: 0\n'))
+        self.assertEqual(json.loads(snapshot.split('data: ', 1)[1])['entries'][0],
+                         {'rank': 1, 'username': 'p0', 'score': 90})
+
+        broadcaster.notify({'all'})
+        delta = (await asyncio.wait_for(anext(stream), 2)).decode()
+        self.assertTrue(delta.startswith('event: delta\nid: 1\n'))
+        self.assertEqual(json.loads(delta.split('data: ', 1)[1])['changes'],
+                         [{'rank': 1, 'username': 'p0', 'score': 95}])
+
+        await stream.aclose()
+        self.assertEqual(broker.count(), 0)
+
+    async def test_slow_subscriber_is_resynced(self):
+        broker = realtime.InMemoryBroker(queue_size=2)
+        subscription = broker.subscribe('all')
+        for index in range(3):
+            broker.publish('all', b'message %d' % index)
+        await asyncio.sleep(0)
+        self.assertIs(await subscription.queue.get(), realtime.RESYNC)
+        self.assertTrue(subscription.queue.empty())
+
+    async def test_stream_endpoint(self):
+        self.addCleanup(realtime.reset_stream)
+        response = await self.async_client.get('/banana/leaderboard/stream/', {'window': 'daily'})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        first = await anext(aiter(response.streaming_content))
+        self.assertIn(b'event: snapshot', first)
+        await response.streaming_content.aclose()
+        bad = await self.async_client.get('/banana/leaderboard/stream/', {'window': 'monthly'})
+        self.assertEqual(bad.status_code, 400)
+
+
+@override_settings(JOB_RUNNER='immediate')
+class QueryPlanTests(TestCase):
+    """EXPLAIN QUERY PLAN for each hot query must use an index, not scan the table."""
+
+    @classmethod
+    def setUpTestData(cls):
+        users = User.objects.bulk_create([User(username=f'plan{i}') for i in range(50)])
+        now = timezone.now()
+        rng = random.Random(11)
+        Score.objects.bulk_create(
+            [Score(user=rng.choice(users), score=rng.randint(0, 1000)) for _ in range(2000)])
+        OTP.objects.bulk_create([
+            OTP(user=rng.choice(users), otp_code='123456', otp_type=OTP.EMAIL, contact_info='x@example.com',
+                expires_at=now + timedelta(minutes=rng.randint(-60, 10)), is_used=rng.random() < 0.8)
+            for _ in range(1000)
+        ])
+        Review.objects.bulk_create([
+            Review(user=rng.choice(users), title='t', content='c', is_approved=rng.random() < 0.5)
+            for _ in range(1000)
+        ])
+        OutboxEmail.objects.bulk_create([
+            OutboxEmail(subject='s', body='b', from_email='f@example.com', to=['x@example.com'],
+                        status=OutboxEmail.SENT if rng.random() < 0.95 else OutboxEmail.PENDING)
+            for _ in range(1000)
+        ])
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        cls.user = users[0]
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        # A bare "SCAN <table>" line is a full table scan; "SCAN ... USING INDEX" is fine.
+        self.assertNotRegex(plan, r'(?m)SCAN \w+$', plan)
+        self.assertNotIn('USE TEMP B-TREE', plan)
+        self.assertIn(index_name, plan)
+
+    def test_backfill_chunk_aggregate(self):
+        # Leaderboards read LeaderboardEntry; only the rebuild scans Score, by the user foreign key index.
+        chunk = Score.objects.filter(user_id__gte=self.user.id, user_id__lt=self.user.id + 10)
+        self.assertUsesIndex(chunk.values_list('user_id').annotate(Max('score')), 'Banana_score_user_id')
+
+    def test_live_otp_lookup(self):
+        live = OTP.objects.filter(user=self.user, otp_type=OTP.EMAIL, is_used=False,
+                                  expires_at__gt=timezone.now())
+        self.assertUsesIndex(live[:1], 'otp_unused_lookup_idx')
+
+    def test_approved_reviews(self):
+        self.assertUsesIndex(Review.objects.filter(is_approved=True), 'review_approved_created_idx')
+
+    def test_user_reviews(self):
+        self.assertUsesIndex(Review.objects.filter(user=self.user), 'review_user_created_idx')
+
+    def test_outbox_due_batch(self):
+        due = OutboxEmail.objects.filter(status=OutboxEmail.PENDING, next_attempt_at__lte=timezone.now())
+        self.assertUsesIndex(due.order_by('priority', 'next_attempt_at', 'id')[:50], 'outbox_due_idx')
+
+
+class FlakyEmailBackend(locmem.EmailBackend):
+    """locmem backend that counts connections and refuses addresses starting with 'bounce'."""
+    opened = 0
+
+    def open(self):
+        type(self).opened += 1
+        return super().open()
+
+    def send_messages(self, messages):
+        for message in messages:
+            if any(address.startswith('bounce') for address in message.to):
+                raise smtplib.SMTPRecipientsRefused({address: (550, b'No such user') for address in message.to})
+        return super().send_messages(messages)
+
+
+@override_settings(EMAIL_BACKEND='Banana.tests.FlakyEmailBackend', JOB_RUNNER='immediate',
+                   EMAIL_OUTBOX={'BATCH_SIZE': 10, 'MAX_ATTEMPTS': 3, 'BACKOFF': 30})
+class EmailOutboxTests(TestCase):
+    def setUp(self):
+        FlakyEmailBackend.opened = 0
+        cache.clear()
+        self.client = APIClient()
+
+    def test_request_returns_before_sending(self):
+        User.objects.create(username='otp-user', email='otp@example.com')
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post('/banana/login/request-otp/', {'email': 'otp@example.com'}, format='json')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(mail.outbox, [])
+        for callback in callbacks:
+            callback()
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn('Your OTP for Banana Game login is', mail.outbox[0].body)
+        # Queued ahead of other mail, and the code is gone from the table once sent.
+        email = OutboxEmail.objects.get()
+        self.assertEqual((email.priority, email.status, email.body), (OutboxEmail.PRIORITY_HIGH, OutboxEmail.SENT, ''))
+
+    def test_failed_secret_email_is_blanked_too(self):
+        email = outbox.send('otp', 'code 123456', ['bounce@example.com'], secret=True)
+        now = timezone.now()
+        with self.assertLogs('Banana.outbox', 'WARNING'):
+            for step in range(3):
+                outbox.drain(now=now + timedelta(hours=step))
+                email.refresh_from_db()
+                self.assertEqual(email.body, '' if step == 2 else 'code 123456')
+        self.assertEqual(email.status, OutboxEmail.FAILED)
+
+    def test_failure_reconnects_once_for_the_rest_of_the_batch(self):
+        for address in ['a', 'bounce', 'b', 'c', 'd']:
+            outbox.send('thanks', 'body', [f'{address}@example.com'])
+        with self.assertLogs('Banana.outbox', 'WARNING'):
+            self.assertEqual(outbox.drain(), {'sent': 4, 'retried': 1, 'failed': 0})
+        self.assertEqual(FlakyEmailBackend.opened, 2)
+
+    def test_batch_shares_one_connection_and_sends_otp_first(self):
+        for i in range(5):
+            outbox.send(f'thanks {i}', 'body', [f'user{i}@example.com'])
+        outbox.send('otp', 'body', ['otp@example.com'], priority=OutboxEmail.PRIORITY_HIGH)
+
+        self.assertEqual(outbox.drain(), {'sent': 6, 'retried': 0, 'failed': 0})
+        self.assertEqual(FlakyEmailBackend.opened, 1)
+        self.assertEqual([message.subject for message in mail.outbox][:2], ['otp', 'thanks 0'])
+        self.assertEqual(outbox.stats()[OutboxEmail.SENT], 6)
+
+    def test_drain_all_works_through_batches(self):
+        for i in range(25):
+            outbox.send(f'thanks {i}', 'body', [f'user{i}@example.com'])
+        self.assertEqual(outbox.drain_all()['sent'], 25)
+        self.assertEqual(FlakyEmailBackend.opened, 3)
+
+    def test_failures_back_off_then_give_up(self):
+        outbox.send('ok', 'body', ['user@example.com'])
+        bounced = outbox.send('bounced', 'body', ['bounce@example.com'])
+        now = timezone.now()
+
+        with self.assertLogs('Banana.outbox', 'WARNING'):
+            self.assertEqual(outbox.drain(now=now), {'sent': 1, 'retried': 1, 'failed': 0})
+        bounced.refresh_from_db()
+        self.assertEqual((bounced.status, bounced.attempts), (OutboxEmail.PENDING, 1))
+        self.assertEqual(bounced.next_attempt_at, now + timedelta(seconds=30))
+        self.assertIn('No such user', bounced.last_error)
+        # Not due yet.
+        self.assertEqual(outbox.drain(now=now + timedelta(seconds=29))['retried'], 0)
+
+        with self.assertLogs('Banana.outbox', 'WARNING'):
+            outbox.drain(now=now + timedelta(seconds=30))
+            bounced.refresh_from_db()
+            self.assertEqual(bounced.next_attempt_at, now + timedelta(seconds=90))
+            self.assertEqual(outbox.drain(now=now + timedelta(seconds=90))['failed'], 1)
+        bounced.refresh_from_db()
+        self.assertEqual((bounced.status, bounced.attempts), (OutboxEmail.FAILED, 3))
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_claimed_rows_are_skipped_until_the_lease_expires(self):
+        email = outbox.send('otp', 'body', ['otp@example.com'])
+        now = timezone.now()
+        claimed = outbox._claim(10, now, timedelta(minutes=5))
+        self.assertEqual([row.pk for row in claimed], [email.pk])
+        self.assertEqual(outbox.drain(now=now)['sent'], 0)
+        self.assertEqual(outbox.drain(now=now + timedelta(minutes=5))['sent'], 1)
+
+    @override_settings(EMAIL_OUTBOX={'ENABLED': False})
+    def test_disabled_outbox_sends_inside_the_request(self):
+        self.client.post('/banana/contact/', {
+            'name': 'Ann', 'email': 'ann@example.com', 'subject': 'Hi', 'message': 'Hello',
+        }, format='json')
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertFalse(OutboxEmail.objects.exists())
+
+    def test_drain_outbox_command(self):
+        outbox.send('thanks', 'body', ['user@example.com'])
+        out = io.StringIO()
+        call_command('drain_outbox', stdout=out)
+        self.assertIn('Sent 1 emails', out.getvalue())
+
+
+@override_settings(JOB_RUNNER='immediate')
+class OTPStoreTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='otp-user', email='otp@example.com')
+        self.client = APIClient()
+
+    def login(self, code):
+        return self.client.post('/banana/login/verify-otp/', {'email': 'otp@example.com', 'otp_code': code},
+                                format='json')
+
+    def test_backends_are_single_use(self):
+        for backend in (otp.CacheOTPBackend(60), otp.DatabaseOTPBackend(60)):
+            with self.subTest(backend=type(backend).__name__):
+                code = backend.issue(self.user, OTP.EMAIL, 'otp@example.com')
+                wrong = '000000' if code != '000000' else '111111'
+                self.assertEqual(backend.verify(self.user, wrong, OTP.EMAIL), (False, otp.INVALID))
+                self.assertEqual(backend.verify(self.user, code, OTP.EMAIL), (True, otp.VERIFIED))
+                self.assertEqual(backend.verify(self.user, code, OTP.EMAIL), (False, otp.EXPIRED))
+
+    def test_new_code_replaces_the_old_one(self):
+        backend = otp.CacheOTPBackend(60)
+        first = backend.issue(self.user, OTP.EMAIL, 'otp@example.com')
+        second = backend.issue(self.user, OTP.EMAIL, 'otp@example.com')
+        if first != second:
+            self.assertFalse(backend.verify(self.user, first, OTP.EMAIL)[0])
+        self.assertTrue(backend.verify(self.user, second, OTP.EMAIL)[0])
+
+    def test_cache_entry_expires(self):
+        backend = otp.CacheOTPBackend(0.05)
+        code = backend.issue(self.user, OTP.EMAIL, 'otp@example.com')
+        time.sleep(0.1)
+        self.assertEqual(backend.verify(self.user, code, OTP.EMAIL), (False, otp.EXPIRED))
+
+    def test_cache_stores_only_a_hash(self):
+        backend = otp.CacheOTPBackend(60)
+        code = backend.issue(self.user, OTP.EMAIL, 'otp@example.com')
+        stored = cache.get(f'otp:{OTP.EMAIL}:{self.user.pk}')
+        self.assertNotIn(code, stored)
+
+    def test_concurrent_verifies_log_in_once(self):
+        backend = otp.CacheOTPBackend(60)
+        code = backend.issue(self.user, OTP.EMAIL, 'otp@example.com')
+        barrier = threading.Barrier(8)
+
+        def attempt():
+            barrier.wait()
+            return backend.verify(self.user, code, OTP.EMAIL)[0]
+
+        threads = [threading.Thread(target=lambda: results.append(attempt())) for _ in range(8)]
+        results = []
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results.count(True), 1)
+
+    def test_login_flow_writes_no_otp_rows(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/banana/login/request-otp/', {'email': 'otp@example.com'}, format='json')
+        self.assertEqual(response.json()['expires_in_minutes'], 10)
+        code = re.search(r'\b(\d{6})\b', mail.outbox[0].body).group(1)
+        self.assertFalse(OTP.objects.exists())
+        self.assertEqual(self.login(code).status_code, 200)
+        self.assertEqual(self.login(code).status_code, 400)
+
+    @override_settings(OTP_STORE={'BACKEND': 'db'})
+    def test_db_backend_keeps_an_audit_row(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/banana/login/request-otp/', {'email': 'otp@example.com'}, format='json')
+        self.assertEqual(self.login(OTP.objects.get().otp_code).status_code, 200)
+        self.assertTrue(OTP.objects.get().is_used)
+
+
+@override_settings(JOB_RUNNER='immediate')
+class AuthPurgeTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='purge-user')
+        self.now = timezone.now()
+        OTP.objects.bulk_create([
+            OTP(user=self.user, otp_code='123456', otp_type=OTP.EMAIL, contact_info='x@example.com',
+                expires_at=self.now + timedelta(minutes=-30 if i % 3 else 10))
+            for i in range(30)
+        ])
+        tokens = OutstandingToken.objects.bulk_create([
+            OutstandingToken(user=self.user, jti=f'jti-{i}', token='t',
+                             expires_at=self.now + timedelta(days=-1 if i < 8 else 1))
+            for i in range(12)
+        ])
+        BlacklistedToken.objects.bulk_create([BlacklistedToken(token=token) for token in tokens[::2]])
+        OutboxEmail.objects.bulk_create([
+            OutboxEmail(subject='s', body='b', from_email='f@example.com', to=['x@example.com'], status=status,
+                        sent_at=self.now - timedelta(days=days) if status == OutboxEmail.SENT else None)
+            for status, days in [(OutboxEmail.SENT, 8), (OutboxEmail.SENT, 8), (OutboxEmail.SENT, 1),
+                                 (OutboxEmail.PENDING, 0), (OutboxEmail.FAILED, 0)]
+        ])
+
+    def test_purge_deletes_only_expired_rows(self):
+        chunks = []
+        purged = purge.purge_expired(chunk_size=7, now=self.now, progress=lambda *args: chunks.append(args))
+        self.assertEqual(purged, {'OTP': 20, 'BlacklistedToken': 4, 'OutstandingToken': 8, 'OutboxEmail': 2})
+        self.assertEqual(OutboxEmail.objects.count(), 3)
+        self.assertFalse(OTP.objects.filter(expires_at__lt=self.now).exists())
+        self.assertEqual(OTP.objects.count(), 10)
+        self.assertEqual(OutstandingToken.objects.count(), 4)
+        self.assertEqual(BlacklistedToken.objects.count(), 2)
+        self.assertGreater(len([chunk for chunk in chunks if chunk[0] == 'OTP']), 1)
+
+    def test_chunks_are_bounded(self):
+        with CaptureQueriesContext(connection) as queries:
+            purge.purge_expired(chunk_size=5, now=self.now)
+        otp_deletes = [q['sql'] for q in queries if q['sql'].startswith('DELETE FROM "Banana_otp"')]
+        self.assertEqual(len(otp_deletes), 6)
+        self.assertTrue(all('"Banana_otp"."id" >=' in sql for sql in otp_deletes))
+
+    def test_dry_run_deletes_nothing(self):
+        out = io.StringIO()
+        call_command('purge_expired_auth', '--dry-run', stdout=out)
+        self.assertIn('OTP: 20 expired rows found', out.getvalue())
+        self.assertEqual(OTP.objects.count(), 30)
+
+    def test_command(self):
+        out = io.StringIO()
+        call_command('purge_expired_auth', '--chunk-size', '4', stdout=out)
+        self.assertIn('OutstandingToken: 8 expired rows deleted', out.getvalue())
+        self.assertEqual(OutstandingToken.objects.count(), 4)
+
+    def test_scheduled_once_a_day(self):
+        cache.clear()
+        self.assertTrue(purge.maybe_schedule())
+        self.assertFalse(purge.maybe_schedule())
+        self.assertEqual(OTP.objects.count(), 10)
+
+
+
+class CountingCache(LocMemCache):
+    ops = []
+
+    def get_many(self, *args, **kwargs):
+        self.ops.append('get_many')
+        return super().get_many(*args, **kwargs)
+
+    def incr(self, *args, **kwargs):
+        self.ops.append('incr')
+        return super().incr(*args, **kwargs)
+
+    def add(self, *args, **kwargs):
+        self.ops.append('add')
+        return super().add(*args, **kwargs)
+
+
+@override_settings(RATE_LIMITS={'RATES': {
+    'contact': {'ip': '5/min', 'email': '3/min'},
+    'login': {'ip': '100/min', 'username+ip': '4/10min'},
+}}, JOB_RUNNER='immediate')
+class RateLimitTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def contact(self, email='ann@example.com', ip='10.0.0.1'):
+        return self.client.post('/banana/contact/', {
+            'name': 'Ann', 'email': email, 'subject': 'Hi', 'message': 'Hello',
+        }, format='json', REMOTE_ADDR=ip)
+
+    def test_burst_from_one_ip_gets_429_with_retry_after(self):
+        statuses = [self.contact(email=f'user{i}@example.com').status_code for i in range(20)]
+        self.assertEqual(statuses, [201] * 5 + [429] * 15)
+        response = self.contact(email='other@example.com')
+        self.assertEqual(response.status_code, 429)
+        self.assertTrue(1 <= int(response['Retry-After']) <= 120)
+        # Rejected requests do not use up the budget of other clients.
+        self.assertEqual(self.contact(email='other@example.com', ip='10.0.0.2').status_code, 201)
+
+    def login(self, username, ip):
+        return self.client.post('/banana/login/', {'username': username, 'password': 'guess'},
+                                format='json', REMOTE_ADDR=ip).status_code
+
+    def test_guesses_at_one_account_are_limited_per_ip(self):
+        statuses = [self.login('Victim', '10.0.1.1') for _ in range(6)]
+        self.assertEqual(statuses, [400] * 4 + [429] * 2)
+        self.assertEqual(self.login('victim', '10.0.1.1'), 429)
+        # The owner, elsewhere, isn't locked out by someone else's guesses.
+        self.assertEqual(self.login('victim', '10.0.2.1'), 400)
+        # The same address can still try other accounts until its IP budget runs out.
+        self.assertEqual(self.login('other', '10.0.1.1'), 400)
+
+    def test_counts_slide_out_of_the_window(self):
+        # 4 requests last window, 30 s into the current one: half of them still count.
+        self.assertEqual(throttling.sliding_count(4, 1, 30, 60), 3)
+        # limit 3 -> room for 2: wait until 4 * (1 - f) + 1 <= 2, i.e. f = 0.75 -> 45 s in.
+        self.assertEqual(throttling.retry_after(4, 1, 30, 3, 60), 15)
+        # The current window alone is over: wait for the next one to start and weigh it down.
+        self.assertEqual(throttling.retry_after(0, 4, 15, 3, 60), 45 + 30)
+        # A limit of 1 only fits once both windows are empty, and 0 never does; neither divides by zero.
+        self.assertEqual(throttling.retry_after(1, 0, 15, 1, 60), 45)
+        self.assertEqual(throttling.retry_after(0, 1, 15, 1, 60), 45 + 60)
+        self.assertEqual(throttling.retry_after(0, 0, 15, 0, 60), 45)
+
+    def test_rate_parsing(self):
+        self.assertEqual(throttling.parse_rate('5/10min'), (5, 600))
+        self.assertEqual(throttling.parse_rate('3/hour'), (3, 3600))
+        with self.assertRaises(ImproperlyConfigured):
+            throttling.parse_rate('5 per minute')
+
+    @override_settings(CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+        'counting': {'BACKEND': 'Banana.tests.CountingCache'},
+    })
+    def test_constant_cache_ops_per_request(self):
+        with override_settings(RATE_LIMITS={'CACHE': 'counting', 'RATES': {'contact': {'ip': '50/min',
+                                                                                     'email': '50/min'}}}):
+            self.contact()
+            CountingCache.ops.clear()
+            for _ in range(10):
+                self.contact()
+        # One read for both budgets, one increment each.
+        self.assertEqual(CountingCache.ops, ['get_many', 'incr', 'incr'] * 10)
+
+    @override_settings(RATE_LIMITS={'ENABLED': False, 'RATES': {'contact': {'ip': '1/min'}}})
+    def test_disabled(self):
+        self.assertEqual([self.contact().status_code for _ in range(3)], [201] * 3)
+
+
+class SessionRevokeTests(TestCase):
+    def setUp(self):
+        self.now = timezone.now()
+        self.users = [User.objects.create(username=f'session{i}') for i in range(3)]
+        self.tokens = {
+            user: OutstandingToken.objects.bulk_create([
+                OutstandingToken(user=user, jti=f'{user.username}-{i}', token='t',
+                                 expires_at=self.now + timedelta(days=-1 if i == 0 else 1))
+                for i in range(20)
+            ])
+            for user in self.users
+        }
+        BlacklistedToken.objects.create(token=self.tokens[self.users[0]][1])
+
+    def blacklisted(self, user):
+        return BlacklistedToken.objects.filter(token__user=user).count()
+
+    def test_logout_all_is_two_queries(self):
+        client = APIClient()
+        client.force_authenticate(self.users[0])
+        # SELECT the unrevoked live token ids, then one INSERT ... ON CONFLICT DO NOTHING.
+        with self.assertNumQueries(2):
+            response = client.post('/banana/logout-all/')
+        self.assertEqual(response.status_code, 205)
+        # Every live token, the one already revoked kept once; the expired one skipped.
+        self.assertEqual(self.blacklisted(self.users[0]), 19)
+        self.assertEqual(self.blacklisted(self.users[1]), 0)
+
+    def test_revoking_twice_adds_nothing(self):
+        self.assertEqual(sessions.revoke_all_sessions([self.users[1].pk], now=self.now), 19)
+        self.assertEqual(sessions.revoke_all_sessions([self.users[1].pk], now=self.now), 0)
+
+    def test_admin_revokes_many_users(self):
+        admin_user = User.objects.create(username='root', is_staff=True, is_superuser=True)
+        self.client.force_login(admin_user)
+        response = self.client.post('/admin/auth/user/', {
+            'action': 'revoke_sessions', '_selected_action': [user.pk for user in self.users[1:]],
+        }, follow=True)
+        self.assertContains(response, 'Revoked 38 sessions.')
+        self.assertEqual([self.blacklisted(user) for user in self.users], [1, 19, 19])
+
+
+class CachedAuthenticationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='cached', email='cached@example.com')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+
+    def warm(self):
+        self.assertEqual(self.client.get('/banana/game-stats/').status_code, 200)
+
+    def test_first_request_loads_user_and_player_together(self):
+        # One joined SELECT, then get_or_create (SELECT + INSERT in a savepoint) for the missing player.
+        with self.assertNumQueries(5):
+            self.warm()
+        self.assertTrue(Player.objects.filter(user=self.user).exists())
+        cache.clear()
+        with self.assertNumQueries(1):
+            self.warm()
+
+    @override_settings(AUTH_USER_CACHE={'CHECK_STATE': False})
+    def test_read_endpoints_hit_no_tables_when_warm(self):
+        self.warm()
+        for url in ('/banana/game-stats/', '/banana/player/', '/banana/daily-challenge/'):
+            with self.subTest(url=url), self.assertNumQueries(0):
+                self.assertEqual(self.client.get(url).status_code, 200)
+
+    @override_settings(AUTH_USER_CACHE={'CHECK_STATE': False})
+    def test_write_endpoints(self):
+        self.warm()
+        with self.assertNumQueries(1):
+            # A blind write: only the UPDATE of the difficulty.
+            self.client.post('/banana/set-difficulty/', {'difficulty': 'hard'}, format='json')
+        self.warm()
+        with self.assertNumQueries(1):
+            # Hints are read-modify-write, so the player is re-read; it has none to spend.
+            self.assertEqual(self.client.post('/banana/use-hint/', {}, format='json').status_code, 400)
+
+    def test_player_changes_invalidate_the_cache(self):
+        self.warm()
+        player = Player.objects.get(user=self.user)
+        player.coins = 999
+        player.save()
+        self.assertEqual(self.client.get('/banana/game-stats/').json()['coins'], 999)
+
+        # A bare queryset update is invisible until something invalidates; scoring's updates do.
+        Player.objects.filter(pk=player.pk).update(coins=5)
+        self.assertEqual(self.client.get('/banana/game-stats/').json()['coins'], 999)
+        scoring.apply_miss(player, '')
+        self.assertEqual(self.client.get('/banana/game-stats/').json()['coins'], 5)
+
+    def test_deactivated_user_is_rejected(self):
+        self.warm()
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get('/banana/game-stats/').status_code, 401)
+
+    def test_per_process_cache_rechecks_the_user_row(self):
+        self.warm()
+        # locmem can't see other workers' invalidations: one lookup of is_active and the password.
+        with self.assertNumQueries(1):
+            self.warm()
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertEqual(self.client.get('/banana/game-stats/').status_code, 401)
+
+    def test_cache_holds_no_password_hash(self):
+        self.user.set_password('secret1')
+        self.user.save()
+        self.warm()
+        entry = cache.get(f'auth:user:{self.user.pk}')
+        self.assertNotIn('password', entry['user'])
+        self.assertNotIn(self.user.password, repr(entry))
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+                   PASSWORD_HASHING={'WORKERS': 1, 'MAX_PENDING': 1}, JOB_RUNNER='immediate')
+class AsyncLoginTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def login(self, username='ann', password='secret1'):
+        return self.client.post('/banana/login/async/', {'username': username, 'password': password}, format='json')
+
+    def register(self):
+        return self.client.post('/banana/register/async/', {
+            'username': 'ann', 'email': 'ann@example.com', 'password': 'secret1', 'confirm_password': 'secret1',
+        }, format='json')
+
+    def test_register_then_login(self):
+        response = self.register()
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['username'], 'ann')
+        user = User.objects.get(username='ann')
+        self.assertTrue(user.check_password('secret1'))
+        self.assertTrue(Player.objects.filter(user=user).exists())
+        self.assertEqual(self.register().json(), {'detail': {'username': ['A user with that username already exists.']}})
+
+        response = self.login()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.json()), {'refresh', 'access', 'username'})
+        self.assertEqual(OutstandingToken.objects.filter(user=user).count(), 2)
+
+    def test_bad_credentials(self):
+        User.objects.create_user('ann', 'ann@example.com', 'secret1')
+        invalid = {'detail': {'detail': ['Invalid username or password']}}
+        self.assertEqual(self.login(password='wrong').json(), invalid)
+        self.assertEqual(self.login(username='nobody').json(), invalid)
+        self.assertEqual(self.login(password='').status_code, 400)
+        self.assertEqual(self.client.post('/banana/login/async/', 'not json', content_type='application/json').status_code, 400)
+        User.objects.filter(username='ann').update(is_active=False)
+        self.assertEqual(self.login().json(), invalid)
+
+    def test_failures_are_signalled_by_both_login_views(self):
+        User.objects.create_user('ann', 'ann@example.com', 'secret1')
+        failed = []
+
+        def receiver(sender, credentials, **kwargs):
+            failed.append(credentials['username'])
+
+        user_login_failed.connect(receiver)
+        try:
+            self.login(password='wrong')
+            self.client.post('/banana/login/', {'username': 'ann', 'password': 'wrong'}, format='json')
+        finally:
+            user_login_failed.disconnect(receiver)
+        self.assertEqual(failed, ['ann', 'ann'])
+
+    @override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.PBKDF2PasswordHasher',
+                                         'django.contrib.auth.hashers.MD5PasswordHasher'])
+    def test_outdated_hash_is_upgraded(self):
+        User.objects.create(username='ann', password=make_password('secret1', hasher='md5'))
+        self.assertEqual(self.login().status_code, 200)
+        self.assertTrue(User.objects.get(username='ann').password.startswith('pbkdf2_sha256$'))
+
+    def test_full_pool_answers_503(self):
+        User.objects.create_user('ann', 'ann@example.com', 'secret1')
+        executor = hashing.get_executor()
+        started, release = threading.Event(), threading.Event()
+
+        def hold():
+            started.set()
+            release.wait(5)
+
+        holder = threading.Thread(target=lambda: asyncio.run(executor.run(hold)))
+        holder.start()
+        self.assertTrue(started.wait(5))
+        try:
+            response = self.login()
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response['Retry-After'], '1')
+        finally:
+            release.set()
+            holder.join(5)
+        self.assertEqual(self.login().status_code, 200)
+        self.assertEqual(executor.stats()['rejected'], 1)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'], JOB_RUNNER='immediate')
+class RegistrationTests(TestCase):
+    def register(self, username='ann', email='ann@example.com', client=None):
+        return (client or APIClient()).post('/banana/register/', {
+            'username': username, 'email': email, 'password': 'secret1', 'confirm_password': 'secret1',
+        }, format='json')
+
+    def test_user_player_and_token_in_three_inserts(self):
+        # SAVEPOINT, INSERT user, INSERT player, RELEASE, then INSERT the outstanding token.
+        with self.assertNumQueries(5):
+            self.assertEqual(self.register().status_code, 201)
+        user = User.objects.get(username='ann')
+        self.assertTrue(Player.objects.filter(user=user).exists())
+        self.assertTrue(OutstandingToken.objects.filter(user=user).exists())
+
+    def test_taken_username_or_email_gives_the_old_messages(self):
+        self.register()
+        # The failed insert, rolled back, then one lookup to name the taken field.
+        with self.assertNumQueries(5):
+            response = self.register(email='other@example.com')
+        self.assertEqual(response.json(), {'detail': {'username': ['A user with that username already exists.']}})
+        self.assertEqual(self.register(username='bob').json(), {'detail': {'email': ['Email already exists']}})
+        self.assertEqual(User.objects.count(), 1)
+        self.assertEqual(Player.objects.count(), 1)
+        # Accounts without an email don't collide.
+        User.objects.create(username='admin1')
+        User.objects.create(username='admin2')
+        self.assertEqual(User.objects.filter(email='').count(), 2)
+
+    def test_migration_names_shared_emails_before_indexing(self):
+        check = importlib.import_module('Banana.migrations.0010_user_email_unique').check_duplicate_emails
+        with connection.cursor() as cursor:
+            cursor.execute("DROP INDEX user_email_unique_idx")
+        for name in ('dup1', 'dup2', 'other'):
+            User.objects.create(username=name, email='other@example.com' if name == 'other' else 'dup@example.com')
+        with self.assertRaisesMessage(RuntimeError, 'these emails are shared: dup@example.com (2 accounts).'):
+            check(django_apps, None)
+
+    def test_interleaved_sign_ups_with_one_email(self):
+        # The interleaving the old exists() checks lost: both sign-ups validate before either inserts.
+        sign_ups = [
+            RegisterSerializer(data={'username': f'racer{i}', 'email': 'race@example.com',
+                                     'password': 'secret1', 'confirm_password': 'secret1'})
+            for i in range(2)
+        ]
+        self.assertTrue(all(sign_up.is_valid() for sign_up in sign_ups))
+        sign_ups[0].save()
+        with self.assertRaises(drf_serializers.ValidationError) as raised:
+            sign_ups[1].save()
+        self.assertEqual(raised.exception.detail, {'email': ['Email already exists']})
+        self.assertEqual(User.objects.filter(email='race@example.com').count(), 1)
+        self.assertEqual(Player.objects.count(), 1)
+
+
+class RatingSummaryTests(TestCase):
+    def rate(self, user, stars):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client.post('/banana/ratings/submit/', {'rating': stars}, format='json')
+
+    def assert_summary_matches_ratings(self):
+        stars = list(Rating.objects.values_list('rating', flat=True))
+        summary = ratings.summary()
+        self.assertEqual(summary['total_ratings'], len(stars))
+        self.assertEqual(summary['average_rating'], round(sum(stars) / len(stars), 2) if stars else 0)
+        self.assertEqual(summary['histogram'], {str(n): stars.count(n) for n in range(1, 6)})
+
+    def test_summary_follows_creates_changes_and_deletes(self):
+        users = [User.objects.create(username=f'rater{i}') for i in range(4)]
+        for user, stars in zip(users, [5, 4, 4, 1]):
+            self.assertEqual(self.rate(user, stars).status_code, 201)
+        self.assert_summary_matches_ratings()
+        self.assertEqual(self.rate(users[3], 3).status_code, 200)
+        self.assertEqual(self.rate(users[0], 5).status_code, 200)
+        self.assert_summary_matches_ratings()
+        self.assertEqual(self.rate(users[1], 9).status_code, 400)
+        users[2].delete()
+        self.assert_summary_matches_ratings()
+        self.assertEqual(ratings.summary()['histogram'], {'1': 0, '2': 0, '3': 1, '4': 1, '5': 1})
+
+    def test_summary_is_one_query(self):
+        for i, stars in enumerate([2, 3, 5]):
+            self.rate(User.objects.create(username=f'rater{i}'), stars)
+        with self.assertNumQueries(1):
+            response = APIClient().get('/banana/ratings/')
+        self.assertEqual(response.json(), {
+            'average_rating': 3.33, 'total_ratings': 3, 'histogram': {'1': 0, '2': 1, '3': 1, '4': 0, '5': 1},
+        })
+
+    def test_missing_row_is_rebuilt(self):
+        self.rate(User.objects.create(username='rater'), 4)
+        RatingSummary.objects.all().delete()
+        self.rate(User.objects.create(username='other'), 2)
+        self.assert_summary_matches_ratings()
+        self.assertEqual(RatingSummary.objects.count(), 1)
+
+    def test_list_is_paginated(self):
+        users = [User.objects.create(username=f'rater{i}') for i in range(5)]
+        for user in users:
+            self.rate(user, 3)
+        # Equal timestamps, so the pages hold together on the id tie-break.
+        Rating.objects.update(created_at=timezone.now())
+        client = APIClient()
+        with self.assertNumQueries(1):
+            first = client.get('/banana/ratings/list/', {'page_size': 2}).json()
+        self.assertEqual([r['username'] for r in first['ratings']], ['rater4', 'rater3'])
+        second = client.get('/banana/ratings/list/', {'page_size': 2, 'cursor': first['next']}).json()
+        self.assertEqual([r['username'] for r in second['ratings']], ['rater2', 'rater1'])
+        last = client.get('/banana/ratings/list/', {'page_size': 2, 'cursor': second['next']}).json()
+        self.assertEqual([r['username'] for r in last['ratings']], ['rater0'])
+        self.assertIsNone(last['next'])
+        self.assertEqual(client.get('/banana/ratings/list/', {'cursor': 'x'}).status_code, 400)
+        self.assertEqual(client.get('/banana/ratings/list/', {'page_size': 'x'}).status_code, 400)
+
+
+class ReviewPaginationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='reviewer')
+        self.client = APIClient()
+        moment = timezone.now()
+        for i in range(7):
+            review = Review.objects.create(user=self.user, title=f'r{i}', content='...', is_approved=i < 5)
+            # Pairs of reviews share a timestamp, so the id tie-break matters.
+            Review.objects.filter(pk=review.pk).update(created_at=moment - timedelta(minutes=i // 2))
+
+    def walk(self, url, page_size=2):
+        titles, cursor, pages = [], None, 0
+        while True:
+            params = {'page_size': page_size, **({'cursor': cursor} if cursor else {})}
+            body = self.client.get(url, params).json()
+            titles += [review['title'] for review in body['reviews']]
+            pages += 1
+            cursor = body['next']
+            if cursor is None:
+                return titles, pages, body['count']
+
+    def test_pages_cover_every_approved_review_once(self):
+        titles, pages, count = self.walk('/banana/reviews/')
+        self.assertEqual(titles, ['r1', 'r0', 'r3', 'r2', 'r4'])
+        self.assertEqual((pages, count), (3, 5))
+
+    def test_a_page_is_one_query_once_the_count_is_cached(self):
+        with self.assertNumQueries(2):
+            self.client.get('/banana/reviews/')
+        with self.assertNumQueries(1):
+            response = self.client.get('/banana/reviews/', {'page_size': 100})
+        self.assertEqual(len(response.json()['reviews']), 5)
+        self.assertEqual(response.json()['count'], 5)
+
+    def test_count_follows_approvals(self):
+        self.client.get('/banana/reviews/')
+        review = Review.objects.get(title='r5')
+        review.is_approved = True
+        review.save()
+        self.assertEqual(self.client.get('/banana/reviews/').json()['count'], 6)
+        review.delete()
+        self.assertEqual(self.client.get('/banana/reviews/').json()['count'], 5)
+
+    def test_user_reviews(self):
+        self.client.force_authenticate(self.user)
+        titles, pages, count = self.walk('/banana/reviews/my-reviews/', page_size=3)
+        self.assertEqual(titles, ['r1', 'r0', 'r3', 'r2', 'r5', 'r4', 'r6'])
+        self.assertEqual((pages, count), (3, 7))
+        with self.assertNumQueries(1):
+            body = self.client.get('/banana/reviews/my-reviews/', {'page_size': 10}).json()
+        self.assertEqual((len(body['reviews']), body['count'], body['next']), (7, 7, None))
+
+    def test_bad_cursor(self):
+        self.assertEqual(self.client.get('/banana/reviews/', {'cursor': 'nonsense'}).status_code, 400)
+        self.assertEqual(self.client.get('/banana/reviews/', {'page_size': 'x'}).status_code, 400)
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='critic')
+        self.client = APIClient()
+        self.reviews = {
+            key: Review.objects.create(user=self.user, title=title, content=content, is_approved=approved)
+            for key, title, content, approved in [
+                ('title', 'Banana puzzles galore', 'Fun for the whole family.', True),
+                ('body', 'Great game', 'The banana puzzles get hard later on.', True),
+                ('other', 'Meh', 'Not my kind of game.', True),
+                ('hidden', 'Banana spam', 'banana banana banana', False),
+            ]
+        }
+
+    def found(self, query):
+        response = self.client.get('/banana/reviews/search/', {'q': query})
+        self.assertEqual(response.status_code, 200)
+        return [review['title'] for review in response.json()['reviews']]
+
+    def test_ranked_stemmed_and_prefix_matches(self):
+        self.assertEqual(self.found('puzzle banana'), ['Banana puzzles galore', 'Great game'])
+        self.assertEqual(self.found('bana'), ['Banana puzzles galore', 'Great game'])
+        self.assertEqual(self.found('family'), ['Banana puzzles galore'])
+        self.assertEqual(self.found('"AND (*'), [])
+        self.assertEqual(self.client.get('/banana/reviews/search/').status_code, 400)
+
+    def test_short_last_word_is_not_a_prefix(self):
+        self.assertEqual(search.match_expression('banana pu'), '"banana" "pu"')
+        self.assertEqual(search.match_expression('banana puz'), '"banana" "puz"*')
+        self.assertEqual(self.found('banana pu'), [])
+        self.assertEqual(self.found('banana puz'), ['Banana puzzles galore', 'Great game'])
+
+    @override_settings(RATE_LIMITS={'RATES': {'search': {'ip': '2/min'}}})
+    def test_search_is_rate_limited(self):
+        self.assertEqual(self.found('banana'), ['Banana puzzles galore', 'Great game'])
+        self.assertEqual(self.found('family'), ['Banana puzzles galore'])
+        response = self.client.get('/banana/reviews/search/', {'q': 'banana'})
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+
+    def test_triggers_keep_the_index_in_step(self):
+        review = self.reviews['other']
+        review.content = 'Surprisingly good family game.'
+        review.save()
+        self.assertCountEqual(self.found('family'), ['Banana puzzles galore', 'Meh'])
+        self.reviews['title'].delete()
+        self.assertEqual(self.found('family'), ['Meh'])
+
+    def test_rebuild_restores_a_lost_index(self):
+        fts = connection.ops.quote_name(search.fts_table(Review))
+        with connection.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {fts}({fts}) VALUES ('delete-all')")
+        self.assertEqual(self.found('banana'), [])
+        out = io.StringIO()
+        call_command('rebuild_search_index', stdout=out)
+        self.assertIn('Banana.Review: 4 rows indexed', out.getvalue())
+        self.assertEqual(self.found('banana'), ['Banana puzzles galore', 'Great game'])
+
+    def test_admin_search(self):
+        request = RequestFactory().get('/admin/Banana/review/', {'q': 'puzzles'})
+        model_admin = ReviewAdmin(Review, admin.site)
+        results, _ = model_admin.get_search_results(request, Review.objects.all(), 'puzzles')
+        self.assertEqual(set(results), {self.reviews['title'], self.reviews['body']})
+        results, _ = model_admin.get_search_results(request, Review.objects.all(), 'critic')
+        self.assertEqual(results.count(), 4)
+
+        Contact.objects.create(name='Ann', email='ann@example.com', subject='Bug', message='The hint button froze.')
+        results, _ = ContactAdmin(Contact, admin.site).get_search_results(request, Contact.objects.all(), 'hints')
+        self.assertEqual([contact.name for contact in results], ['Ann'])
+
+    def test_icontains_fallback_without_fts5(self):
+        search.uninstall(connection)
+        # install() also forgets which tables are indexed; the rollback then brings the index back.
+        self.addCleanup(search.install, connection)
+        self.assertFalse(search.is_indexed(Review))
+        self.assertEqual(self.found('banana puzzles'), ['Great game', 'Banana puzzles galore'])
+        self.assertEqual(self.found('family'), ['Banana puzzles galore'])
@@ -0,0 +1,160 @@
+"""
+Sliding-window rate limits for the anonymous auth, contact and search endpoints.
+
+``rate_limit(scope)`` returns a DRF throttle class for one endpoint. Its
+budgets come from ``RATE_LIMITS['RATES'][scope]``, one rate per key kind:
+
+``'ip'``
+    the client address, as DRF's ``get_ident`` sees it (``NUM_PROXIES``);
+``'email'`` / ``'username'``
+    that field of the request body, lower-cased;
+``'username+ip'`` (any kinds joined by ``+``)
+    the combination, counted only when every part is present.
+
+A client rotating usernames still hits its IP budget. Login guesses are
+counted per username and IP, not per username alone, so nobody can lock
+the owner out of an account by spending its budget from elsewhere. The OTP
+endpoints keep per-email budgets, since those guard the mailbox and the
+six-digit code rather than a password.
+
+Each budget is an approximate sliding window: one counter per fixed window
+in the cache, with the previous window's count weighted by how much of it
+still overlaps the sliding window. A request costs one ``get_many`` for all
+of its counters plus one ``incr`` per key kind, whatever the rate. Throttled
+requests are not counted and get DRF's ``429`` with ``Retry-After``.
+Plain Django views, such as ``login_async``, call ``check_request`` and
+answer the ``429`` themselves.
+
+With the default per-process locmem cache each worker enforces its own
+budgets; point ``RATE_LIMITS['CACHE']`` at a shared backend to enforce them
+across workers.
+"""
+import hashlib
+import re
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework.throttling import BaseThrottle
+
+DEFAULT_RATE_LIMIT_SETTINGS = {
+    'ENABLED': True,
+    'CACHE': 'default',
+    'RATES': {},
+}
+
+PERIODS = {'s': 1, 'sec': 1, 'm': 60, 'min': 60, 'h': 3600, 'hour': 3600, 'd': 86400, 'day': 86400}
+_RATE_RE = re.compile(r'^\s*(\d+)\s*/\s*(\d*)\s*([a-z]+)\s*$')
+
+
+def get_rate_limit_settings():
+    return {**DEFAULT_RATE_LIMIT_SETTINGS, **getattr(settings, 'RATE_LIMITS', {})}
+
+
+def parse_rate(rate):
+    """``'5/10min'`` -> ``(5, 600)``: ``limit`` requests per ``period`` seconds."""
+    match = _RATE_RE.match(rate)
+    if not match or match.group(3) not in PERIODS:
+        raise ImproperlyConfigured(f"Invalid rate {rate!r}; expected e.g. '10/min' or '5/10min'")
+    limit, multiplier, unit = match.groups()
+    return int(limit), int(multiplier or 1) * PERIODS[unit]
+
+
+def sliding_count(previous, current, elapsed, period):
+    """Estimated requests in the sliding window ending ``elapsed`` seconds into the current window."""
+    return previous * (1 - elapsed / period) + current
+
+
+def retry_after(previous, current, elapsed, limit, period):
+    """Seconds until one more request fits in ``limit``."""
+    room = limit - 1
+    if room <= 0:
+        # Only an empty sliding window has room (none at all with a limit of 0).
+        return period - elapsed + (period if current else 0)
+    if current > room:
+        # Not before the current window has become the previous one.
+        return period - elapsed + (1 - room / current) * period
+    return max(0.0, (1 - (room - current) / previous) * period - elapsed)
+
+
+def idents(scope, ip, data):
+    """``(kind, value, (limit, period))`` for each configured key kind present in the request."""
+    rates = get_rate_limit_settings()['RATES'].get(scope, {})
+    for kind, rate in rates.items():
+        values = [_ident_part(part, ip, data) for part in kind.split('+')]
+        if all(values):
+            yield kind, '\n'.join(values), parse_rate(rate)
+
+
+def _ident_part(kind, ip, data):
+    if kind == 'ip':
+        value = ip
+    else:
+        try:
+            value = data.get(kind)
+        except AttributeError:
+            value = None
+    return str(value).strip().lower() if value else None
+
+
+def consume(scope, ip, data):
+    """
+    Count one request against the ``scope`` budgets. Returns None when it
+    fits, or the seconds to wait when it doesn't (and then counts nothing).
+    """
+    conf = get_rate_limit_settings()
+    if not conf['ENABLED']:
+        return None
+    now = time.time()
+    checks = []
+    for kind, value, (limit, period) in idents(scope, ip, data):
+        digest = hashlib.sha256(value.encode()).hexdigest()[:24]
+        window, elapsed = divmod(now, period)
+        prefix = f'ratelimit:{scope}:{kind}:{period}:{digest}'
+        checks.append((f'{prefix}:{int(window) - 1}', f'{prefix}:{int(window)}', elapsed, limit, period))
+    if not checks:
+        return None
+
+    cache = caches[conf['CACHE']]
+    counts = cache.get_many([key for check in checks for key in check[:2]])
+    waits = []
+    for previous_key, current_key, elapsed, limit, period in checks:
+        previous, current = counts.get(previous_key, 0), counts.get(current_key, 0)
+        if sliding_count(previous, current, elapsed, period) + 1 > limit:
+            waits.append(retry_after(previous, current, elapsed, limit, period))
+    if waits:
+        return max(waits)
+
+    for _, current_key, _, _, period in checks:
+        try:
+            cache.incr(current_key)
+        except ValueError:
+            # First request of this window; it lives on through the next one as "previous".
+            if not cache.add(current_key, 1, timeout=2 * period + 1):
+                cache.incr(current_key)
+    return None
+
+
+def check_request(scope, request, data):
+    """``consume`` for a plain Django view, which has no DRF throttle to do it."""
+    return consume(scope, BaseThrottle().get_ident(request), data)
+
+
+class SlidingWindowThrottle(BaseThrottle):
+    scope = None
+
+    def __init__(self):
+        self._wait = None
+
+    def allow_request(self, request, view):
+        self._wait = consume(self.scope, self.get_ident(request), request.data)
+        return self._wait is None
+
+    def wait(self):
+        return self._wait
+
+
+def rate_limit(scope):
+    """A throttle class applying the ``RATE_LIMITS['RATES'][scope]`` budgets."""
+    return type(f'{scope.title().replace("_", "")}RateThrottle', (SlidingWindowThrottle,), {'scope': scope})
@@ -0,0 +1,284 @@
+"""
+HTTP client for the upstream banana puzzle API.
+
+All upstream calls share one keep-alive requests.Session with a sized
+connection pool. Failed calls are retried with jittered exponential backoff,
+and a circuit breaker stops calling the API for a cool-down period once it
+keeps failing, so workers get an immediate degraded response instead of
+waiting out the timeout on every request. All attempts of one fetch, and the
+sleeps between them, share a ``DEADLINE``: each attempt's timeouts are cut
+to the time left and no retry starts once it has run out.
+"""
+import collections
+import logging
+import random
+import threading
+import time
+
+import requests
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PUZZLE_API_URL = "https://marcconrad.com/uob/banana/api.php"
+
+DEFAULT_UPSTREAM_SETTINGS = {
+    'CONNECT_TIMEOUT': 2.0,
+    'READ_TIMEOUT': 3.0,
+    'RETRIES': 2,
+    'BACKOFF_BASE': 0.1,
+    'BACKOFF_MAX': 1.0,
+    # Seconds for a whole fetch_puzzle call, retries included
+    'DEADLINE': 5.0,
+    'POOL_CONNECTIONS': 4,
+    'POOL_MAXSIZE': 16,
+    'FAILURE_THRESHOLD': 5,
+    'RESET_TIMEOUT': 30.0,
+}
+
+
+class PuzzleFetchError(Exception):
+    """Raised when a puzzle could not be fetched from the upstream API."""
+
+    def __init__(self, message, status_code=500):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class UpstreamUnavailable(PuzzleFetchError):
+    """The upstream API is failing or the circuit breaker is open."""
+
+    def __init__(self, message="Puzzle service is temporarily unavailable", retry_after=None):
+        super().__init__(message, status_code=503)
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == self.OPEN and self._clock() - self._opened_at >= self.reset_timeout:
+                return self.HALF_OPEN
+            return self._state
+
+    def retry_after(self):
+        with self._lock:
+            if self._state != self.OPEN:
+                return 0
+            return max(0, int(self.reset_timeout - (self._clock() - self._opened_at)) + 1)
+
+    def allow(self):
+        """Whether a call may go through. In half-open state only one probe is let through."""
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN:
+                if self._clock() - self._opened_at < self.reset_timeout:
+                    return False
+                self._state = self.HALF_OPEN
+            if self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def release(self):
+        """End a call that says nothing about upstream health, such as a 4xx."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probe_in_flight = False
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    logger.warning("Upstream puzzle API circuit opened after %d failures", self._failures)
+                self._state = self.OPEN
+                self._opened_at = self._clock()
+
+
+class UpstreamMetrics:
+    """Call counters plus a rolling window of latencies for the upstream API."""
+
+    def __init__(self, window=1000):
+        self._lock = threading.Lock()
+        self._latencies = collections.deque(maxlen=window)
+        self.calls = 0
+        self.successes = 0
+        self.failures = 0
+        self.retries = 0
+        self.short_circuited = 0
+
+    def incr(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def observe(self, latency, ok):
+        with self._lock:
+            self._latencies.append(latency)
+            if ok:
+                self.successes += 1
+            else:
+                self.failures += 1
+
+    def snapshot(self):
+        with self._lock:
+            latencies = sorted(self._latencies)
+            counters = {
+                "calls": self.calls,
+                "successes": self.successes,
+                "failures": self.failures,
+                "retries": self.retries,
+                "short_circuited": self.short_circuited,
+            }
+        def pct(p):
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000, 2)
+        return {
+            **counters,
+            "latency_ms_p50": pct(0.50),
+            "latency_ms_p99": pct(0.99),
+            "latency_ms_max": round(latencies[-1] * 1000, 2) if latencies else None,
+        }
+
+
+class UpstreamClient:
+    def __init__(self, url, connect_timeout=2.0, read_timeout=3.0, retries=2,
+                 backoff_base=0.1, backoff_max=1.0, deadline=5.0, pool_connections=4, pool_maxsize=16,
+                 failure_threshold=5, reset_timeout=30.0):
+        self.url = url
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.deadline = deadline
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.metrics = UpstreamMetrics()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def _backoff(self, attempt):
+        # "Full jitter": spreads retries from many workers instead of synchronising them.
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def fetch_puzzle(self):
+        if not self.breaker.allow():
+            self.metrics.incr('short_circuited')
+            raise UpstreamUnavailable(retry_after=self.breaker.retry_after())
+
+        self.metrics.incr('calls')
+        deadline = time.monotonic() + self.deadline
+        for attempt in range(self.retries + 1):
+            if attempt:
+                pause = self._backoff(attempt - 1)
+                if time.monotonic() + pause >= deadline:
+                    break
+                self.metrics.incr('retries')
+                time.sleep(pause)
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            # The read timeout bounds each wait for data, not the whole response.
+            timeout = (min(self.timeout[0], remaining), min(self.timeout[1], remaining))
+            start = time.perf_counter()
+            try:
+                res = self.session.get(self.url, timeout=timeout)
+                if res.status_code == 200:
+                    data = res.json()
+                    self.metrics.observe(time.perf_counter() - start, ok=True)
+                    self.breaker.record_success()
+                    return data
+                error = f"HTTP {res.status_code}"
+                retryable = res.status_code >= 500 or res.status_code == 429
+            except (requests.RequestException, ValueError) as exc:
+                error = exc
+                retryable = True
+            self.metrics.observe(time.perf_counter() - start, ok=False)
+            logger.warning("Upstream puzzle fetch failed (attempt %d): %s", attempt + 1, error)
+            if not retryable:
+                # Our request was refused; upstream itself may still be down.
+                self.breaker.release()
+                raise PuzzleFetchError("Failed to fetch puzzle", status_code=res.status_code)
+
+        self.breaker.record_failure()
+        raise UpstreamUnavailable(retry_after=self.breaker.retry_after() or None)
+
+    def close(self):
+        self.session.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_upstream_settings():
+    return {**DEFAULT_UPSTREAM_SETTINGS, **getattr(settings, 'PUZZLE_UPSTREAM', {})}
+
+
+def get_client():
+    """Return the process-wide upstream client."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                conf = get_upstream_settings()
+                _client = UpstreamClient(
+                    getattr(settings, 'PUZZLE_API_URL', DEFAULT_PUZZLE_API_URL),
+                    connect_timeout=conf['CONNECT_TIMEOUT'],
+                    read_timeout=conf['READ_TIMEOUT'],
+                    retries=conf['RETRIES'],
+                    backoff_base=conf['BACKOFF_BASE'],
+                    backoff_max=conf['BACKOFF_MAX'],
+                    deadline=conf['DEADLINE'],
+                    pool_connections=conf['POOL_CONNECTIONS'],
+                    pool_maxsize=conf['POOL_MAXSIZE'],
+                    failure_threshold=conf['FAILURE_THRESHOLD'],
+                    reset_timeout=conf['RESET_TIMEOUT'],
+                )
+    return _client
+
+
+def reset_client():
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+        _client = None
+
+
+@receiver(setting_changed)
+def _reset_on_setting_change(setting, **kwargs):
+    if setting in ('PUZZLE_API_URL', 'PUZZLE_UPSTREAM'):
+        reset_client()
+
+
+def fetch_puzzle():
+    return get_client().fetch_puzzle()
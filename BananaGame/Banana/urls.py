@@ -5,6 +5,9 @@ from rest_framework_simplejwt.views import TokenRefreshView
 urlpatterns = [
     path('register/', views.register, name='register'),
     path('login/', views.login, name='login'),
+    # Opt-in async variants for ASGI deployments; see Banana.hashing.
+    path('register/async/', views.register_async, name='register-async'),
+    path('login/async/', views.login_async, name='login-async'),
     path('login/request-otp/', views.request_email_otp, name='request-email-otp'),
     path('login/verify-otp/', views.verify_email_otp_login, name='verify-email-otp'),
     path('logout/', views.logout, name='logout'),
@@ -13,7 +16,11 @@ urlpatterns = [
     path('player/', views.player_detail, name='player-detail'),
     path('submit-score/', views.submit_score, name='submit-score'),
     path('leaderboard/', views.leaderboard, name='leaderboard'),
+    path('leaderboard/me/', views.my_rank, name='my-rank'),
+    path('leaderboard/cache-stats/', views.leaderboard_cache_stats, name='leaderboard-cache-stats'),
+    path('leaderboard/stream/', views.leaderboard_stream, name='leaderboard-stream'),
     path('puzzle/', views.fetch_puzzle, name='fetch-puzzle'),
+    path('puzzle/pool-stats/', views.puzzle_pool_stats, name='puzzle-pool-stats'),
     path('check-puzzle/', views.check_puzzle_answer, name='check-puzzle'),
     path('use-hint/', views.use_hint, name='use-hint'),
     path('set-difficulty/', views.set_difficulty, name='set-difficulty'),
@@ -24,15 +31,18 @@ urlpatterns = [
     path('contact/', views.submit_contact, name='submit-contact'),
     
     path('ratings/', views.get_ratings, name='get-ratings'),
+    path('ratings/list/', views.get_rating_list, name='get-rating-list'),
     path('ratings/submit/', views.submit_rating, name='submit-rating'),
     path('ratings/my-rating/', views.get_user_rating, name='get-user-rating'),
     
     
     path('reviews/', views.get_reviews, name='get-reviews'),
+    path('reviews/search/', views.search_reviews, name='search-reviews'),
     path('reviews/submit/', views.submit_review, name='submit-review'),
     path('reviews/my-reviews/', views.get_user_reviews, name='get-user-reviews'),
     
     
     path('certificate/', views.get_certificate, name='get-certificate'),
+    path('certificate/stats/', views.certificate_stats, name='certificate-stats'),
 
 ]
\ No newline at end of file
@@ -1,18 +1,26 @@
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, permission_classes, throttle_classes
 from rest_framework.response import Response
-from rest_framework import status
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework import serializers, status
+from rest_framework.permissions import AllowAny, IsAuthenticated, IsAdminUser
 from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework_simplejwt.exceptions import TokenError
-from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
 from django.contrib.auth.models import User
-from django.conf import settings
-from django.core.mail import send_mail
+from django.contrib.auth.signals import user_login_failed
+from django.db import transaction
+from django.http import FileResponse, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.http import parse_etags
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from asgiref.sync import sync_to_async
+import json
 import logging
+import math
 
 from .serializers import (
     RegisterSerializer,
     CustomTokenObtainPairSerializer,
+    LoginSerializer,
     PlayerSerializer,
     ScoreSerializer,
     EmailOTPRequestSerializer,
@@ -23,7 +31,13 @@ from .serializers import (
     ReviewSerializer,
     ReviewCreateSerializer,
 )
-from .models import Player, Score, OTP, Contact, Rating, Review
+from .models import Player, Score, OTP, OutboxEmail, Contact, Rating, Review
+from . import leaderboard as leaderboard_service
+from . import certificates, hashing, jobs, leaderboard_cache, otp, outbox, pagination, purge, realtime
+from . import puzzle_pool, puzzle_tokens, ranking, ratings, reviews, scoring, search, sessions, throttling, upstream
+from .authentication import get_player, invalidate_user
+from .puzzle_tokens import InvalidPuzzleToken
+from .upstream import PuzzleFetchError, UpstreamUnavailable
 
 logger = logging.getLogger(__name__)
 # @api_view(['POST'])
@@ -41,40 +55,143 @@ logger = logging.getLogger(__name__)
 #     return Response({"detail": serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
 
 
+def _request_data(request):
+    """The JSON or form body of a plain Django view's request; ValueError if the JSON is malformed."""
+    if request.content_type == 'application/json':
+        return json.loads(request.body or b'{}')
+    return request.POST
+
+
+def _issue_tokens(user):
+    refresh = RefreshToken.for_user(user)
+    return {
+        'refresh': str(refresh),
+        'access': str(refresh.access_token),
+        'username': user.username,
+    }
+
+
+def _throttled_response(wait):
+    # The same body and header DRF gives its own throttled views.
+    wait = math.ceil(wait)
+    response = JsonResponse(
+        {"detail": f"Request was throttled. Expected available in {wait} second{'' if wait == 1 else 's'}."},
+        status=429,
+    )
+    response['Retry-After'] = str(wait)
+    return response
+
+
+def _hashing_busy_response():
+    response = JsonResponse({"detail": "Too many sign-ins in progress, try again shortly."}, status=503)
+    response['Retry-After'] = str(hashing.get_hashing_settings()['RETRY_AFTER'])
+    return response
+
+
+def _create_account(serializer, password_hash):
+    try:
+        user = serializer.save(password_hash=password_hash)
+    except serializers.ValidationError as exc:
+        return {"detail": exc.detail}, status.HTTP_400_BAD_REQUEST
+    return _issue_tokens(user), status.HTTP_201_CREATED
+
+
 @api_view(['POST'])
 @permission_classes([AllowAny])
 def register(request):
     serializer = RegisterSerializer(data=request.data)
-    if serializer.is_valid():
-        user = serializer.save()
-        Player.objects.get_or_create(user=user)  
-        refresh = RefreshToken.for_user(user)
-        return Response({
-            'refresh': str(refresh),
-            'access': str(refresh.access_token),
-            'username': user.username,
-        }, status=status.HTTP_201_CREATED)
-    return Response({"detail": serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+    # No queries: taken usernames and emails are caught by the insert.
+    if not serializer.is_valid():
+        return Response({"detail": serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+    body, status_code = _create_account(serializer, None)
+    return Response(body, status=status_code)
+
+
+@csrf_exempt
+@require_POST
+async def register_async(request):
+    """
+    ``register`` hashing the password on Banana.hashing's pool. Only worth
+    routing to under ASGI; under WSGI it runs on a request thread like any view.
+    """
+    try:
+        data = _request_data(request)
+    except ValueError:
+        return JsonResponse({"detail": "Malformed JSON body"}, status=400)
+    serializer = RegisterSerializer(data=data)
+    # No queries: taken usernames and emails are caught by the insert.
+    if not serializer.is_valid():
+        return JsonResponse({"detail": serializer.errors}, status=400)
+    try:
+        password_hash = await hashing.hash_password(serializer.validated_data['password'])
+    except hashing.HashingBusy:
+        return _hashing_busy_response()
+    body, status_code = await sync_to_async(_create_account)(serializer, password_hash)
+    return JsonResponse(body, status=status_code)
+
+
+def _complete_login(user, new_password_hash):
+    if new_password_hash:
+        user.password = new_password_hash
+        user.save(update_fields=['password'])
+    # Each login adds an OutstandingToken; clear out the expired ones once a day.
+    transaction.on_commit(purge.maybe_schedule)
+    return _issue_tokens(user)
 
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@throttle_classes([throttling.rate_limit('login')])
 def login(request):
     serializer = CustomTokenObtainPairSerializer(data=request.data)
     if serializer.is_valid():
+        # Each login adds an OutstandingToken; clear out the expired ones once a day.
+        transaction.on_commit(purge.maybe_schedule)
         return Response(serializer.validated_data, status=status.HTTP_200_OK)
     return Response({"detail": serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
 
+
+@csrf_exempt
+@require_POST
+async def login_async(request):
+    """
+    ``login`` checking the password on Banana.hashing's pool, for ASGI
+    deployments. It checks the password of the ``User`` row itself rather
+    than going through ``authenticate()``, so only use it with the default
+    ``ModelBackend``; failures still send ``user_login_failed``.
+    """
+    try:
+        data = _request_data(request)
+    except ValueError:
+        return JsonResponse({"detail": "Malformed JSON body"}, status=400)
+    wait = await sync_to_async(throttling.check_request)('login', request, data)
+    if wait is not None:
+        return _throttled_response(wait)
+    serializer = LoginSerializer(data=data)
+    if not serializer.is_valid():
+        return JsonResponse({"detail": serializer.errors}, status=400)
+
+    user = await User.objects.filter(username=serializer.validated_data['username']).afirst()
+    try:
+        matches, new_password_hash = await hashing.verify_password(user, serializer.validated_data['password'])
+    except hashing.HashingBusy:
+        return _hashing_busy_response()
+    if not matches or not user.is_active:
+        await sync_to_async(user_login_failed.send)(
+            sender=__name__, credentials={'username': serializer.validated_data['username']}, request=request,
+        )
+        return JsonResponse({"detail": {"detail": ["Invalid username or password"]}}, status=400)
+    return JsonResponse(await sync_to_async(_complete_login)(user, new_password_hash))
+
 def send_otp_email(email, otp_code):
     try:
         subject = 'Your Banana Game Login OTP'
         message = (
             f'Your OTP for Banana Game login is: {otp_code}\n\n'
-            'This OTP is valid for 10 minutes.'
+            f'This OTP is valid for {otp.validity_minutes()} minutes.'
         )
-        from_email = getattr(settings, 'DEFAULT_FROM_EMAIL', getattr(settings, 'EMAIL_HOST_USER', None))
-        recipient_list = [email]
-        send_mail(subject, message, from_email, recipient_list, fail_silently=False)
+        # Ahead of everything else queued; the body is blanked once it's sent.
+        outbox.send(subject, message, [email], priority=OutboxEmail.PRIORITY_HIGH, secret=True)
         return True
     except Exception as exc:
         logger.error("Failed to send OTP email: %s", exc)
@@ -92,9 +209,7 @@ def send_contact_thankyou_email(name, email):
             'Best regards,\n'
             'Banana Brain Blitz Team'
         )
-        from_email = getattr(settings, 'DEFAULT_FROM_EMAIL', getattr(settings, 'EMAIL_HOST_USER', None))
-        recipient_list = [email]
-        send_mail(subject, message, from_email, recipient_list, fail_silently=False)
+        outbox.send(subject, message, [email])
         return True
     except Exception as exc:
         logger.error("Failed to send contact thank you email: %s", exc)
@@ -114,9 +229,7 @@ def send_review_thankyou_email(user_email, username, review_title):
             'Best regards,\n'
             'Banana Brain Blitz Team'
         )
-        from_email = getattr(settings, 'DEFAULT_FROM_EMAIL', getattr(settings, 'EMAIL_HOST_USER', None))
-        recipient_list = [user_email]
-        send_mail(subject, message, from_email, recipient_list, fail_silently=False)
+        outbox.send(subject, message, [user_email])
         return True
     except Exception as exc:
         logger.error("Failed to send review thank you email: %s", exc)
@@ -125,6 +238,7 @@ def send_review_thankyou_email(user_email, username, review_title):
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@throttle_classes([throttling.rate_limit('otp_request')])
 def request_email_otp(request):
     serializer = EmailOTPRequestSerializer(data=request.data)
     if not serializer.is_valid():
@@ -137,15 +251,15 @@ def request_email_otp(request):
     except User.DoesNotExist:
         return Response({"detail": "User with this email was not found."}, status=status.HTTP_404_NOT_FOUND)
 
-    otp = OTP.generate_otp(user, OTP.EMAIL, email)
+    otp_code = otp.issue(user, OTP.EMAIL, email)
 
-    if not send_otp_email(email, otp.otp_code):
+    if not send_otp_email(email, otp_code):
         return Response({"detail": "Failed to send OTP. Please try again later."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
     return Response(
         {
             "detail": "OTP sent successfully to your email.",
-            "expires_in_minutes": 10
+            "expires_in_minutes": otp.validity_minutes()
         },
         status=status.HTTP_200_OK
     )
@@ -153,6 +267,7 @@ def request_email_otp(request):
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@throttle_classes([throttling.rate_limit('otp_verify')])
 def verify_email_otp_login(request):
     serializer = EmailOTPVerifySerializer(data=request.data)
     if not serializer.is_valid():
@@ -166,7 +281,7 @@ def verify_email_otp_login(request):
     except User.DoesNotExist:
         return Response({"detail": "User with this email was not found."}, status=status.HTTP_404_NOT_FOUND)
 
-    is_valid, message = OTP.verify_otp(user, otp_code, OTP.EMAIL)
+    is_valid, message = otp.verify(user, otp_code, OTP.EMAIL)
     if not is_valid:
         return Response({"detail": message}, status=status.HTTP_400_BAD_REQUEST)
 
@@ -202,17 +317,14 @@ def logout(request):
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def logout_all(request):
-    tokens = OutstandingToken.objects.filter(user=request.user)
-
-    for outstanding_token in tokens:
-        BlacklistedToken.objects.get_or_create(token=outstanding_token)
+    sessions.revoke_all_sessions([request.user.pk])
 
     return Response({"detail": "Logged out from all sessions"}, status=status.HTTP_205_RESET_CONTENT)
 
 @api_view(['GET', 'PATCH'])
 @permission_classes([IsAuthenticated])
 def player_detail(request):
-    player, created = Player.objects.get_or_create(user=request.user)
+    player = get_player(request, fresh=request.method == 'PATCH')
 
     if request.method == 'GET':
         serializer = PlayerSerializer(player)
@@ -236,13 +348,26 @@ def submit_score(request):
             return Response({"detail": "Missing score field"}, status=status.HTTP_400_BAD_REQUEST)
 
         
-        score_instance = Score.objects.create(user=request.user, score=int(score_value))
+        with transaction.atomic():
+            score_instance = Score.objects.create(user=request.user, score=int(score_value))
+            changed = leaderboard_service.record_score(request.user, score_instance.score, score_instance.date)
+            if leaderboard_service.ALL_TIME in changed:
+                transaction.on_commit(lambda: ranking.get_ranking().update(
+                    request.user.id, request.user.username, score_instance.score, score_instance.date
+                ))
+            top_changed = leaderboard_service.top_n_changed(changed, score_instance.score, score_instance.date)
+            if top_changed:
+                transaction.on_commit(lambda: leaderboard_cache.invalidate(top_changed))
+                transaction.on_commit(lambda: realtime.notify(top_changed))
+            if leaderboard_service.ALL_TIME in top_changed:
+                transaction.on_commit(certificates.schedule_prerender)
 
         
-        player, created = Player.objects.get_or_create(user=request.user)
-        if score_instance.score > player.high_score:
-            player.high_score = score_instance.score
-            player.save()
+        player = get_player(request)
+        if Player.objects.filter(pk=player.pk, high_score__lt=score_instance.score).update(
+            high_score=score_instance.score
+        ):
+            invalidate_user(request.user.pk)
 
         
         return Response({
@@ -255,181 +380,115 @@ def submit_score(request):
         return Response({"detail": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
-from django.db.models import Max
-
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def leaderboard(request):
-    top_scores = (
-        Score.objects
-        .values('user__username')
-        .annotate(highest_score=Max('score'))
-        .order_by('-highest_score')[:10]
-    )
+    window = request.query_params.get('window', leaderboard_service.ALL_TIME)
+    if window not in leaderboard_service.WINDOWS:
+        return Response(
+            {"detail": f"window must be one of: {', '.join(leaderboard_service.WINDOWS)}"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if not leaderboard_cache.enabled():
+        leaderboard_data = leaderboard_service.top_entries(10, window=window)
+        return Response(leaderboard_data, status=status.HTTP_200_OK)
+
+    etag = leaderboard_cache.etag(window)
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        leaderboard_cache.stats.incr('not_modified')
+        response = Response(status=status.HTTP_304_NOT_MODIFIED)
+    else:
+        response = Response(leaderboard_cache.top_entries(window, etag), status=status.HTTP_200_OK)
+    response['ETag'] = etag
+    # Let clients keep the body but revalidate it on every poll.
+    response['Cache-Control'] = 'no-cache'
+    return response
 
-    
-    leaderboard_data = [
-        {'username': item['user__username'], 'score': item['highest_score']}
-        for item in top_scores
-    ]
 
-    return Response(leaderboard_data, status=status.HTTP_200_OK)
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def certificate_stats(request):
+    """Certificate store and pre-render hit rates plus background job counters for this worker"""
+    return Response({
+        **certificates.get_store().stats(),
+        "jobs": jobs.get_runner().stats(),
+    }, status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def leaderboard_cache_stats(request):
+    """Leaderboard response cache hit/miss counters for this worker"""
+    return Response(leaderboard_cache.stats.snapshot(), status=status.HTTP_200_OK)
+
+
+@require_GET
+async def leaderboard_stream(request):
+    """Server-sent leaderboard snapshot and deltas (serve through ASGI)"""
+    window = request.GET.get('window', leaderboard_service.ALL_TIME)
+    if window not in leaderboard_service.WINDOWS:
+        return JsonResponse(
+            {"detail": f"window must be one of: {', '.join(leaderboard_service.WINDOWS)}"}, status=400
+        )
+    response = StreamingHttpResponse(realtime.event_stream(window), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream.
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def my_rank(request):
+    """Current user's rank plus up to ``around`` players just above and below them"""
+    try:
+        around = min(max(int(request.query_params.get('around', 2)), 0), 25)
+    except ValueError:
+        return Response({"detail": "around must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+
+    board = ranking.get_ranking()
+    rank, neighbours = board.around(request.user.id, around)
+    if rank is None:
+        return Response({"detail": "No score submitted yet."}, status=status.HTTP_404_NOT_FOUND)
+
+    return Response({
+        "rank": rank,
+        "score": next(entry['score'] for entry in neighbours if entry['rank'] == rank),
+        "total_players": len(board),
+        "neighbours": neighbours,
+    }, status=status.HTTP_200_OK)
 
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_certificate(request):
     """
-    Generate and return certificate PDF for top 3 players
+    Return the certificate PDF for top 3 players, rendered once per rank/score/day
     """
     try:
-        from reportlab.lib.pagesizes import A4, landscape
-        from reportlab.lib import colors
-        from reportlab.lib.units import mm
-        from reportlab.pdfgen import canvas
-        from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-        from reportlab.platypus import Paragraph, Spacer
-        from reportlab.lib.enums import TA_CENTER
-        from io import BytesIO
-        from django.http import HttpResponse
-        from datetime import datetime
-        
-        
-        top_scores = (
-            Score.objects
-            .values('user__username')
-            .annotate(highest_score=Max('score'))
-            .order_by('-highest_score')[:10]
-        )
-        
-        leaderboard_data = [
-            {'username': item['user__username'], 'score': item['highest_score']}
-            for item in top_scores
-        ]
-        
-        
-        user_rank = None
-        user_score = None
-        for idx, entry in enumerate(leaderboard_data, 1):
-            if entry['username'] == request.user.username:
-                user_rank = idx
-                user_score = entry['score']
-                break
-        
-        
-        if not user_rank or user_rank > 3:
+        # From the table, not this process's rank index, which may not have seen another worker's submit.
+        user_rank, user_score = leaderboard_service.rank_within(request.user, 3)
+        if user_rank is None:
             return Response(
                 {"detail": "Certificate is only available for top 3 players."},
                 status=status.HTTP_403_FORBIDDEN
             )
         
-        
-        buffer = BytesIO()
-        p = canvas.Canvas(buffer, pagesize=landscape(A4))
-        width, height = landscape(A4)
-        
-        
-        p.setFillColor(colors.HexColor('#FCD34D'))  
-        p.rect(0, 0, width, height, fill=1)
-        
-        
-        p.setStrokeColor(colors.HexColor('#F59E0B'))
-        p.setLineWidth(20)
-        p.rect(10, 10, width - 20, height - 20, fill=0, stroke=1)
-        
-        
-        p.setStrokeColor(colors.HexColor('#D97706'))
-        p.setLineWidth(5)
-        p.rect(30, 30, width - 60, height - 60, fill=0, stroke=1)
-        
-        
-        p.setFillColor(colors.HexColor('#92400E'))
-        p.setFont("Helvetica-Bold", 48)
-        title = "CERTIFICATE OF ACHIEVEMENT"
-        title_width = p.stringWidth(title, "Helvetica-Bold", 48)
-        p.drawString((width - title_width) / 2, height - 120, title)
-        
-        
-        p.setStrokeColor(colors.HexColor('#92400E'))
-        p.setLineWidth(3)
-        p.line(width * 0.2, height - 160, width * 0.8, height - 160)
-        
-        
-        place_texts = {1: "CHAMPION", 2: "RUNNER-UP", 3: "THIRD PLACE"}
-        place_colors = {
-            1: colors.HexColor('#FCD34D'),
-            2: colors.HexColor('#9CA3AF'),
-            3: colors.HexColor('#FB923C')
-        }
-        
-        p.setFillColor(place_colors[user_rank])
-        p.setFont("Helvetica-Bold", 36)
-        place_text = place_texts[user_rank]
-        place_width = p.stringWidth(place_text, "Helvetica-Bold", 36)
-        p.drawString((width - place_width) / 2, height - 220, place_text)
-        
-        
-        p.setFillColor(colors.HexColor('#78350F'))
-        p.setFont("Helvetica", 24)
-        subtitle = f"{'First' if user_rank == 1 else 'Second' if user_rank == 2 else 'Third'} Place Winner"
-        subtitle_width = p.stringWidth(subtitle, "Helvetica", 24)
-        p.drawString((width - subtitle_width) / 2, height - 270, subtitle)
-        
-        
-        p.setFillColor(colors.HexColor('#78350F'))
-        p.setFont("Helvetica", 20)
-        certify_text = "This is to certify that"
-        certify_width = p.stringWidth(certify_text, "Helvetica", 20)
-        p.drawString((width - certify_width) / 2, height - 320, certify_text)
-        
-       
-        p.setFillColor(colors.HexColor('#1F2937'))
-        p.setFont("Helvetica-Bold", 42)
-        player_name = request.user.username
-        name_width = p.stringWidth(player_name, "Helvetica-Bold", 42)
-        p.drawString((width - name_width) / 2, height - 380, player_name)
-        
-        
-        p.setFillColor(colors.HexColor('#78350F'))
-        p.setFont("Helvetica", 22)
-        achievement_text = f"Has achieved {user_rank}{'st' if user_rank == 1 else 'nd' if user_rank == 2 else 'rd'} Place"
-        achievement_width = p.stringWidth(achievement_text, "Helvetica", 22)
-        p.drawString((width - achievement_width) / 2, height - 440, achievement_text)
-        
-      
-        p.setFont("Helvetica", 20)
-        game_text = "in the Banana Brain Blitz Game"
-        game_width = p.stringWidth(game_text, "Helvetica", 20)
-        p.drawString((width - game_width) / 2, height - 480, game_text)
-        
-        
-        p.setFont("Helvetica-Bold", 28)
-        score_text = f"Final Score: {user_score} Points"
-        score_width = p.stringWidth(score_text, "Helvetica-Bold", 28)
-        p.drawString((width - score_width) / 2, height - 540, score_text)
-        
-        
-        p.setFillColor(colors.HexColor('#78350F'))
-        p.setFont("Helvetica", 16)
-        date_text = f"Date: {datetime.now().strftime('%B %d, %Y')}"
-        date_width = p.stringWidth(date_text, "Helvetica", 16)
-        p.drawString((width - date_width) / 2, 80, date_text)
-        
-        
-        p.setFont("Helvetica-Bold", 40)
-        p.setFillColor(colors.HexColor('#92400E'))
-        p.drawString(100, height - 100, "*")
-        p.drawString(width - 140, height - 100, "*")
-        p.drawString(100, 120, "*")
-        p.drawString(width - 140, 120, "*")
-        
-        p.showPage()
-        p.save()
-        
-        buffer.seek(0)
-        response = HttpResponse(buffer, content_type='application/pdf')
-        response['Content-Disposition'] = f'attachment; filename="Banana_Game_Certificate_{request.user.username}_{user_rank}st.pdf"'
-        
+        filename = f"Banana_Game_Certificate_{request.user.username}_{user_rank}st.pdf"
+        today = timezone.localdate()
+        if not certificates.get_certificate_settings()['ENABLED']:
+            pdf = certificates.render(request.user.username, user_rank, user_score, today)
+            response = HttpResponse(pdf, content_type='application/pdf')
+            response['Content-Disposition'] = f'attachment; filename="{filename}"'
+            return response
+
+        etag = f'"{certificates.certificate_key(request.user.username, user_rank, user_score, today)}"'
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            pdf, _ = certificates.get_store().open_or_render(request.user.username, user_rank, user_score, today)
+            response = FileResponse(pdf, as_attachment=True, filename=filename, content_type='application/pdf')
+        response['ETag'] = etag
         return response
         
     except Exception as e:
@@ -441,12 +500,10 @@ def get_certificate(request):
 
 
 
-import requests
 from django.http import JsonResponse
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import AllowAny
 
-import requests
 from django.http import JsonResponse
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import AllowAny
@@ -456,22 +513,42 @@ from .models import Player
 @permission_classes([IsAuthenticated])
 def fetch_puzzle(request):
     try:
-        res = requests.get("https://marcconrad.com/uob/banana/api.php", timeout=5)
-        if res.status_code != 200:
-            return JsonResponse({"error": "Failed to fetch puzzle"}, status=res.status_code)
-
-        data = res.json()
-        player, _ = Player.objects.get_or_create(user=request.user)
-        player.current_puzzle = data  
-        player.save()
+        try:
+            data = puzzle_pool.get_puzzle()
+        except UpstreamUnavailable as e:
+            response = JsonResponse({"error": str(e), "degraded": True, "retry_after": e.retry_after}, status=503)
+            if e.retry_after:
+                response['Retry-After'] = str(e.retry_after)
+            return response
+        except PuzzleFetchError as e:
+            return JsonResponse({"error": str(e)}, status=e.status_code)
+
+        player = get_player(request)
+        if puzzle_tokens.enabled():
+            data['puzzle_token'] = puzzle_tokens.issue(
+                request.user.id, data.get('question', ''), data.get('solution', ''), player.difficulty
+            )
+        else:
+            player.current_puzzle = data
+            player.save(update_fields=['current_puzzle'])
 
-       
         data.pop('solution', None)
         return JsonResponse(data, safe=False)
     except Exception as e:
         return JsonResponse({"error": str(e)}, status=500)
 
 
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def puzzle_pool_stats(request):
+    """Puzzle pool depth/hit-rate and upstream API latency/failure counters for this worker"""
+    client = upstream.get_client()
+    return Response({
+        **puzzle_pool.get_pool().stats(),
+        "upstream": {**client.metrics.snapshot(), "circuit": client.breaker.state},
+    }, status=status.HTTP_200_OK)
+
+
 
 from django.http import JsonResponse
 from rest_framework.decorators import api_view, permission_classes
@@ -482,97 +559,64 @@ from .models import Player
 @permission_classes([IsAuthenticated])
 def check_puzzle_answer(request):
     try:
-        from datetime import date
-        import random
-        
         user_answer = str(request.data.get('answer', '')).strip()
         time_taken = request.data.get('time_taken', 0)  
         hints_used = request.data.get('hints_used', 0)  
         if not user_answer:
             return JsonResponse({"error": "Missing answer"}, status=400)
 
-        player, _ = Player.objects.get_or_create(user=request.user)
-        puzzle_data = player.current_puzzle or {}
-
-        real_solution = str(puzzle_data.get('solution', '')).strip()
-        if not real_solution:
-            return JsonResponse({"error": "No puzzle stored. Please fetch again."}, status=400)
+        player = get_player(request, fresh=True)
+        use_token = puzzle_tokens.enabled()
 
-        correct = user_answer == real_solution
-        puzzle_id = puzzle_data.get('question', '')
+        if use_token:
+            try:
+                claims = puzzle_tokens.load(request.data.get('puzzle_token'), request.user.id)
+            except InvalidPuzzleToken as e:
+                return JsonResponse({"error": str(e)}, status=400)
+            if not puzzle_tokens.consume(claims):
+                return JsonResponse({"error": "Puzzle already answered. Please fetch again."}, status=400)
+            correct = puzzle_tokens.check_answer(claims, user_answer)
+            real_solution = user_answer if correct else puzzle_tokens.recover_solution(claims)
+            puzzle_id = claims['q']
+            difficulty = claims['d']
+        else:
+            puzzle_data = player.current_puzzle or {}
+            real_solution = str(puzzle_data.get('solution', '')).strip()
+            if not real_solution:
+                return JsonResponse({"error": "No puzzle stored. Please fetch again."}, status=400)
+            correct = user_answer == real_solution
+            puzzle_id = puzzle_data.get('question', '')
+            difficulty = player.difficulty
 
         if correct:
-            
-            difficulty_multipliers = {'easy': 0.7, 'medium': 1.0, 'hard': 1.5}
-            base_points = 10 * difficulty_multipliers.get(player.difficulty, 1.0)
-            
-           
-            time_bonus = max(0, (40 - time_taken) / 2) if time_taken > 0 else 0
-            time_bonus = min(time_bonus, 15)  
-            
-            
-            combo_bonus = player.combo_count * 2
-            player.combo_count += 1
-            if player.combo_count > player.max_combo:
-                player.max_combo = player.combo_count
-            
-            
-            perfect_bonus = 0
-            if hints_used == 0:
-                perfect_bonus = 10
-                player.perfect_solves += 1
-            
-            
-            lucky_multiplier = 2.0 if random.random() < 0.05 else 1.0
-                        
-            total_points = int((base_points + time_bonus + combo_bonus + perfect_bonus) * lucky_multiplier)
-                        
-            xp_gained = total_points
-            if hints_used == 0:
-                xp_gained += 5  
-                        
-            old_level = player.level
-            player.xp += xp_gained
-            new_level = (player.xp // 100) + 1
-            leveled_up = new_level > old_level
-            player.level = new_level
-            
-            
-            player.puzzles_solved += 1
-            
-           
-            if puzzle_id:
-                if puzzle_id not in player.puzzle_history:
-                    player.puzzle_history.append(puzzle_id)
-                    if len(player.puzzle_history) > 50:
-                        player.puzzle_history = player.puzzle_history[-50:]
+            result = scoring.score_solve(player.combo_count, difficulty, time_taken, hints_used)
+            if not scoring.apply_solve(player, result, puzzle_id, clear_puzzle=not use_token):
+                return JsonResponse({"error": "No puzzle stored. Please fetch again."}, status=400)
+
+            new_combo = player.combo_count + 1
+            new_level = scoring.level_for_xp(player.xp + result.xp_gained)
+            leveled_up = new_level > player.level
 
-            
-            player.current_puzzle = {}
-            player.save()
-            
             return JsonResponse({
                 "correct": True,
-                "points": total_points,
-                "xp_gained": xp_gained,
-                "combo": player.combo_count,
+                "points": result.total_points,
+                "xp_gained": result.xp_gained,
+                "combo": new_combo,
                 "leveled_up": leveled_up,
                 "new_level": new_level if leveled_up else None,
-                "perfect_solve": hints_used == 0,
-                "lucky_streak": lucky_multiplier > 1.0,
+                "perfect_solve": result.perfect,
+                "lucky_streak": result.lucky_multiplier > 1.0,
                 "breakdown": {
-                    "base_points": int(base_points),
-                    "time_bonus": int(time_bonus),
-                    "combo_bonus": combo_bonus,
-                    "perfect_bonus": perfect_bonus,
-                    "lucky_multiplier": lucky_multiplier
+                    "base_points": int(result.base_points),
+                    "time_bonus": int(result.time_bonus),
+                    "combo_bonus": result.combo_bonus,
+                    "perfect_bonus": result.perfect_bonus,
+                    "lucky_multiplier": result.lucky_multiplier
                 }
             })
         else:
-           
-            player.combo_count = 0
-            player.current_puzzle = {}
-            player.save()
+            if not scoring.apply_miss(player, puzzle_id, clear_puzzle=not use_token):
+                return JsonResponse({"error": "No puzzle stored. Please fetch again."}, status=400)
             return JsonResponse({"correct": False, "correct_answer": real_solution})
     except Exception as e:
         return JsonResponse({"error": str(e)}, status=500)
@@ -591,14 +635,21 @@ def use_hint(request):
     5. Multiple choice hint (answer is one of X, Y, Z)
     """
     try:
-        player, _ = Player.objects.get_or_create(user=request.user)
+        player = get_player(request, fresh=True)
               
         if player.hints <= 0:
             return JsonResponse({"error": "No hints available"}, status=400)
         
 
-        puzzle_data = player.current_puzzle or {}
-        real_solution = str(puzzle_data.get('solution', '')).strip()
+        if puzzle_tokens.enabled():
+            try:
+                claims = puzzle_tokens.load(request.data.get('puzzle_token'), request.user.id)
+            except InvalidPuzzleToken as e:
+                return JsonResponse({"error": str(e)}, status=400)
+            real_solution = puzzle_tokens.recover_solution(claims) or ''
+        else:
+            puzzle_data = player.current_puzzle or {}
+            real_solution = str(puzzle_data.get('solution', '')).strip()
         
         if not real_solution:
             return JsonResponse({"error": "No puzzle stored. Please fetch a puzzle first."}, status=400)
@@ -610,7 +661,7 @@ def use_hint(request):
         
  
         player.hints -= 1
-        player.save()
+        player.save(update_fields=['hints'])
         
         import random
         hint_type = random.choice(['wrong_answer', 'range', 'parity', 'comparison', 'multiple_choice'])
@@ -673,9 +724,9 @@ def set_difficulty(request):
         if difficulty not in ['easy', 'medium', 'hard']:
             return JsonResponse({"error": "Invalid difficulty. Must be 'easy', 'medium', or 'hard'"}, status=400)
         
-        player, _ = Player.objects.get_or_create(user=request.user)
+        player = get_player(request)
         player.difficulty = difficulty
-        player.save()
+        player.save(update_fields=['difficulty'])
         
         return JsonResponse({
             "difficulty": difficulty,
@@ -692,7 +743,7 @@ def get_daily_challenge(request):
     try:
         from datetime import date, timedelta
         
-        player, _ = Player.objects.get_or_create(user=request.user)
+        player = get_player(request)
         today = date.today()
         
         if player.last_daily_challenge == today:
@@ -732,7 +783,7 @@ def claim_daily_challenge(request):
     try:
         from datetime import date, timedelta
         
-        player, _ = Player.objects.get_or_create(user=request.user)
+        player = get_player(request, fresh=True)
         today = date.today()
         
 
@@ -769,7 +820,7 @@ def claim_daily_challenge(request):
 def get_game_stats(request):
     """Get comprehensive game statistics"""
     try:
-        player, _ = Player.objects.get_or_create(user=request.user)
+        player = get_player(request)
         
         xp_for_current_level = (player.level - 1) * 100
         xp_for_next_level = player.level * 100
@@ -797,6 +848,7 @@ def get_game_stats(request):
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@throttle_classes([throttling.rate_limit('contact')])
 def submit_contact(request):
     """Submit a contact form"""
     try:
@@ -823,22 +875,29 @@ def submit_contact(request):
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def get_ratings(request):
-    """Get all ratings with average"""
+    """Average, count and per-star histogram of all ratings, from the one-row summary"""
+    try:
+        return Response(ratings.summary(), status=status.HTTP_200_OK)
+    except Exception as e:
+        return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def get_rating_list(request):
+    """Individual ratings, newest first, a page at a time (pass back ``next`` as ``cursor``)"""
+    try:
+        cursor, page_size = pagination.page_params(request.query_params)
+        rows, next_cursor = pagination.paginate(
+            Rating.objects.select_related('user').only('id', 'rating', 'created_at', 'updated_at', 'user__username'),
+            cursor, page_size,
+        )
+    except pagination.InvalidCursor as exc:
+        return Response({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
     try:
-        ratings = Rating.objects.all()
-        serializer = RatingSerializer(ratings, many=True)
-        
-        if ratings.exists():
-            avg_rating = sum(r.rating for r in ratings) / ratings.count()
-            total_ratings = ratings.count()
-        else:
-            avg_rating = 0
-            total_ratings = 0
-        
         return Response({
-            "ratings": serializer.data,
-            "average_rating": round(avg_rating, 2),
-            "total_ratings": total_ratings
+            "ratings": RatingSerializer(rows, many=True).data,
+            "next": next_cursor,
         }, status=status.HTTP_200_OK)
     except Exception as e:
         return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -852,19 +911,12 @@ def submit_rating(request):
         rating_value = request.data.get('rating')
         if not rating_value:
             return Response({"error": "Rating is required"}, status=status.HTTP_400_BAD_REQUEST)
-        
-        rating, created = Rating.objects.get_or_create(
-            user=request.user,
-            defaults={'rating': rating_value}
-        )
-        
-        if not created:
-            serializer = RatingCreateSerializer(rating, data={'rating': rating_value})
-            if serializer.is_valid():
-                serializer.save()
-            else:
-                return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-        
+
+        serializer = RatingCreateSerializer(data={'rating': rating_value})
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        rating, created = ratings.submit(request.user, serializer.validated_data['rating'])
+
         return Response({
             "message": "Rating submitted successfully" if created else "Rating updated successfully",
             "rating": rating.rating
@@ -888,16 +940,54 @@ def get_user_rating(request):
         return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+def _for_review_serializer(queryset):
+    """Just the columns ReviewSerializer reads, with the username joined in."""
+    return queryset.select_related('user').only(
+        'id', 'title', 'content', 'rating', 'is_approved', 'created_at', 'updated_at', 'user__username'
+    )
+
+
+def _review_page(queryset, request):
+    """One keyset page of ``queryset`` as (rows, next_cursor), in a single query."""
+    cursor, page_size = pagination.page_params(request.query_params)
+    return pagination.paginate(_for_review_serializer(queryset), cursor, page_size)
+
+
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def get_reviews(request):
-    """Get all approved reviews"""
+    """Approved reviews, newest first, a page at a time (pass back ``next`` as ``cursor``)"""
+    try:
+        rows, next_cursor = _review_page(Review.objects.filter(is_approved=True), request)
+    except pagination.InvalidCursor as exc:
+        return Response({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        return Response({
+            "reviews": ReviewSerializer(rows, many=True).data,
+            "count": reviews.approved_count(),
+            "next": next_cursor,
+        }, status=status.HTTP_200_OK)
+    except Exception as e:
+        return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+@throttle_classes([throttling.rate_limit('search')])
+def search_reviews(request):
+    """Approved reviews matching ``q``, best match first (full-text on SQLite, see Banana.search)"""
+    query = request.query_params.get('q', '').strip()
+    if not query:
+        return Response({"detail": "q is required"}, status=status.HTTP_400_BAD_REQUEST)
     try:
-        reviews = Review.objects.filter(is_approved=True)
-        serializer = ReviewSerializer(reviews, many=True)
+        _, page_size = pagination.page_params(request.query_params)
+    except pagination.InvalidCursor as exc:
+        return Response({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        rows = search.ranked(_for_review_serializer(Review.objects.filter(is_approved=True)), query)[:page_size]
         return Response({
-            "reviews": serializer.data,
-            "count": reviews.count()
+            "reviews": ReviewSerializer(rows, many=True).data,
+            "query": query,
         }, status=status.HTTP_200_OK)
     except Exception as e:
         return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -938,13 +1028,19 @@ def submit_review(request):
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_user_reviews(request):
-    """Get current user's reviews"""
+    """Current user's reviews, newest first, a page at a time (pass back ``next`` as ``cursor``)"""
+    try:
+        queryset = Review.objects.filter(user=request.user)
+        rows, next_cursor = _review_page(queryset, request)
+    except pagination.InvalidCursor as exc:
+        return Response({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
     try:
-        reviews = Review.objects.filter(user=request.user)
-        serializer = ReviewSerializer(reviews, many=True)
+        # Everything fits on a first page more often than not; count only when it doesn't.
+        whole_list = next_cursor is None and not request.query_params.get('cursor')
         return Response({
-            "reviews": serializer.data,
-            "count": reviews.count()
+            "reviews": ReviewSerializer(rows, many=True).data,
+            "count": len(rows) if whole_list else queryset.count(),
+            "next": next_cursor,
         }, status=status.HTTP_200_OK)
     except Exception as e:
         return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
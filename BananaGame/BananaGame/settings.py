@@ -44,10 +44,29 @@ MIDDLEWARE = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'Banana.authentication.CachedJWTAuthentication',
     ),
 }
 
+# CachedJWTAuthentication keeps each user's profile fields and their Player in this cache
+# for TIMEOUT seconds. locmem is per process, so is_active and the password are then
+# re-read on every request (CHECK_STATE None: auto); use a shared cache so every worker
+# sees invalidations and that query is skipped.
+AUTH_USER_CACHE = {
+    'ALIAS': 'default',
+    'TIMEOUT': 60,
+    'CHECK_STATE': None,
+}
+
+# The opt-in async login/async/ and register/async/ views (ASGI only) hash passwords
+# on a pool of WORKERS threads (None: one per core). Past MAX_PENDING running or queued hashes (None: four per
+# worker) they answer 503 with Retry-After: RETRY_AFTER.
+PASSWORD_HASHING = {
+    'WORKERS': None,
+    'MAX_PENDING': None,
+    'RETRY_AFTER': 1,
+}
+
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:8080",  # Adjust to your frontend URL
 ]
@@ -72,6 +91,12 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'BananaGame.wsgi.application'
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
 # Database
 DATABASES = {
     'default': {
@@ -105,6 +130,9 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+MEDIA_URL = 'media/'
+MEDIA_ROOT = BASE_DIR / 'media'
+
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
@@ -120,9 +148,132 @@ EMAIL_HOST_USER = 'bananabrain021@gmail.com'
 EMAIL_HOST_PASSWORD = 'ymqlwejsgvakbgal'
 DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
 
+# Outgoing mail goes through the Banana.outbox table and is sent in batches by a
+# background job; set ENABLED to False to send inside the request instead.
+# Failed sends are retried after BACKOFF seconds, doubling up to MAX_BACKOFF.
+EMAIL_OUTBOX = {
+    'ENABLED': True,
+    'BATCH_SIZE': 50,
+    'MAX_ATTEMPTS': 5,
+    'BACKOFF': 30,
+    'MAX_BACKOFF': 60 * 60,
+    'LEASE': 5 * 60,
+}
+
+# Login OTPs (Banana.otp): 'cache' keeps hashed codes in CACHE with a TTL of TTL seconds,
+# 'db' keeps them as OTP rows for auditing. locmem is per process; use a shared cache
+# (Redis, Memcached) when running several workers.
+OTP_STORE = {
+    'BACKEND': 'cache',
+    'CACHE': 'default',
+    'TTL': 10 * 60,
+}
+
+# Purge of expired OTP / OutstandingToken / BlacklistedToken rows and of outbox emails
+# sent more than SENT_EMAIL_DAYS ago (Banana.purge): CHUNK_SIZE primary keys per
+# transaction, THROTTLE seconds between chunks.
+# AUTO queues one purge a day from the login view; otherwise run purge_expired_auth.
+AUTH_PURGE = {
+    'CHUNK_SIZE': 1000,
+    'THROTTLE': 0.0,
+    'AUTO': True,
+    'SENT_EMAIL_DAYS': 7,
+}
+
+# Sliding-window budgets for the anonymous endpoints (Banana.throttling), per client IP,
+# per email in the request body, or per username+ip pair (so failed logins from one
+# address can't lock an account for everyone). Rates are 'N/period', e.g. '5/10min'.
+# locmem is per process; use a shared cache to enforce them across workers.
+RATE_LIMITS = {
+    'ENABLED': True,
+    'CACHE': 'default',
+    'RATES': {
+        'login': {'ip': '30/min', 'username+ip': '10/10min'},
+        'otp_request': {'ip': '10/min', 'email': '3/10min'},
+        'otp_verify': {'ip': '30/min', 'email': '10/10min'},
+        'contact': {'ip': '5/10min', 'email': '3/hour'},
+        'search': {'ip': '60/min'},
+    },
+}
+
 
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
     'AUTH_HEADER_TYPES': ('Bearer',),
-}
\ No newline at end of file
+}
+
+# Puzzle source: 'upstream' (external banana API) or 'local' (Banana.puzzlegen)
+PUZZLE_SOURCE = 'upstream'
+PUZZLE_STORE_DIR = MEDIA_ROOT / 'puzzles'
+# Relative by default; set an absolute URL when the frontend is served from another origin
+PUZZLE_STORE_URL = os.environ.get('PUZZLE_STORE_URL', f'/{MEDIA_URL}puzzles/')
+PUZZLE_CORPUS_MANIFEST = BASE_DIR / 'puzzle_corpus.jsonl'
+
+# Daily leaderboard buckets older than this are deleted (kept at least a week for weekly boards)
+LEADERBOARD_BUCKET_RETENTION_DAYS = 14
+
+# Cached /leaderboard/ responses, invalidated when a submitted score enters a top 10.
+# Use a shared cache alias in production so every worker sees the same versions.
+LEADERBOARD_CACHE = {
+    'ENABLED': True,
+    'ALIAS': 'default',
+    'TIMEOUT': 300,
+}
+
+# Rendered top-3 certificates, keyed by username/rank/score/date and LRU-evicted past MAX_BYTES.
+# Kept outside MEDIA_ROOT so certificates are only served through /certificate/.
+CERTIFICATE_CACHE = {
+    'ENABLED': True,
+    'DIR': BASE_DIR / 'certificate_cache',
+    'MAX_BYTES': 50 * 1024 * 1024,
+    # Render the top 3's certificates in the background whenever the top 3 changes
+    'PRERENDER': True,
+}
+# 'inline' renders on the request thread; 'process' uses a pool of WORKERS processes.
+CERTIFICATE_RENDERER = {
+    'BACKEND': 'inline',
+    'WORKERS': 2,
+    'TIMEOUT': 30,
+}
+
+# Background jobs (Banana.jobs): 'thread' runs them on a worker thread, 'immediate' inline
+JOB_RUNNER = 'thread'
+
+# /leaderboard/stream/ server-sent events (ASGI only). At most one push per INTERVAL
+# seconds. BROKER implements Banana.realtime.Broker; the in-process InMemoryBroker is
+# the only one, so each worker streams its own pushes and seq numbers.
+LEADERBOARD_STREAM = {
+    'BROKER': 'Banana.realtime.InMemoryBroker',
+    'INTERVAL': 1.0,
+    'KEEPALIVE': 15.0,
+    'QUEUE_SIZE': 16,
+}
+
+# 'db' keeps the active puzzle in Player.current_puzzle; 'token' hands the client a
+# signed, expiring puzzle token instead (see Banana.puzzle_tokens)
+PUZZLE_STATE_MODE = 'db'
+PUZZLE_TOKEN_MAX_AGE = 15 * 60
+PUZZLE_TOKEN_CACHE = 'default'
+
+# Upstream puzzle API and the per-worker pool of pre-fetched puzzles
+PUZZLE_API_URL = 'https://marcconrad.com/uob/banana/api.php'
+PUZZLE_POOL = {
+    'ENABLED': True,
+    'LOW_WATERMARK': 5,
+    'HIGH_WATERMARK': 20,
+    'REFILL_INTERVAL': 1.0,
+}
+PUZZLE_UPSTREAM = {
+    'CONNECT_TIMEOUT': 2.0,
+    'READ_TIMEOUT': 3.0,
+    'RETRIES': 2,
+    'BACKOFF_BASE': 0.1,
+    'BACKOFF_MAX': 1.0,
+    # Overall limit for one fetch, retries and backoff included
+    'DEADLINE': 5.0,
+    'POOL_CONNECTIONS': 4,
+    'POOL_MAXSIZE': 16,
+    'FAILURE_THRESHOLD': 5,
+    'RESET_TIMEOUT': 30.0,
+}